@@ -1,3 +1,4 @@
+import importlib.util
 import os
 import environ
 import dj_database_url
@@ -45,6 +46,9 @@ AUTH_USER_MODEL = "myapp.CustomUser"
 
 
 MIDDLEWARE = [
+    # First, so its timings include every other middleware
+    "myapp.middleware.MetricsMiddleware",
+    "myapp.middleware.ReplicaReadsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -77,21 +81,161 @@ WSGI_APPLICATION = "django_project.wsgi.application"
 
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
-DATABASES = {
-    "default": dj_database_url.config(
-        default=os.getenv("DATABASE_URL"),
-        conn_max_age=600,
-        ssl_require=True,
+DATABASE_SSL_REQUIRE = os.getenv("DATABASE_SSL_REQUIRE", "True") == "True"
+DATABASE_CONN_MAX_AGE = int(os.getenv("DATABASE_CONN_MAX_AGE", 600))
+# Per statement limit in milliseconds on PostgreSQL, 0 disables it
+DATABASE_STATEMENT_TIMEOUT = int(os.getenv("DATABASE_STATEMENT_TIMEOUT", 30000))
+
+# Connection pool on PostgreSQL, with psycopg 3 and psycopg-pool installed.
+# Each process keeps MIN_SIZE to MAX_SIZE open connections instead of one
+# per thread, checked on checkout; a request waits up to DATABASE_POOL_TIMEOUT
+# seconds for a free one. Connections are replaced after MAX_IDLE seconds
+# unused and MAX_LIFETIME seconds in total. Without the pool, connections
+# persist per thread for DATABASE_CONN_MAX_AGE seconds.
+DATABASE_POOL = os.getenv("DATABASE_POOL", "True") == "True"
+DATABASE_POOL_MIN_SIZE = int(os.getenv("DATABASE_POOL_MIN_SIZE", 2))
+DATABASE_POOL_MAX_SIZE = int(os.getenv("DATABASE_POOL_MAX_SIZE", 10))
+DATABASE_POOL_TIMEOUT = float(os.getenv("DATABASE_POOL_TIMEOUT", 10))
+DATABASE_POOL_MAX_IDLE = float(os.getenv("DATABASE_POOL_MAX_IDLE", 600))
+DATABASE_POOL_MAX_LIFETIME = float(os.getenv("DATABASE_POOL_MAX_LIFETIME", 3600))
+
+
+def _database(url):
+    if not url:
+        return {}
+    config = dj_database_url.parse(
+        url,
+        conn_max_age=DATABASE_CONN_MAX_AGE,
+        conn_health_checks=True,
+        ssl_require=DATABASE_SSL_REQUIRE,
     )
+    if config["ENGINE"] != "django.db.backends.postgresql":
+        return config
+    options = config.setdefault("OPTIONS", {})
+    if DATABASE_STATEMENT_TIMEOUT:
+        options["options"] = f"-c statement_timeout={DATABASE_STATEMENT_TIMEOUT}"
+    # psycopg-pool is optional, and only works with psycopg 3: Django falls
+    # back to psycopg2 when psycopg is missing, and refuses the pool option
+    if (
+        DATABASE_POOL
+        and importlib.util.find_spec("psycopg") is not None
+        and importlib.util.find_spec("psycopg_pool") is not None
+    ):
+        options["pool"] = {
+            "min_size": DATABASE_POOL_MIN_SIZE,
+            "max_size": DATABASE_POOL_MAX_SIZE,
+            "timeout": DATABASE_POOL_TIMEOUT,
+            "max_idle": DATABASE_POOL_MAX_IDLE,
+            "max_lifetime": DATABASE_POOL_MAX_LIFETIME,
+        }
+        # The pool owns the connections: Django must not keep them open
+        config["CONN_MAX_AGE"] = 0
+    return config
+
+
+DATABASES = {"default": _database(os.getenv("DATABASE_URL"))}
+
+# Read replicas, comma separated URLs. Safe requests read from them unless
+# the user wrote within DATABASE_PIN_SECONDS; writes, commands and background
+# work use default. Locally, with a copy of db.sqlite3 standing in as replica:
+# DATABASE_URL=sqlite:///db.sqlite3 DATABASE_REPLICA_URLS=sqlite:///replica.sqlite3
+# DATABASE_SSL_REQUIRE=False
+DATABASE_REPLICAS = []
+for index, url in enumerate(
+    url.strip() for url in os.getenv("DATABASE_REPLICA_URLS", "").split(",")
+):
+    if not url:
+        continue
+    alias = f"replica_{index}"
+    DATABASES[alias] = _database(url)
+    # No test database is created for replicas; run the test suite without
+    # DATABASE_REPLICA_URLS, TestCase data is not visible to other connections
+    DATABASES[alias]["TEST"] = {"MIRROR": "default"}
+    DATABASE_REPLICAS.append(alias)
+
+DATABASE_ROUTERS = ["myapp.db_router.ReplicaRouter"]
+DATABASE_PIN_SECONDS = int(os.getenv("DATABASE_PIN_SECONDS", 5))
+# Pins are kept in this cache, which must be shared by all workers (e.g.
+# Redis): the user's next read may be served by another worker than the write
+DATABASE_PIN_CACHE_ALIAS = os.getenv("DATABASE_PIN_CACHE_ALIAS", "default")
+
+# Cache
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# The local-memory default is per process; with several workers use a shared
+# backend (e.g. Redis) so feed invalidation and user revocation reach all of them
+CACHE_BACKEND = os.getenv(
+    "CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+)
+CACHE_LOCATION = os.getenv("CACHE_LOCATION", "mini-blog")
+
+
+def _cache(name=None, max_entries=None):
+    cache = {"BACKEND": CACHE_BACKEND, "LOCATION": CACHE_LOCATION}
+    if name and CACHE_BACKEND.endswith("LocMemCache"):
+        # A store of its own, and no culling of a third of the entries past
+        # the default MAX_ENTRIES of 300
+        cache["LOCATION"] = f"{CACHE_LOCATION}-{name}"
+        if max_entries:
+            cache["OPTIONS"] = {"MAX_ENTRIES": max_entries}
+    return cache
+
+
+CACHES = {
+    "default": _cache(),
+    # User revocations, apart so that other entries never evict them
+    "auth": _cache("auth", max_entries=1_000_000),
+    # Rate limit buckets, an evicted bucket would start over full
+    "throttle": _cache("throttle", max_entries=1_000_000),
 }
 
 # Custom User Authentication Using JWT
 REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
-        "rest_framework_simplejwt.authentication.JWTAuthentication",
+        "myapp.authentication.ClaimsJWTAuthentication",
     ),
+    # orjson-based, falls back to the stdlib encoder when orjson is missing
+    "DEFAULT_RENDERER_CLASSES": (
+        "myapp.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
+    # Token buckets with the RATE_LIMITS of each view's throttle_scope
+    "DEFAULT_THROTTLE_CLASSES": ("myapp.throttling.TokenBucketThrottle",),
+    # Throttled requests are answered in the response_utils envelope
+    "EXCEPTION_HANDLER": "myapp.throttling.exception_handler",
+    # Client IPs are taken from X-Forwarded-For as appended by this many
+    # trusted proxies in front of the app. With 0, REMOTE_ADDR is used and
+    # the header, which any client can set, is ignored
+    "NUM_PROXIES": int(os.getenv("NUM_PROXIES", 0)),
+}
+
+# Rate limiting (myapp.throttling): a token bucket per user, or per client
+# IP for login and register, and per throttle_scope, held in the
+# RATE_LIMIT_CACHE_ALIAS cache. That cache must be shared by all workers
+# (e.g. Redis): with the local-memory default each process counts on its
+# own, and the limits are multiplied by the number of workers.
+# "<requests>/<second|minute|hour|day>" allows bursts of <requests>, refilled
+# evenly over the period; an empty rate means no limit. Views without a
+# throttle_scope use "default"
+RATE_LIMIT_CACHE_ALIAS = os.getenv("RATE_LIMIT_CACHE_ALIAS", "throttle")
+RATE_LIMITS = {
+    "default": os.getenv("RATE_LIMIT_DEFAULT", "300/min"),
+    "login": os.getenv("RATE_LIMIT_LOGIN", "10/min"),
+    "register": os.getenv("RATE_LIMIT_REGISTER", "5/min"),
+    "feed": os.getenv("RATE_LIMIT_FEED", "120/min"),
+    "search": os.getenv("RATE_LIMIT_SEARCH", "60/min"),
+    "write": os.getenv("RATE_LIMIT_WRITE", "60/min"),
+    "bulk": os.getenv("RATE_LIMIT_BULK", "10/min"),
 }
 
+# Deactivated users are refused through a shared cache of revoked users,
+# with a small per-process LRU in front of it
+AUTH_REVOCATION_CACHE_ALIAS = os.getenv("AUTH_REVOCATION_CACHE_ALIAS", "auth")
+AUTH_REVOCATION_CACHE_SIZE = int(os.getenv("AUTH_REVOCATION_CACHE_SIZE", 10000))
+AUTH_REVOCATION_CACHE_TTL = int(os.getenv("AUTH_REVOCATION_CACHE_TTL", 5))
+# Entries of the shared cache expire and are read from the database again:
+# with a per-process cache, how late other workers see a deactivation
+AUTH_REVOCATION_SHARED_TTL = int(os.getenv("AUTH_REVOCATION_SHARED_TTL", 60))
+
 # JWT Configuration
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(days=1),
@@ -115,6 +259,41 @@ cloudinary.config(**CLOUDINARY_CREDENTIALS)
 
 DEFAULT_FILE_STORAGE = "cloudinary_storage.storage.MediaCloudinaryStorage"
 
+# Post image uploads
+# Use "myapp.image_storage.LocalImageBackend" to store images under MEDIA_ROOT
+IMAGE_STORAGE_BACKEND = os.getenv(
+    "IMAGE_STORAGE_BACKEND", "myapp.image_storage.CloudinaryImageBackend"
+)
+IMAGE_UPLOAD_WORKERS = int(os.getenv("IMAGE_UPLOAD_WORKERS", 4))
+# Upload inline instead of on the thread pool (tests, debugging)
+IMAGE_UPLOAD_EAGER = os.getenv("IMAGE_UPLOAD_EAGER", "False") == "True"
+# Uploads pending for longer were lost with their process (restart, crash):
+# the sweep_uploads command marks them failed so they can be retried
+IMAGE_UPLOAD_STALE_SECONDS = int(os.getenv("IMAGE_UPLOAD_STALE_SECONDS", 900))
+
+# Uploaded images are kept in memory up to IMAGE_UPLOAD_SPOOL_SIZE bytes,
+# larger files are spooled to disk
+IMAGE_UPLOAD_SPOOL_SIZE = int(os.getenv("IMAGE_UPLOAD_SPOOL_SIZE", 1024 * 1024))
+IMAGE_UPLOAD_MAX_FILE_SIZE = int(
+    os.getenv("IMAGE_UPLOAD_MAX_FILE_SIZE", 10 * 1024 * 1024)
+)
+IMAGE_UPLOAD_MAX_REQUEST_SIZE = int(
+    os.getenv("IMAGE_UPLOAD_MAX_REQUEST_SIZE", 50 * 1024 * 1024)
+)
+
+# Images are re-encoded without metadata and resized before storage
+IMAGE_MAX_DIMENSIONS = (6000, 6000)
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "WEBP")  # or "JPEG"
+IMAGE_OUTPUT_QUALITY = int(os.getenv("IMAGE_OUTPUT_QUALITY", 80))
+IMAGE_VARIANT_SIZES = {
+    "thumbnail": 150,
+    "small": 480,
+    "medium": 1080,
+}
+
+MEDIA_ROOT = BASE_DIR / "media"
+MEDIA_URL = "media/"
+
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
 
@@ -134,6 +313,41 @@ AUTH_PASSWORD_VALIDATORS = [
 ]
 
 
+# Password hashing
+# https://docs.djangoproject.com/en/5.1/topics/auth/passwords/
+# The first hasher hashes new passwords; the others still verify old hashes,
+# which are upgraded on the next successful login.
+PASSWORD_HASHER_POLICY = os.getenv("PASSWORD_HASHER_POLICY", "scrypt")
+
+PASSWORD_SCRYPT_WORK_FACTOR = int(os.getenv("PASSWORD_SCRYPT_WORK_FACTOR", 2**14))
+PASSWORD_SCRYPT_BLOCK_SIZE = int(os.getenv("PASSWORD_SCRYPT_BLOCK_SIZE", 8))
+PASSWORD_SCRYPT_PARALLELISM = int(os.getenv("PASSWORD_SCRYPT_PARALLELISM", 1))
+
+PASSWORD_ARGON2_TIME_COST = int(os.getenv("PASSWORD_ARGON2_TIME_COST", 2))
+PASSWORD_ARGON2_MEMORY_COST = int(os.getenv("PASSWORD_ARGON2_MEMORY_COST", 19456))
+PASSWORD_ARGON2_PARALLELISM = int(os.getenv("PASSWORD_ARGON2_PARALLELISM", 1))
+
+_PASSWORD_HASHERS = {
+    "scrypt": "myapp.hashers.TunedScryptPasswordHasher",
+    "pbkdf2": "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+}
+# argon2-cffi is optional
+if importlib.util.find_spec("argon2") is not None:
+    _PASSWORD_HASHERS["argon2"] = "myapp.hashers.TunedArgon2PasswordHasher"
+
+PASSWORD_HASHERS = list(
+    dict.fromkeys(
+        [_PASSWORD_HASHERS.get(PASSWORD_HASHER_POLICY, _PASSWORD_HASHERS["scrypt"])]
+        + list(_PASSWORD_HASHERS.values())
+    )
+)
+
+# Password checks run in a bounded process pool, 0 runs them inline
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+PASSWORD_HASH_MAX_PENDING = int(os.getenv("PASSWORD_HASH_MAX_PENDING", 32))
+PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv("PASSWORD_HASH_QUEUE_TIMEOUT", 5))
+
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
@@ -155,3 +369,71 @@ STATIC_URL = "static/"
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Post feed pagination
+FEED_PAGE_SIZE = int(os.getenv("FEED_PAGE_SIZE", 20))
+FEED_MAX_PAGE_SIZE = int(os.getenv("FEED_MAX_PAGE_SIZE", 100))
+FEED_STREAM_CHUNK_SIZE = int(os.getenv("FEED_STREAM_CHUNK_SIZE", 200))
+FEED_MAX_COMMENTS_LIMIT = int(os.getenv("FEED_MAX_COMMENTS_LIMIT", 50))
+
+# Post feed cache, pages are invalidated by bumping a generation counter
+FEED_CACHE_ALIAS = os.getenv("FEED_CACHE_ALIAS", "default")
+FEED_CACHE_TIMEOUT = int(os.getenv("FEED_CACHE_TIMEOUT", 300))
+# A per-process cache never hears of writes made by other workers: there the
+# generation expires after this many seconds, bounding how long their pages
+# and ETags (304 answers) stay stale. A shared cache keeps it forever
+FEED_GENERATION_TTL = int(os.getenv("FEED_GENERATION_TTL", 30))
+
+# Bulk create endpoints: items per request and rows per transaction
+BULK_MAX_ITEMS = int(os.getenv("BULK_MAX_ITEMS", 1000))
+BULK_BATCH_SIZE = int(os.getenv("BULK_BATCH_SIZE", 200))
+
+# Change log behind posts/changes/: tombstones are kept this long, and the
+# newest seconds are held back until concurrent transactions have committed.
+# Entries are stamped when inserted, not when committed: a transaction open
+# longer than the settle window commits entries below tokens already handed
+# out, and clients syncing from those tokens never see them. Keep it well
+# above the slowest writing transaction (and DATABASE_STATEMENT_TIMEOUT)
+CHANGES_RETENTION_DAYS = int(os.getenv("CHANGES_RETENTION_DAYS", 30))
+CHANGES_SETTLE_SECONDS = float(os.getenv("CHANGES_SETTLE_SECONDS", 60))
+
+# Home timelines are materialized on write, the trim_timelines command keeps
+# the newest TIMELINE_MAX_ENTRIES posts of each
+TIMELINE_MAX_ENTRIES = int(os.getenv("TIMELINE_MAX_ENTRIES", 800))
+
+# Background tasks (myapp.tasks): jobs are stored in the database and queued
+# after commit. TASKS_WORKERS threads per process drain them right away; the
+# run_tasks command runs the rest (retries, jobs of crashed processes) and
+# can take over entirely with TASKS_WORKERS=0. Run inline with TASKS_EAGER.
+TASKS_EAGER = os.getenv("TASKS_EAGER", "False") == "True"
+TASKS_WORKERS = int(os.getenv("TASKS_WORKERS", 2))
+TASKS_BATCH_SIZE = int(os.getenv("TASKS_BATCH_SIZE", 20))
+TASKS_MAX_ATTEMPTS = int(os.getenv("TASKS_MAX_ATTEMPTS", 5))
+# Retries wait base * 2^(attempt - 1) seconds, up to the max
+TASKS_RETRY_BASE_SECONDS = float(os.getenv("TASKS_RETRY_BASE_SECONDS", 2))
+TASKS_RETRY_MAX_SECONDS = float(os.getenv("TASKS_RETRY_MAX_SECONDS", 600))
+# A running job is given to another worker when its lease runs out
+TASKS_LEASE_SECONDS = int(os.getenv("TASKS_LEASE_SECONDS", 300))
+TASKS_RETENTION_DAYS = int(os.getenv("TASKS_RETENTION_DAYS", 7))
+
+# metrics/ endpoint, behind this bearer token. Without one it is only served
+# in DEBUG, and answers 404 otherwise
+METRICS_TOKEN = os.getenv("METRICS_TOKEN", "")
+
+# Logging, LOG_FORMAT is "json" (one object per line) or "text"
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "json": {"()": "myapp.log_formatters.JSONFormatter"},
+        "text": {"format": "%(asctime)s %(levelname)s %(name)s %(message)s"},
+    },
+    "handlers": {
+        "console": {"class": "logging.StreamHandler", "formatter": LOG_FORMAT},
+    },
+    "loggers": {
+        "myapp": {"handlers": ["console"], "level": LOG_LEVEL, "propagate": False},
+    },
+}
@@ -4,11 +4,28 @@ from . import views
 from myapp.views import (
     CreatePostView,
     CommentOnPostView,
+    BulkCreatePostsView,
+    BulkCommentOnPostView,
     # GetPostsView,
     GetPostWithCommentsView,
+    SearchPostsView,
+    PostChangesView,
+    UserPostsView,
+    HomeTimelineView,
+    FollowUserView,
     UpdatePostView,
     DeletePostView,
     DeleteCommentView,
+    metrics_view,
+)
+
+from myapp.async_views import (
+    AsyncCreatePostView,
+    AsyncCommentOnPostView,
+    AsyncGetPostWithCommentsView,
+    AsyncUpdatePostView,
+    AsyncDeletePostView,
+    AsyncDeleteCommentView,
 )
 
 from myapp.auth import (
@@ -21,6 +38,7 @@ urlpatterns = [
     path("admin/", admin.site.urls),
     path("", views.homepage),
     path("about/", views.about),
+    path("metrics/", metrics_view, name="metrics"),
     path("register/", RegisterView.as_view(), name="register"),
     path("login/", LoginView.as_view(), name="login"),
     path("posts/", CreatePostView.as_view(), name="create_post"),
@@ -29,13 +47,53 @@ urlpatterns = [
         CommentOnPostView.as_view(),
         name="comment_on_post",
     ),
+    path("posts/bulk/", BulkCreatePostsView.as_view(), name="bulk_create_posts"),
+    path(
+        "posts/<int:post_id>/comments/bulk/",
+        BulkCommentOnPostView.as_view(),
+        name="bulk_comment_on_post",
+    ),
     # path("posts/all/", GetPostsView.as_view(), name="get_all_posts"),
     path(
         "posts/all/",
         GetPostWithCommentsView.as_view(),
         name="get_post_with_comments",
     ),
+    path("posts/search/", SearchPostsView.as_view(), name="search_posts"),
+    path("posts/changes/", PostChangesView.as_view(), name="post_changes"),
+    path("users/<uuid:user_id>/posts/", UserPostsView.as_view(), name="user_posts"),
+    path(
+        "users/<uuid:user_id>/follow/", FollowUserView.as_view(), name="follow_user"
+    ),
+    path("timeline/", HomeTimelineView.as_view(), name="home_timeline"),
     path("posts/<int:pk>/update/", UpdatePostView.as_view(), name="update_post"),
     path("posts/<int:pk>/delete/", DeletePostView.as_view(), name="delete_post"),
     path("posts/<int:pk>/", DeleteCommentView.as_view(), name="delete_comment"),
+    # ASGI-native versions of the endpoints above
+    path("async/posts/", AsyncCreatePostView.as_view(), name="async_create_post"),
+    path(
+        "async/posts/<int:post_id>/comment/",
+        AsyncCommentOnPostView.as_view(),
+        name="async_comment_on_post",
+    ),
+    path(
+        "async/posts/all/",
+        AsyncGetPostWithCommentsView.as_view(),
+        name="async_get_post_with_comments",
+    ),
+    path(
+        "async/posts/<int:pk>/update/",
+        AsyncUpdatePostView.as_view(),
+        name="async_update_post",
+    ),
+    path(
+        "async/posts/<int:pk>/delete/",
+        AsyncDeletePostView.as_view(),
+        name="async_delete_post",
+    ),
+    path(
+        "async/posts/<int:pk>/",
+        AsyncDeleteCommentView.as_view(),
+        name="async_delete_comment",
+    ),
 ]
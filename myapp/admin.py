@@ -1,6 +1,22 @@
 from django.contrib import admin
-from .models import CustomUser, Post, Comment
+from .models import CustomUser, Post, Comment, PostImage
 
 admin.site.register(CustomUser)
-admin.site.register(Post)
-admin.site.register(Comment)
+
+
+@admin.register(Post)
+class PostAdmin(admin.ModelAdmin):
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_relations()
+
+
+@admin.register(Comment)
+class CommentAdmin(admin.ModelAdmin):
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_relations()
+
+
+@admin.register(PostImage)
+class PostImageAdmin(admin.ModelAdmin):
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_relations()
@@ -0,0 +1,300 @@
+# myapp/async_views.py
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework import status
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import feed_cache, throttling
+from .authentication import ais_revoked, user_from_claims
+from .db_router import amark_recent_write, apin_if_recent_write
+from .image_uploads import schedule_uploads
+from .models import Comment, CustomUser, Post
+from .pagination import apaginate, get_comments_limit, get_page_size
+from .read_serializers import aserialize_feed, feed_posts
+from .renderers import dumps, render_envelope
+from .response_utils import (
+    bad_request_response,
+    error_response,
+    not_found_response,
+    success_response,
+    too_many_requests_response,
+    unauthorized_response,
+)
+from .serializers import CommentSerializer, PostSerializer
+from .upload_handlers import StreamingUploadHandler, UploadTooLarge
+from .views import GetPostWithCommentsView, not_modified, set_validators
+
+
+def envelope(data, status_code=status.HTTP_200_OK):
+    return HttpResponse(
+        dumps(data), status=status_code, content_type="application/json"
+    )
+
+
+async def authenticate(request):
+    """
+    Resolve the user of a `Bearer <access token>` header, None if the token
+    is missing, invalid or belongs to an inactive user.
+    """
+    header = request.headers.get("Authorization", "")
+    parts = header.split()
+    if len(parts) != 2 or parts[0] not in api_settings.AUTH_HEADER_TYPES:
+        return None
+    try:
+        token = AccessToken(parts[1])
+    except TokenError:
+        return None
+    try:
+        user = user_from_claims(token)
+    except InvalidToken:
+        return None
+    if user is not None:
+        # Fast path, no query: the user comes from the token claims
+        if await ais_revoked(user.user_id):
+            return None
+    else:
+        user_id = token.get(api_settings.USER_ID_CLAIM)
+        user = await CustomUser.objects.filter(user_id=user_id, is_active=True).afirst()
+        if user is None:
+            return None
+    await apin_if_recent_write(user.pk)
+    return user
+
+
+def parse_body(request):
+    """
+    Request data as a dict, from a JSON body or a (multipart) form.
+    """
+    if request.content_type == "application/json":
+        return json.loads(request.body or b"{}")
+    data = request.POST.dict()
+    for name in request.FILES:
+        data[name] = request.FILES.getlist(name)
+    return data
+
+
+@sync_to_async
+def validate_body(request, serializer_class, *args, **kwargs):
+    """
+    A `serializer_class` of the request body, validated. Off the event loop:
+    reading the upload and checking images block.
+    """
+    serializer = serializer_class(*args, data=parse_body(request), **kwargs)
+    serializer.is_valid()
+    return serializer
+
+
+@method_decorator(csrf_exempt, name="dispatch")
+class AsyncAPIView(View):
+    """
+    Async view that requires a JWT authenticated user, like the
+    IsAuthenticated APIViews, rate limited the same way. Under ASGI a
+    request waiting on the database does not hold a thread; the few sync
+    steps run through sync_to_async.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        request.user = await authenticate(request)
+        if request.user is None:
+            return envelope(
+                unauthorized_response("Authentication credentials were not provided"),
+                status_code=status.HTTP_401_UNAUTHORIZED,
+            )
+        wait = await throttling.atake(
+            throttling.get_scope(self), throttling.get_ident(request, self)
+        )
+        if wait is not None:
+            response = envelope(
+                too_many_requests_response(),
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            )
+            response["Retry-After"] = throttling.retry_after(wait)
+            return response
+        try:
+            return await super().dispatch(request, *args, **kwargs)
+        except (ValueError, UnicodeDecodeError) as e:
+            return envelope(
+                bad_request_response(str(e)), status_code=status.HTTP_400_BAD_REQUEST
+            )
+
+
+class AsyncCreatePostView(AsyncAPIView):
+    throttle_scope = "write"
+
+    async def post(self, request):
+        request.upload_handlers = [StreamingUploadHandler(request)]
+        try:
+            post_serializer = await validate_body(
+                request, PostSerializer, context={"request": request}
+            )
+        except UploadTooLarge as e:
+            return envelope(
+                error_response(e.detail, message="Upload too large"),
+                status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+        if post_serializer.errors:
+            return envelope(
+                error_response(post_serializer.errors),
+                status_code=status.HTTP_400_BAD_REQUEST,
+            )
+
+        images = post_serializer.validated_data.pop("images", [])
+        post = await Post.objects.acreate(
+            author=request.user, **post_serializer.validated_data
+        )
+        # Uploads run on the upload thread pool, only the rows are written here
+        await sync_to_async(schedule_uploads)(post, images)
+        await amark_recent_write(request.user.pk)
+        data = await sync_to_async(lambda: PostSerializer(post).data)()
+        return envelope(
+            success_response(data, message="post created successfully"),
+            status_code=status.HTTP_201_CREATED,
+        )
+
+
+class AsyncCommentOnPostView(AsyncAPIView):
+    throttle_scope = "write"
+
+    async def post(self, request, post_id):
+        post = await Post.objects.filter(id=post_id).only("id").afirst()
+        if post is None:
+            return envelope(
+                not_found_response("Post not found"),
+                status_code=status.HTTP_404_NOT_FOUND,
+            )
+
+        serializer = await validate_body(request, CommentSerializer)
+        if serializer.errors:
+            return envelope(
+                bad_request_response(serializer.errors),
+                status_code=status.HTTP_400_BAD_REQUEST,
+            )
+
+        comment = await Comment.objects.acreate(
+            post=post, user=request.user, **serializer.validated_data
+        )
+        await amark_recent_write(request.user.pk)
+        return envelope(
+            success_response(CommentSerializer(comment).data),
+            status_code=status.HTTP_201_CREATED,
+        )
+
+
+class AsyncGetPostWithCommentsView(AsyncAPIView):
+    message = GetPostWithCommentsView.message
+    throttle_scope = GetPostWithCommentsView.throttle_scope
+
+    async def get(self, request):
+        cursor = request.GET.get("cursor")
+        page_size = get_page_size(request.GET.get("page_size"))
+        comments_limit = get_comments_limit(request.GET.get("comments_limit"))
+        etag, last_modified = await feed_cache.aget_validators(
+            cursor, page_size, comments_limit
+        )
+        response = not_modified(request, etag, last_modified)
+        if response is not None:
+            return response
+
+        async def build_page():
+            rows, next_cursor = await apaginate(feed_posts(), cursor, page_size)
+            data = await aserialize_feed(rows, comments_limit)
+            # Cached already encoded, a hit is served without serializing
+            return render_envelope(data, self.message, next_cursor=next_cursor)
+
+        payload = await feed_cache.aget_page(
+            cursor, page_size, comments_limit, build_page, fmt="json"
+        )
+        return set_validators(
+            HttpResponse(payload, content_type="application/json"),
+            etag,
+            last_modified,
+        )
+
+
+class AsyncUpdatePostView(AsyncAPIView):
+    throttle_scope = "write"
+
+    async def patch(self, request, pk):
+        post = await Post.objects.with_relations().filter(pk=pk).afirst()
+        if post is None:
+            return envelope(
+                not_found_response("Post not found"),
+                status_code=status.HTTP_404_NOT_FOUND,
+            )
+        if post.author_id != request.user.pk:
+            return envelope(
+                unauthorized_response("You are not authorized to perform this action"),
+                status_code=status.HTTP_403_FORBIDDEN,
+            )
+
+        post_serializer = await validate_body(
+            request, PostSerializer, post, context={"request": request}, partial=True
+        )
+        if post_serializer.errors:
+            return envelope(
+                bad_request_response(post_serializer.errors),
+                status_code=status.HTTP_400_BAD_REQUEST,
+            )
+
+        post_serializer.validated_data.pop("images", None)
+        for field, value in post_serializer.validated_data.items():
+            setattr(post, field, value)
+        await post.asave()
+        await amark_recent_write(request.user.pk)
+        data = await sync_to_async(lambda: PostSerializer(post).data)()
+        return envelope(success_response(data, message="Post Updated"))
+
+
+class AsyncDeletePostView(AsyncAPIView):
+    throttle_scope = "write"
+
+    async def delete(self, request, pk):
+        post = await Post.objects.with_relations().filter(pk=pk).afirst()
+        if post is None:
+            return envelope(
+                not_found_response("Post not found"),
+                status_code=status.HTTP_404_NOT_FOUND,
+            )
+        if post.author_id != request.user.pk:
+            return envelope(
+                unauthorized_response("You are not authorized to perform this action"),
+                status_code=status.HTTP_403_FORBIDDEN,
+            )
+
+        await post.adelete()
+        await amark_recent_write(request.user.pk)
+        return envelope(
+            success_response(data=None, message="Post deleted successfully"),
+            status_code=status.HTTP_204_NO_CONTENT,
+        )
+
+
+class AsyncDeleteCommentView(AsyncAPIView):
+    throttle_scope = "write"
+
+    async def delete(self, request, pk):
+        comment = await Comment.objects.with_relations().filter(pk=pk).afirst()
+        if comment is None:
+            return envelope(
+                not_found_response("Comment not found"),
+                status_code=status.HTTP_404_NOT_FOUND,
+            )
+        if comment.user_id != request.user.pk:
+            return envelope(
+                unauthorized_response("You are not authorized to perform this action"),
+                status_code=status.HTTP_403_FORBIDDEN,
+            )
+
+        await comment.adelete()
+        await amark_recent_write(request.user.pk)
+        return envelope(
+            success_response(data=None, message="Comment deleted successfully"),
+            status_code=status.HTTP_204_NO_CONTENT,
+        )
@@ -1,20 +1,40 @@
-from django.contrib.auth.hashers import make_password
+import logging
+
 from rest_framework import status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
+from .authentication import add_user_claims
 from .models import CustomUser
+from .passwords import PasswordPoolBusy, hash_password, verify_user_password
 from .serializers import CustomUserSerializer
 from .response_utils import (
     success_response,
+    internal_server_error_response,
 )
 
+logger = logging.getLogger(__name__)
+
+
+def password_pool_busy_response():
+    return Response(
+        internal_server_error_response("Server busy, please try again"),
+        status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        headers={"Retry-After": "1"},
+    )
+
 
 class RegisterView(APIView):
+    throttle_scope = "register"
+    throttle_per_ip = True
+
     def post(self, request):
         serializer = CustomUserSerializer(data=request.data)
         if serializer.is_valid():
-            password = make_password(serializer.validated_data["password"])
+            try:
+                password = hash_password(serializer.validated_data["password"])
+            except PasswordPoolBusy:
+                return password_pool_busy_response()
             user = serializer.save(password=password)
 
             return Response(
@@ -27,6 +47,9 @@ class RegisterView(APIView):
 
 
 class LoginView(APIView):
+    throttle_scope = "login"
+    throttle_per_ip = True
+
     def post(self, request):
         email = request.data.get("email")
         password = request.data.get("password")
@@ -38,13 +61,19 @@ class LoginView(APIView):
                 {"error": "User not found"}, status=status.HTTP_404_NOT_FOUND
             )
 
-        print(f"User found: {user.email}")
+        logger.debug("Login attempt", extra={"user_id": str(user.user_id)})
+
+        try:
+            # Verified in the password pool, outdated hashes are upgraded
+            is_correct = verify_user_password(user, password)
+        except PasswordPoolBusy:
+            return password_pool_busy_response()
 
-        if user and user.check_password(password):
+        if is_correct:
             refresh = RefreshToken.for_user(user)
 
-            # Explicitly add user_id to the token
-            refresh["user_id"] = str(user.user_id)  # Convert UUID to string
+            # Explicitly add user_id and the user claims to the token
+            add_user_claims(refresh, user)
             data = {
                 "refresh": str(refresh),
                 "access": str(refresh.access_token),
@@ -0,0 +1,175 @@
+# myapp/authentication.py
+import time
+import uuid
+from collections import OrderedDict
+from threading import Lock
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+from .db_router import pin_if_recent_write
+from .models import CustomUser, TokenUser
+
+# Claims copied from the user into every token, see add_user_claims()
+CLAIMS = ("email", "is_staff")
+
+
+def add_user_claims(token, user):
+    """
+    Put the user fields the API needs into the token, so authenticated
+    requests can be served without loading the user.
+    """
+    token["user_id"] = str(user.user_id)  # Convert UUID to string
+    for claim in CLAIMS:
+        token[claim] = getattr(user, claim)
+    return token
+
+
+def revoked_key(user_id):
+    return f"auth:revoked:{user_id}"
+
+
+class RevocationCache:
+    """
+    Small per-process LRU with a TTL in front of the shared cache of whether
+    users are revoked (deactivated or deleted), itself backed by the
+    database. Entries for users saved in this process are dropped right
+    away, other processes see the change within the TTL.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self.entries.move_to_end(user_id)
+                return entry[0]
+        return None
+
+    def set(self, user_id, revoked):
+        with self.lock:
+            self.entries[user_id] = (revoked, time.monotonic() + self.ttl)
+            self.entries.move_to_end(user_id)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.entries.pop(user_id, None)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+revocations = RevocationCache(
+    maxsize=settings.AUTH_REVOCATION_CACHE_SIZE,
+    ttl=settings.AUTH_REVOCATION_CACHE_TTL,
+)
+
+
+def get_shared_cache():
+    return caches[settings.AUTH_REVOCATION_CACHE_ALIAS]
+
+
+def load_revoked(user_id):
+    """
+    Whether a user is deactivated or deleted, from the database: the shared
+    cache may have lost the entry (eviction, restart).
+    """
+    return not CustomUser.objects.filter(user_id=user_id, is_active=True).exists()
+
+
+async def aload_revoked(user_id):
+    return not await CustomUser.objects.filter(
+        user_id=user_id, is_active=True
+    ).aexists()
+
+
+def is_revoked(user_id):
+    revoked = revocations.get(user_id)
+    if revoked is None:
+        revoked = get_shared_cache().get(revoked_key(user_id))
+        if revoked is None:
+            revoked = load_revoked(user_id)
+            get_shared_cache().set(
+                revoked_key(user_id),
+                revoked,
+                timeout=settings.AUTH_REVOCATION_SHARED_TTL,
+            )
+        revocations.set(user_id, revoked)
+    return revoked
+
+
+async def ais_revoked(user_id):
+    revoked = revocations.get(user_id)
+    if revoked is None:
+        revoked = await get_shared_cache().aget(revoked_key(user_id))
+        if revoked is None:
+            revoked = await aload_revoked(user_id)
+            await get_shared_cache().aset(
+                revoked_key(user_id),
+                revoked,
+                timeout=settings.AUTH_REVOCATION_SHARED_TTL,
+            )
+        revocations.set(user_id, revoked)
+    return revoked
+
+
+def set_revoked(user_id, revoked):
+    """
+    Record whether tokens of a user must be refused. The database stays the
+    source of truth, a lost entry is read from it again.
+    """
+    get_shared_cache().set(
+        revoked_key(user_id), revoked, timeout=settings.AUTH_REVOCATION_SHARED_TTL
+    )
+    revocations.invalidate(user_id)
+
+
+def user_from_claims(validated_token):
+    """
+    TokenUser for a token carrying our claims, None for older tokens that
+    do not have them.
+    """
+    if any(claim not in validated_token for claim in CLAIMS):
+        return None
+    try:
+        user_id = uuid.UUID(str(validated_token[api_settings.USER_ID_CLAIM]))
+    except (KeyError, ValueError):
+        raise InvalidToken(_("Token contained no recognizable user identification"))
+    return TokenUser.from_claims(
+        user_id,
+        email=validated_token["email"],
+        is_staff=validated_token["is_staff"],
+    )
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """
+    JWT authentication that builds the user from the token claims instead of
+    loading it from the database. Deactivated and deleted users are refused
+    through the revocation cache. Tokens issued without the claims fall back
+    to the database lookup. Users who wrote recently have their reads
+    pinned to the primary database.
+    """
+
+    def get_user(self, validated_token):
+        user = user_from_claims(validated_token)
+        if user is None:
+            user = super().get_user(validated_token)
+        elif is_revoked(user.user_id):
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+        pin_if_recent_write(user.pk)
+        return user
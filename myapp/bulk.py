@@ -0,0 +1,75 @@
+# myapp/bulk.py
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+
+from . import changes, feed_cache, search, timelines
+from .models import Change, Comment, Post
+
+
+def batches(items, size):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def item_errors(errors):
+    """
+    Per-item errors of a `many=True` serializer, as a list of
+    {"index", "errors"} entries. Valid items have no entry.
+    """
+    if isinstance(errors, dict):
+        # Depending on the DRF version errors come keyed by index, or as
+        # non_field_errors when the payload itself is invalid
+        if not all(isinstance(index, int) for index in errors):
+            return errors
+        errors = [errors.get(index) for index in range(max(errors) + 1)]
+    return [{"index": index, "errors": e} for index, e in enumerate(errors) if e]
+
+
+def create_posts(author, items):
+    """
+    Insert posts with bulk_create, one transaction per BULK_BATCH_SIZE rows.
+    bulk_create sends no signals, so the search index, the change log, the
+    timelines and the feed cache are updated here.
+    """
+    posts = []
+    for batch in batches(items, settings.BULK_BATCH_SIZE):
+        with transaction.atomic():
+            created = Post.objects.bulk_create(
+                [Post(author=author, **item) for item in batch]
+            )
+            search.index_many(
+                search.POST,
+                [(post.id, post.id, post.title, post.content) for post in created],
+            )
+            changes.record_many(Change.POST, [(post.id, post.id) for post in created])
+            timelines.schedule_fan_out([post.id for post in created])
+            transaction.on_commit(feed_cache.bump_generation)
+        posts += created
+    return posts
+
+
+def create_comments(post, user, items):
+    """
+    Insert comments on `post` with bulk_create, one transaction per
+    BULK_BATCH_SIZE rows, keeping the post's comment_count in step.
+    """
+    comments = []
+    for batch in batches(items, settings.BULK_BATCH_SIZE):
+        with transaction.atomic():
+            created = Comment.objects.bulk_create(
+                [Comment(post=post, user=user, **item) for item in batch]
+            )
+            Post.objects.filter(pk=post.pk).update(
+                comment_count=F("comment_count") + len(created)
+            )
+            search.index_many(
+                search.COMMENT,
+                [(comment.id, post.pk, "", comment.content) for comment in created],
+            )
+            changes.record_many(
+                Change.COMMENT, [(comment.id, post.pk) for comment in created]
+            )
+            transaction.on_commit(feed_cache.bump_generation)
+        comments += created
+    return comments
@@ -0,0 +1,187 @@
+# myapp/changes.py
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from .models import Change, Comment, Post, PostImage
+from .pagination import InvalidCursor, decode_cursor, encode_cursor
+from .read_serializers import (
+    COMMENT_FIELDS,
+    IMAGE_FIELDS,
+    POST_FIELDS,
+    serialize_comment,
+    serialize_image,
+    serialize_post,
+)
+
+
+class SyncTokenExpired(InvalidCursor):
+    """
+    The token is older than CHANGES_RETENTION_DAYS, deletions it would need
+    may have been compacted away: the client has to sync from scratch.
+    """
+
+
+def record(kind, object_id, post_id, action=Change.UPSERT):
+    Change.objects.create(
+        kind=kind, object_id=object_id, post_id=post_id, action=action
+    )
+
+
+def record_many(kind, rows, action=Change.UPSERT):
+    """
+    Log many objects at once, `rows` are (object_id, post_id) pairs. Used
+    with bulk_create, which sends no post_save signals.
+    """
+    Change.objects.bulk_create(
+        [
+            Change(kind=kind, object_id=object_id, post_id=post_id, action=action)
+            for object_id, post_id in rows
+        ]
+    )
+
+
+def record_post_deleted(post_id):
+    """
+    Log the deletion of a post and of its comments and images in a single
+    statement, instead of one insert per cascaded row.
+    """
+    table = Change._meta.db_table
+    now = connection.ops.adapt_datetimefield_value(timezone.now())
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {table} (kind, object_id, post_id, action, created_at) "
+            f"SELECT %s, id, post_id, %s, %s FROM {Comment._meta.db_table} "
+            "WHERE post_id = %s "
+            "UNION ALL "
+            f"SELECT %s, id, post_id, %s, %s FROM {PostImage._meta.db_table} "
+            "WHERE post_id = %s "
+            "UNION ALL SELECT %s, %s, %s, %s, %s",
+            [
+                Change.COMMENT,
+                Change.DELETE,
+                now,
+                post_id,
+                Change.IMAGE,
+                Change.DELETE,
+                now,
+                post_id,
+                Change.POST,
+                post_id,
+                post_id,
+                Change.DELETE,
+                now,
+            ],
+        )
+
+
+def decode_token(since):
+    created_at, change_id = decode_cursor(since)
+    retention = timedelta(days=settings.CHANGES_RETENTION_DAYS)
+    if created_at < timezone.now() - retention:
+        raise SyncTokenExpired("Sync token expired, sync again without since")
+    return change_id
+
+
+def fetch_objects(ids_by_kind):
+    """
+    Current representation of the changed objects, {(kind, id): data}.
+    """
+    querysets = {
+        Change.POST: (
+            Post.objects.values_list(*POST_FIELDS, named=True),
+            serialize_post,
+        ),
+        Change.COMMENT: (
+            Comment.objects.values_list(*COMMENT_FIELDS, named=True),
+            serialize_comment,
+        ),
+        Change.IMAGE: (
+            PostImage.objects.values_list(*IMAGE_FIELDS, named=True),
+            lambda row: dict(serialize_image(row), post=row.post_id),
+        ),
+    }
+    objects = {}
+    for kind, ids in ids_by_kind.items():
+        queryset, serialize = querysets[kind]
+        for row in queryset.filter(id__in=ids):
+            objects[kind, row.id] = serialize(row)
+    return objects
+
+
+def get_changes(since, page_size):
+    """
+    One page of changes after the `since` token, oldest first, as
+    (items, next token, has_more). Upserts carry the object as it is now.
+    """
+    changes = Change.objects.order_by("id")
+    last_id = 0
+    if since:
+        last_id = decode_token(since)
+        changes = changes.filter(id__gt=last_id)
+    # Leave out the last moments: a transaction that took an earlier id may
+    # not be committed yet, and a token past it would skip it for good. This
+    # assumes no writing transaction stays open longer than the window,
+    # created_at is its insert time, not its commit time
+    settled = timezone.now() - timedelta(seconds=settings.CHANGES_SETTLE_SECONDS)
+    changes = changes.filter(created_at__lte=settled)
+
+    rows = list(
+        changes.values_list(
+            "id", "kind", "object_id", "post_id", "action", "created_at", named=True
+        )[: page_size + 1]
+    )
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+
+    # Only the newest entry of each object in the page counts
+    latest = {}
+    for row in rows:
+        latest.pop((row.kind, row.object_id), None)
+        latest[row.kind, row.object_id] = row
+
+    ids_by_kind = {}
+    for row in latest.values():
+        if row.action == Change.UPSERT:
+            ids_by_kind.setdefault(row.kind, []).append(row.object_id)
+    objects = fetch_objects(ids_by_kind)
+
+    items = []
+    for (kind, object_id), row in latest.items():
+        data = objects.get((kind, object_id))
+        items.append(
+            {
+                "type": kind,
+                "id": object_id,
+                "post_id": row.post_id,
+                # Deleted after this entry was logged, its tombstone follows
+                "action": Change.UPSERT if data is not None else Change.DELETE,
+                "data": data,
+            }
+        )
+
+    if rows:
+        last_id = rows[-1].id
+    # A caught up client gets a fresh token, so polling keeps it from expiring
+    token_time = rows[-1].created_at if has_more else settled
+    return items, encode_cursor(token_time, last_id), has_more
+
+
+def compact():
+    """
+    Delete entries superseded by a newer entry of the same object, and
+    tombstones older than CHANGES_RETENTION_DAYS. Returns the number of
+    deleted entries.
+    """
+    newer = Change.objects.filter(
+        kind=OuterRef("kind"), object_id=OuterRef("object_id"), id__gt=OuterRef("id")
+    )
+    superseded, _ = Change.objects.filter(Exists(newer)).delete()
+    cutoff = timezone.now() - timedelta(days=settings.CHANGES_RETENTION_DAYS)
+    expired, _ = Change.objects.filter(
+        action=Change.DELETE, created_at__lt=cutoff
+    ).delete()
+    return superseded + expired
@@ -0,0 +1,81 @@
+# myapp/checks.py
+from django.conf import settings
+from django.core.checks import Warning, register
+
+PER_PROCESS_BACKENDS = ("django.core.cache.backends.locmem.LocMemCache",)
+
+# Settings naming a cache that every worker must share: check id, and what
+# goes wrong when each process has its own
+SHARED_CACHES = {
+    "AUTH_REVOCATION_CACHE_ALIAS": (
+        "myapp.W001",
+        "a deactivated user's tokens keep working on other workers for up "
+        "to AUTH_REVOCATION_SHARED_TTL seconds",
+    ),
+    "FEED_CACHE_ALIAS": (
+        "myapp.W002",
+        "feed pages and ETags stay stale on other workers for up to "
+        "FEED_GENERATION_TTL seconds after a write",
+    ),
+    "RATE_LIMIT_CACHE_ALIAS": (
+        "myapp.W004",
+        "each process counts requests on its own, multiplying the rate "
+        "limits by the number of workers",
+    ),
+    "DATABASE_PIN_CACHE_ALIAS": (
+        "myapp.W005",
+        "a user's reads right after a write can be served by another worker "
+        "from a replica that has not caught up with it",
+    ),
+}
+
+
+def is_per_process(alias):
+    return settings.CACHES[alias]["BACKEND"] in PER_PROCESS_BACKENDS
+
+
+@register()
+def check_shared_caches(app_configs, **kwargs):
+    """
+    Warn about caches that must be shared between workers but are local to
+    each process, outside of DEBUG.
+    """
+    if settings.DEBUG:
+        return []
+    warnings = []
+    for setting, (check_id, consequence) in SHARED_CACHES.items():
+        if setting == "DATABASE_PIN_CACHE_ALIAS" and not settings.DATABASE_REPLICAS:
+            # Nothing is pinned without replicas
+            continue
+        alias = getattr(settings, setting)
+        if is_per_process(alias):
+            warnings.append(
+                Warning(
+                    f"{setting} uses the per-process cache {alias!r}",
+                    hint=f"With several workers {consequence}. Point it at a "
+                    "shared backend such as Redis.",
+                    id=check_id,
+                )
+            )
+    return warnings
+
+
+@register()
+def check_changes_settle_window(app_configs, **kwargs):
+    """
+    Warn when statements may run longer than the change log holds entries
+    back, their entries could commit below tokens already handed out.
+    """
+    timeout = settings.DATABASE_STATEMENT_TIMEOUT / 1000
+    if settings.DEBUG or settings.CHANGES_SETTLE_SECONDS > timeout:
+        return []
+    return [
+        Warning(
+            f"CHANGES_SETTLE_SECONDS ({settings.CHANGES_SETTLE_SECONDS:g}) is not "
+            f"above DATABASE_STATEMENT_TIMEOUT ({timeout:g}s)",
+            hint="Changes committed by slower transactions would be skipped by "
+            "posts/changes/ clients. Raise CHANGES_SETTLE_SECONDS well above the "
+            "slowest writing transaction.",
+            id="myapp.W003",
+        )
+    ]
@@ -0,0 +1,84 @@
+# myapp/db_router.py
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS
+
+# Whether reads of the current request may go to a replica. Off unless the
+# middleware turns it on for a safe request: writes, management commands and
+# background work always read from the primary
+replica_reads = ContextVar("replica_reads", default=False)
+
+
+def get_cache():
+    return caches[settings.DATABASE_PIN_CACHE_ALIAS]
+
+
+def pin_key(user_id):
+    return f"db:pinned:{user_id}"
+
+
+def mark_recent_write(user_id):
+    """
+    Pin the reads of `user_id` to the primary for DATABASE_PIN_SECONDS, so
+    they see their own write before the replicas have caught up with it.
+    """
+    if settings.DATABASE_REPLICAS:
+        get_cache().set(pin_key(user_id), True, timeout=settings.DATABASE_PIN_SECONDS)
+
+
+async def amark_recent_write(user_id):
+    if settings.DATABASE_REPLICAS:
+        await get_cache().aset(
+            pin_key(user_id), True, timeout=settings.DATABASE_PIN_SECONDS
+        )
+
+
+def pin_if_recent_write(user_id):
+    """
+    Read from the primary for the rest of the request when `user_id` wrote
+    within the pin window. Only costs a cache lookup on replica reads.
+    """
+    if replica_reads.get() and get_cache().get(pin_key(user_id)):
+        replica_reads.set(False)
+
+
+async def apin_if_recent_write(user_id):
+    if replica_reads.get() and await get_cache().aget(pin_key(user_id)):
+        replica_reads.set(False)
+
+
+@contextmanager
+def use_replicas(enabled=True):
+    token = replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        replica_reads.reset(token)
+
+
+class ReplicaRouter:
+    """
+    Send reads to a random replica of DATABASE_REPLICAS when the current
+    request allows it, and everything else to the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        instance = hints.get("instance")
+        if instance is not None and instance._state.db:
+            # Related objects are read from where their instance came from
+            return instance._state.db
+        replicas = settings.DATABASE_REPLICAS
+        if not replicas or not replica_reads.get():
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
@@ -0,0 +1,210 @@
+# myapp/feed_cache.py
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.http import quote_etag
+
+from . import db_router
+from .checks import is_per_process
+
+GENERATION_KEY = "feed:generation"
+CHANGED_AT_KEY = "feed:changed_at"
+HITS_KEY = "feed:hits"
+MISSES_KEY = "feed:misses"
+
+
+def get_cache():
+    """
+    The cache backend used for the feed, configured by FEED_CACHE_ALIAS.
+    """
+    return caches[settings.FEED_CACHE_ALIAS]
+
+
+def generation_timeout():
+    """
+    Lifetime of the generation and change time: forever in a shared cache,
+    FEED_GENERATION_TTL in a per-process one, which misses the writes of
+    other workers and must start over from time to time.
+    """
+    if is_per_process(settings.FEED_CACHE_ALIAS):
+        return settings.FEED_GENERATION_TTL
+    return None
+
+
+def _incr(cache, key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        # Key is missing (first use or evicted), start counting from 1
+        if cache.add(key, 1, timeout=None):
+            return 1
+        return cache.incr(key)
+
+
+def initial_generation():
+    # Start from the clock rather than 1, so a flushed cache never hands out
+    # a generation that clients still hold ETags for
+    return int(time.time() * 1000)
+
+
+def get_generation():
+    """
+    Current feed generation. Every page key embeds it, so bumping it makes
+    all cached pages unreachable; they then expire on their own timeout.
+    """
+    cache = get_cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, initial_generation(), timeout=generation_timeout())
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def bump_generation():
+    """
+    Invalidate every cached feed page.
+    """
+    cache = get_cache()
+    cache.set(CHANGED_AT_KEY, int(time.time()), timeout=generation_timeout())
+    try:
+        return cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.add(GENERATION_KEY, initial_generation(), timeout=generation_timeout())
+        return cache.get(GENERATION_KEY)
+
+
+def page_key(generation, cursor, page_size, comments_limit, fmt=""):
+    """
+    Cache key of a feed page stored as `fmt`, the views cache different
+    representations of the same page. Without `fmt` it identifies the page
+    itself, for its ETag.
+    """
+    return f"feed:v{generation}:{fmt}:{cursor or ''}:{page_size}:{comments_limit or ''}"
+
+
+def page_validators(generation, changed_at, cursor, page_size, comments_limit):
+    """
+    ETag and Last-Modified timestamp of one feed page.
+    """
+    key = page_key(generation, cursor, page_size, comments_limit)
+    return quote_etag(hashlib.md5(key.encode()).hexdigest()), changed_at
+
+
+def get_validators(cursor, page_size, comments_limit):
+    """
+    ETag and Last-Modified of a feed page, read from the cache alone: an
+    unchanged feed is answered with 304 without touching the database.
+    """
+    cache = get_cache()
+    changed_at = cache.get(CHANGED_AT_KEY)
+    if changed_at is None:
+        cache.add(CHANGED_AT_KEY, int(time.time()), timeout=generation_timeout())
+        changed_at = cache.get(CHANGED_AT_KEY)
+    return page_validators(
+        get_generation(), changed_at, cursor, page_size, comments_limit
+    )
+
+
+def replicas_settled(changed_at):
+    """
+    Whether a page may be built from a replica: not when the feed changed
+    within DATABASE_PIN_SECONDS, a lagging replica would then get a stale
+    page cached under the new generation. Never lifts a pin to the primary.
+    """
+    if not db_router.replica_reads.get():
+        return False
+    return (
+        changed_at is None or time.time() - changed_at > settings.DATABASE_PIN_SECONDS
+    )
+
+
+def get_page(cursor, page_size, comments_limit, build, fmt):
+    """
+    Read-through lookup of one feed page in representation `fmt`. `build`
+    is called on a miss and its result is stored under the current
+    generation.
+    """
+    cache = get_cache()
+    key = page_key(get_generation(), cursor, page_size, comments_limit, fmt)
+    payload = cache.get(key)
+    if payload is not None:
+        _incr(cache, HITS_KEY)
+        return payload
+
+    _incr(cache, MISSES_KEY)
+    with db_router.use_replicas(replicas_settled(cache.get(CHANGED_AT_KEY))):
+        payload = build()
+    cache.set(key, payload, timeout=settings.FEED_CACHE_TIMEOUT)
+    return payload
+
+
+async def _aincr(cache, key):
+    try:
+        return await cache.aincr(key)
+    except ValueError:
+        if await cache.aadd(key, 1, timeout=None):
+            return 1
+        return await cache.aincr(key)
+
+
+async def aget_generation():
+    cache = get_cache()
+    generation = await cache.aget(GENERATION_KEY)
+    if generation is None:
+        await cache.aadd(
+            GENERATION_KEY, initial_generation(), timeout=generation_timeout()
+        )
+        generation = await cache.aget(GENERATION_KEY)
+    return generation
+
+
+async def aget_validators(cursor, page_size, comments_limit):
+    """
+    Async version of `get_validators`.
+    """
+    cache = get_cache()
+    changed_at = await cache.aget(CHANGED_AT_KEY)
+    if changed_at is None:
+        await cache.aadd(CHANGED_AT_KEY, int(time.time()), timeout=generation_timeout())
+        changed_at = await cache.aget(CHANGED_AT_KEY)
+    return page_validators(
+        await aget_generation(), changed_at, cursor, page_size, comments_limit
+    )
+
+
+async def aget_page(cursor, page_size, comments_limit, build, fmt):
+    """
+    Async version of `get_page`, `build` is a coroutine function.
+    """
+    cache = get_cache()
+    key = page_key(await aget_generation(), cursor, page_size, comments_limit, fmt)
+    payload = await cache.aget(key)
+    if payload is not None:
+        await _aincr(cache, HITS_KEY)
+        return payload
+
+    await _aincr(cache, MISSES_KEY)
+    changed_at = await cache.aget(CHANGED_AT_KEY)
+    with db_router.use_replicas(replicas_settled(changed_at)):
+        payload = await build()
+    await cache.aset(key, payload, timeout=settings.FEED_CACHE_TIMEOUT)
+    return payload
+
+
+def get_stats():
+    """
+    Hit/miss counters of the feed cache.
+    """
+    cache = get_cache()
+    counters = cache.get_many([HITS_KEY, MISSES_KEY])
+    return {
+        "hits": counters.get(HITS_KEY, 0),
+        "misses": counters.get(MISSES_KEY, 0),
+        "generation": get_generation(),
+    }
+
+
+def reset_stats():
+    get_cache().delete_many([HITS_KEY, MISSES_KEY])
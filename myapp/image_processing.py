@@ -0,0 +1,81 @@
+# myapp/image_processing.py
+import io
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+EXTENSIONS = {"WEBP": ".webp", "JPEG": ".jpg"}
+
+
+class ImageTooLarge(ValueError):
+    pass
+
+
+def validate_dimensions(file):
+    """
+    Check the pixel size of an uploaded image. Only the header is read, the
+    image itself is not decoded.
+    """
+    max_width, max_height = settings.IMAGE_MAX_DIMENSIONS
+    position = file.tell() if hasattr(file, "tell") else None
+    try:
+        with Image.open(file) as image:
+            width, height = image.size
+    finally:
+        if position is not None:
+            file.seek(position)
+    if width > max_width or height > max_height:
+        raise ImageTooLarge(
+            f"Image is {width}x{height}, the maximum is {max_width}x{max_height}"
+        )
+    return width, height
+
+
+def _encode(image):
+    output_format = settings.IMAGE_OUTPUT_FORMAT
+    if output_format == "JPEG" and image.mode != "RGB":
+        image = image.convert("RGB")
+    buffer = io.BytesIO()
+    # No exif/icc arguments are passed, so no metadata is written
+    image.save(buffer, format=output_format, quality=settings.IMAGE_OUTPUT_QUALITY)
+    return buffer.getvalue()
+
+
+def process_image(file):
+    """
+    Re-encode an image without its metadata and build the resized variants
+    listed in IMAGE_VARIANT_SIZES.
+
+    Returns (extension, original bytes, {variant name: bytes}).
+    """
+    with Image.open(file) as source:
+        # Apply the exif orientation before the exif data is dropped
+        image = ImageOps.exif_transpose(source)
+        if image.mode not in ("RGB", "RGBA"):
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+        original = _encode(image)
+        variants = {}
+        for name, size in settings.IMAGE_VARIANT_SIZES.items():
+            variant = image.copy()
+            # thumbnail() keeps the aspect ratio and never upscales
+            variant.thumbnail((size, size), Image.LANCZOS)
+            variants[name] = _encode(variant)
+
+    return EXTENSIONS[settings.IMAGE_OUTPUT_FORMAT], original, variants
+
+
+def processed_files(file, key):
+    """
+    Process an image and name the resulting files after `key`.
+    Returns (original ContentFile, {variant name: ContentFile}).
+    """
+    extension, original, variants = process_image(file)
+    return (
+        ContentFile(original, name=f"{key}{extension}"),
+        {
+            name: ContentFile(data, name=f"{key}_{name}{extension}")
+            for name, data in variants.items()
+        },
+    )
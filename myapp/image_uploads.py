@@ -0,0 +1,260 @@
+# myapp/image_uploads.py
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from . import changes, feed_cache, metrics
+from .image_processing import processed_files
+from .image_storage import get_image_backend
+from .models import Change, ImageAsset, Post, PostImage
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+
+def get_executor():
+    """
+    Bounded thread pool shared by every upload, created once per process.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_UPLOAD_WORKERS,
+            thread_name_prefix="image-upload",
+        )
+    return _executor
+
+
+def asset_key(sha256):
+    """
+    Storage key of an asset, derived from its content hash so identical
+    images share one key. The processing stage appends the variant name and
+    file extension.
+    """
+    return f"images/{sha256[:2]}/{sha256}"
+
+
+def content_hash(image):
+    """
+    sha256 of an uploaded file. Streamed uploads were hashed while they were
+    received, anything else is hashed here.
+    """
+    sha256 = getattr(image, "sha256", None)
+    if sha256:
+        return sha256
+    hasher = hashlib.sha256()
+    for chunk in image.chunks():
+        hasher.update(chunk)
+    image.seek(0)
+    return hasher.hexdigest()
+
+
+def acquire_asset(sha256):
+    """
+    Get or create the asset for `sha256` and take a reference on it.
+    Returns (asset, created). Must run in a transaction: the asset's row
+    stays locked until it commits, so it can neither be deleted by
+    release_asset nor finish its upload before our PostImage rows exist.
+    """
+    while True:
+        asset = ImageAsset.objects.select_for_update().filter(sha256=sha256).first()
+        if asset is not None:
+            ImageAsset.objects.filter(pk=asset.pk).update(ref_count=F("ref_count") + 1)
+            return asset, False
+        asset, created = ImageAsset.objects.get_or_create(
+            sha256=sha256, defaults={"key": asset_key(sha256), "ref_count": 1}
+        )
+        if created:
+            return asset, True
+        # Created concurrently: take its lock and a reference on the next turn
+
+
+def schedule_uploads(post, images):
+    """
+    Create a PostImage row per image. Images whose content is already stored
+    reuse that asset and are ready right away, new content is uploaded in
+    the background once the post is committed. Returns the rows.
+    """
+    if not images:
+        return []
+    post_images = []
+    uploads = []
+    with transaction.atomic():
+        for image in images:
+            # Read under the asset's lock, the status is final or the upload
+            # will see our rows when it completes
+            asset, created = acquire_asset(content_hash(image))
+            post_image = PostImage(post=post, asset=asset, key=asset.key)
+            if asset.status == ImageAsset.READY:
+                post_image.status = PostImage.READY
+                post_image.variants = asset.variants
+                post_image.image = asset.variants.get("original", "")
+            else:
+                post_image.status = PostImage.PENDING
+                # A failed asset gets another attempt from the next upload
+                if created or asset.status == ImageAsset.FAILED:
+                    uploads.append((asset, _keep_content(image)))
+            post_images.append(post_image)
+
+        PostImage.objects.bulk_create(post_images)
+        Post.objects.filter(pk=post.pk).update(
+            image_count=F("image_count") + len(post_images)
+        )
+        changes.record_many(
+            Change.IMAGE, [(image.id, post.pk) for image in post_images]
+        )
+        # bulk_create sends no post_save, invalidate the feed ourselves
+        transaction.on_commit(feed_cache.bump_generation)
+
+    for asset, content in uploads:
+        transaction.on_commit(
+            lambda asset=asset, content=content: submit(asset, content)
+        )
+    return post_images
+
+
+def _keep_content(image):
+    if hasattr(image, "detach"):
+        # Streamed uploads stay open after the request for the worker
+        return image.detach()
+    # Other uploaded files are closed (and temp files removed) when the
+    # request ends, so keep our own copy of the bytes
+    return ContentFile(image.read(), name=image.name)
+
+
+def submit(asset, content):
+    if settings.IMAGE_UPLOAD_EAGER:
+        return upload_asset(asset, content)
+    return get_executor().submit(_run_in_worker, upload_asset, asset, content)
+
+
+def _run_in_worker(func, *args):
+    close_old_connections()
+    try:
+        return func(*args)
+    finally:
+        close_old_connections()
+
+
+def upload(file):
+    """
+    Store `file` under its name, returns (url, name it was stored as).
+    """
+    backend = get_image_backend()
+    with metrics.UPLOAD_SECONDS.time(backend=type(backend).__name__):
+        return backend.upload(file, file.name)
+
+
+def upload_asset(asset, content):
+    """
+    Process one image, upload it and its variants to the storage backend
+    and record the outcome on the asset and every PostImage waiting for it.
+    """
+    try:
+        original, variants = processed_files(content, asset.key)
+        asset.variants = {}
+        asset.stored_names = []
+        for name, file in [*variants.items(), ("original", original)]:
+            asset.variants[name], stored_name = upload(file)
+            asset.stored_names.append(stored_name)
+        asset.status = ImageAsset.READY
+    except Exception:
+        logger.exception("Upload of image %s failed", asset.key)
+        asset.status = ImageAsset.FAILED
+    finally:
+        if hasattr(content, "release"):
+            content.release()
+    with transaction.atomic():
+        # Posts still taking a reference hold the lock until their PostImage
+        # rows are committed, so none of them is left pending
+        if not ImageAsset.objects.select_for_update().filter(pk=asset.pk).exists():
+            return asset
+        asset.save(update_fields=["variants", "stored_names", "status"])
+        finish_post_images(asset)
+    return asset
+
+
+def finish_post_images(asset):
+    """
+    Copy the outcome of an asset to every PostImage waiting for it. A ready
+    asset also fixes the images the sweeper gave up on.
+    """
+    waiting = [PostImage.PENDING]
+    if asset.status == ImageAsset.READY:
+        waiting.append(PostImage.FAILED)
+    for post_image in asset.post_images.filter(status__in=waiting):
+        post_image.status = asset.status
+        post_image.variants = asset.variants
+        post_image.image = asset.variants.get("original", "")
+        post_image.save(update_fields=["image", "variants", "status"])
+
+
+def fail_stale_uploads(older_than=None):
+    """
+    Mark assets still pending after `older_than` seconds as failed, along
+    with the images waiting for them. Their content only lived in the
+    memory or temporary files of a process that died before uploading it;
+    the next upload of the same content tries again. Returns the number of
+    failed assets.
+    """
+    if older_than is None:
+        older_than = settings.IMAGE_UPLOAD_STALE_SECONDS
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    failed = 0
+    for asset in ImageAsset.objects.filter(
+        status=ImageAsset.PENDING, created_at__lt=cutoff
+    ):
+        with transaction.atomic():
+            # Unless its upload finished in the meantime
+            if not ImageAsset.objects.filter(
+                pk=asset.pk, status=ImageAsset.PENDING
+            ).update(status=ImageAsset.FAILED):
+                continue
+            asset.status = ImageAsset.FAILED
+            finish_post_images(asset)
+        logger.warning("Upload of image %s was lost, marked failed", asset.key)
+        failed += 1
+    return failed
+
+
+def release_asset(asset_id):
+    """
+    Drop one reference on an asset. The last reference deletes the asset
+    and, after commit, its files in the storage backend.
+    """
+    with transaction.atomic():
+        asset = ImageAsset.objects.select_for_update().filter(pk=asset_id).first()
+        if asset is None:
+            return
+        if asset.ref_count > 1:
+            asset.ref_count = F("ref_count") - 1
+            asset.save(update_fields=["ref_count"])
+            return
+        stored_names = asset.stored_names
+        asset.delete()
+
+    if stored_names:
+        transaction.on_commit(lambda: submit_delete(stored_names))
+
+
+def submit_delete(stored_names):
+    if settings.IMAGE_UPLOAD_EAGER:
+        return delete_files(stored_names)
+    return get_executor().submit(delete_files, stored_names)
+
+
+def delete_files(stored_names):
+    backend = get_image_backend()
+    for name in stored_names:
+        try:
+            backend.delete(name)
+        except Exception:
+            logger.exception("Deleting image %s failed", name)
@@ -0,0 +1,297 @@
+# myapp/management/commands/bench_api.py
+import io
+import json
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import (
+    CaptureQueriesContext,
+    setup_databases,
+    setup_test_environment,
+    teardown_databases,
+    teardown_test_environment,
+)
+from django.urls import reverse
+from PIL import Image
+
+from myapp import feed_cache
+from myapp.bulk import create_comments, create_posts
+from myapp.image_storage import reset_image_backend
+from myapp.metrics import percentile
+from myapp.models import CustomUser, Post, PostImage
+
+PASSWORD = "bench-password-123"
+SCENARIOS = (
+    "register",
+    "login",
+    "create",
+    "create_image",
+    "list",
+    "list_cold",
+    "update",
+    "delete",
+)
+DEFAULT_BASELINE = Path(settings.BASE_DIR) / ".benchmarks" / "api.json"
+
+
+def png(index):
+    # A distinct image per request, identical ones would be deduplicated
+    file = io.BytesIO()
+    Image.new("RGB", (32, 32), (index % 256, index // 256 % 256, 7)).save(file, "PNG")
+    return SimpleUploadedFile(f"bench{index}.png", file.getvalue(), "image/png")
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed a throwaway database and measure latency, queries per request and "
+        "requests/sec of the API endpoints, compared against the last baseline"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=20)
+        parser.add_argument("--posts", type=int, default=500)
+        parser.add_argument("--comments", type=int, default=5, help="Per post")
+        parser.add_argument(
+            "--images", type=int, default=100, help="Posts that get an image"
+        )
+        parser.add_argument(
+            "--requests", type=int, default=50, help="Measured requests per scenario"
+        )
+        parser.add_argument("--warmup", type=int, default=3)
+        parser.add_argument(
+            "--only", nargs="+", choices=SCENARIOS, help="Run only these scenarios"
+        )
+        parser.add_argument("--baseline", default=str(DEFAULT_BASELINE))
+        parser.add_argument(
+            "--save", action="store_true", help="Store this run as the new baseline"
+        )
+        parser.add_argument(
+            "--threshold",
+            type=float,
+            default=10.0,
+            help="Slowdown in percent reported as a regression (default: 10)",
+        )
+        parser.add_argument(
+            "--fail-on-regression",
+            action="store_true",
+            help="Exit with an error when a scenario regressed",
+        )
+
+    def handle(self, *args, **options):
+        # Never touch the configured database: run against a test database
+        setup_test_environment()
+        old_config = setup_databases(
+            verbosity=0, interactive=False, aliases={"default"}
+        )
+        try:
+            # Replicas are not part of the test database, read from it alone.
+            # Background jobs are only queued, as with a separate worker.
+            # The rate limiter runs, but with limits the scenarios never reach
+            with override_settings(
+                DATABASE_REPLICAS=[],
+                RATE_LIMITS={scope: "1000000/s" for scope in settings.RATE_LIMITS},
+                TASKS_EAGER=False,
+                TASKS_WORKERS=0,
+                IMAGE_STORAGE_BACKEND="myapp.image_storage.StubImageBackend",
+                IMAGE_UPLOAD_EAGER=True,
+            ):
+                reset_image_backend()
+                results = self.run(options)
+        finally:
+            reset_image_backend()
+            teardown_databases(old_config, verbosity=0)
+            teardown_test_environment()
+
+        baseline_path = Path(options["baseline"])
+        baseline = None
+        if baseline_path.exists():
+            baseline = json.loads(baseline_path.read_text())
+        regressions = self.report(results, baseline, options["threshold"])
+
+        if options["save"]:
+            baseline_path.parent.mkdir(parents=True, exist_ok=True)
+            baseline_path.write_text(
+                json.dumps(
+                    {
+                        "created_at": datetime.now(timezone.utc).isoformat(),
+                        "options": {
+                            name: options[name]
+                            for name in ("users", "posts", "comments", "images")
+                        },
+                        "results": results,
+                    },
+                    indent=2,
+                )
+            )
+            self.stdout.write(f"Baseline saved to {baseline_path}")
+        if regressions and options["fail_on_regression"]:
+            raise CommandError(f"Regressed: {', '.join(regressions)}")
+
+    def seed(self, options):
+        encoded = make_password(PASSWORD)
+        users = CustomUser.objects.bulk_create(
+            [
+                CustomUser(email=f"bench{i}@example.com", password=encoded)
+                for i in range(max(options["users"], 1))
+            ]
+        )
+        posts = []
+        for index, user in enumerate(users):
+            count = len(range(index, options["posts"], len(users)))
+            posts += create_posts(
+                user,
+                [
+                    {"title": f"Post {i}", "content": "Seeded " * 20}
+                    for i in range(count)
+                ],
+            )
+        for post in posts:
+            create_comments(
+                post,
+                users[post.id % len(users)],
+                [{"content": f"Comment {i}"} for i in range(options["comments"])],
+            )
+        PostImage.objects.bulk_create(
+            [
+                PostImage(
+                    post=post,
+                    image=f"image/upload/v1/bench/{post.id}.png",
+                    key=f"bench/{post.id}.png",
+                    status=PostImage.READY,
+                    variants={"thumb": f"https://stub.invalid/{post.id}_thumb.webp"},
+                )
+                for post in posts[: options["images"]]
+            ]
+        )
+        Post.objects.recompute_counters()
+        return users[0]
+
+    def run(self, options):
+        self.stdout.write(
+            f"Seeding {options['users']} users, {options['posts']} posts, "
+            f"{options['comments']} comments per post, {options['images']} images"
+        )
+        user = self.seed(options)
+        client = Client()
+        response = client.post(
+            reverse("login"), {"email": user.email, "password": PASSWORD}
+        )
+        token = response.json()["data"]["access"]
+        auth = {"HTTP_AUTHORIZATION": f"Bearer {token}"}
+
+        total = options["warmup"] + options["requests"]
+        # Posts of the logged in user for update and delete, beyond the seed
+        own_posts = [
+            post.id
+            for post in create_posts(
+                user, [{"title": "Own", "content": "c"} for _ in range(total)]
+            )
+        ]
+        images = [png(i) for i in range(total)]
+
+        scenarios = {
+            "register": lambda i: client.post(
+                reverse("register"),
+                {"email": f"new{i}@example.com", "password": PASSWORD},
+            ),
+            "login": lambda i: client.post(
+                reverse("login"), {"email": user.email, "password": PASSWORD}
+            ),
+            "create": lambda i: client.post(
+                reverse("create_post"), {"title": "t", "content": "c"}, **auth
+            ),
+            "create_image": lambda i: client.post(
+                reverse("create_post"),
+                {"title": "t", "content": "c", "images": [images[i]]},
+                **auth,
+            ),
+            "list": lambda i: client.get(reverse("get_post_with_comments"), **auth),
+            "list_cold": lambda i: client.get(
+                reverse("get_post_with_comments"), **auth
+            ),
+            "update": lambda i: client.patch(
+                reverse("update_post", args=[own_posts[i]]),
+                json.dumps({"title": f"Updated {i}"}),
+                content_type="application/json",
+                **auth,
+            ),
+            "delete": lambda i: client.delete(
+                reverse("delete_post", args=[own_posts[i]]), **auth
+            ),
+        }
+        # Run before each request of a scenario, outside of the measurement
+        before = {"list_cold": feed_cache.bump_generation}
+
+        results = {}
+        for name in options["only"] or SCENARIOS:
+            results[name] = self.measure(
+                scenarios[name], before.get(name), options["warmup"], total
+            )
+        return results
+
+    def measure(self, request, before, warmup, total):
+        latencies = []
+        queries = 0
+        errors = 0
+        for i in range(total):
+            if before:
+                before()
+            with CaptureQueriesContext(connection) as captured:
+                started = time.perf_counter()
+                response = request(i)
+                elapsed = time.perf_counter() - started
+            if i < warmup:
+                continue
+            latencies.append(elapsed)
+            queries += len(captured)
+            errors += response.status_code >= 400
+
+        latencies.sort()
+        return {
+            "requests": len(latencies),
+            "errors": errors,
+            "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+            "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+            "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+            "rps": round(len(latencies) / sum(latencies), 1),
+            "queries": round(queries / len(latencies), 2),
+        }
+
+    def report(self, results, baseline, threshold):
+        """
+        Print the results, with the change against the baseline when there is
+        one. Returns the scenarios whose p95 regressed past `threshold`.
+        """
+        previous = (baseline or {}).get("results", {})
+        regressions = []
+        self.stdout.write(
+            f"{'scenario':<13} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} "
+            f"{'req/s':>8} {'queries':>8} {'errors':>7} {'p95 vs baseline':>16}"
+        )
+        for name, result in results.items():
+            line = (
+                f"{name:<13} {result['p50_ms']:>8.2f} {result['p95_ms']:>8.2f} "
+                f"{result['p99_ms']:>8.2f} {result['rps']:>8.1f} "
+                f"{result['queries']:>8.2f} {result['errors']:>7}"
+            )
+            old = previous.get(name)
+            if not old:
+                self.stdout.write(line)
+                continue
+            change = (result["p95_ms"] - old["p95_ms"]) / old["p95_ms"] * 100
+            line += f" {change:>+15.1f}%"
+            if old["queries"] != result["queries"]:
+                line += f" (queries {old['queries']} -> {result['queries']})"
+            if change > threshold:
+                regressions.append(name)
+                self.stdout.write(self.style.WARNING(line))
+            else:
+                self.stdout.write(line)
+        return regressions
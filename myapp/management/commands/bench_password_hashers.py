@@ -0,0 +1,79 @@
+# myapp/management/commands/bench_password_hashers.py
+import time
+
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+CONFIGS = {
+    "pbkdf2 (django default)": {
+        "hasher": "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+        "settings": {},
+    },
+    "scrypt n=2^14 r=8 p=1": {
+        "hasher": "myapp.hashers.TunedScryptPasswordHasher",
+        "settings": {
+            "PASSWORD_SCRYPT_WORK_FACTOR": 2**14,
+            "PASSWORD_SCRYPT_BLOCK_SIZE": 8,
+            "PASSWORD_SCRYPT_PARALLELISM": 1,
+        },
+    },
+    "scrypt n=2^15 r=8 p=1": {
+        "hasher": "myapp.hashers.TunedScryptPasswordHasher",
+        "settings": {
+            "PASSWORD_SCRYPT_WORK_FACTOR": 2**15,
+            "PASSWORD_SCRYPT_BLOCK_SIZE": 8,
+            "PASSWORD_SCRYPT_PARALLELISM": 1,
+        },
+    },
+    "argon2id t=2 m=19MiB p=1": {
+        "hasher": "myapp.hashers.TunedArgon2PasswordHasher",
+        "settings": {
+            "PASSWORD_ARGON2_TIME_COST": 2,
+            "PASSWORD_ARGON2_MEMORY_COST": 19456,
+            "PASSWORD_ARGON2_PARALLELISM": 1,
+        },
+    },
+}
+
+
+class Command(BaseCommand):
+    help = "Measure password verifications (logins) per second per core for each hasher config"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--seconds",
+            type=float,
+            default=2.0,
+            help="Time spent measuring each config (default: 2)",
+        )
+
+    def handle(self, *args, **kwargs):
+        self.stdout.write(f"{'config':<28} {'logins/sec/core':>16} {'ms/login':>10}")
+        for name, config in CONFIGS.items():
+            if config["hasher"].endswith("Argon2PasswordHasher"):
+                try:
+                    import argon2  # noqa: F401
+                except ImportError:
+                    self.stdout.write(
+                        f"{name:<28} {'skipped, argon2-cffi missing':>28}"
+                    )
+                    continue
+
+            with override_settings(
+                PASSWORD_HASHERS=[config["hasher"]], **config["settings"]
+            ):
+                rate = self.measure(kwargs["seconds"])
+            self.stdout.write(f"{name:<28} {rate:>16.1f} {1000 / rate:>10.1f}")
+
+    def measure(self, seconds):
+        # One process on one core, like one worker of the password pool
+        encoded = make_password("correct horse battery staple")
+        count = 0
+        started = time.perf_counter()
+        while True:
+            check_password("correct horse battery staple", encoded)
+            count += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= seconds:
+                return count / elapsed
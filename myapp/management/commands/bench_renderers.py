@@ -0,0 +1,95 @@
+# myapp/management/commands/bench_renderers.py
+import json
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from myapp.renderers import ORJSONRenderer, orjson, render_envelope
+from myapp.response_utils import paginated_response
+
+MESSAGE = "Posts and comments  retrieved successfully"
+
+
+def build_feed(posts, comments):
+    """
+    Data shaped like one feed page, with the UUID author keys the
+    serializers return.
+    """
+    now = datetime.now(timezone.utc)
+    authors = [uuid.uuid4() for _ in range(20)]
+    data = []
+    for i in range(posts):
+        created = (now - timedelta(minutes=i)).isoformat()
+        author = authors[i % len(authors)]
+        data.append(
+            {
+                "post": {
+                    "id": i,
+                    "title": f"Post title number {i}",
+                    "content": "Lorem ipsum dolor sit amet, consectetur. " * 8,
+                    "created_at": created,
+                    "updated_at": created,
+                    "author": author,
+                    "images": [],
+                },
+                "comments": [
+                    {
+                        "content": f"Comment {j} on post {i}, ünïcödé",
+                        "post": i,
+                        "user": authors[j % len(authors)],
+                    }
+                    for j in range(comments)
+                ],
+                "comment_count": comments,
+            }
+        )
+    return data
+
+
+class Command(BaseCommand):
+    help = "Compare JSON rendering of large feed pages: DRF's JSONRenderer vs orjson"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--posts", type=int, default=500)
+        parser.add_argument("--comments", type=int, default=20)
+        parser.add_argument("--repeat", type=int, default=20)
+
+    def handle(self, *args, **kwargs):
+        data = build_feed(kwargs["posts"], kwargs["comments"])
+        cursor = "MjAyNC0wMS0wMVQwMDowMDowMCswMDowMHwxMjM="
+        cases = {
+            "drf JSONRenderer": lambda: JSONRenderer().render(
+                paginated_response(data, cursor, message=MESSAGE)
+            ),
+            "ORJSONRenderer": lambda: ORJSONRenderer().render(
+                paginated_response(data, cursor, message=MESSAGE)
+            ),
+            "render_envelope": lambda: render_envelope(
+                data, MESSAGE, next_cursor=cursor
+            ),
+        }
+        if orjson is None:
+            self.stdout.write("orjson is not installed, both renderers use stdlib json")
+
+        expected = json.loads(cases["drf JSONRenderer"]())
+        baseline = None
+        self.stdout.write(
+            f"{'renderer':<18} {'ms/page':>9} {'MB/s':>8} {'speedup':>8} {'bytes':>10}"
+        )
+        for name, render in cases.items():
+            body = render()
+            if json.loads(body) != expected:
+                self.stderr.write(f"{name} output differs from JSONRenderer")
+            started = time.perf_counter()
+            for _ in range(kwargs["repeat"]):
+                render()
+            elapsed = (time.perf_counter() - started) / kwargs["repeat"]
+            baseline = baseline or elapsed
+            self.stdout.write(
+                f"{name:<18} {elapsed * 1000:>9.2f} "
+                f"{len(body) / elapsed / 1e6:>8.1f} "
+                f"{baseline / elapsed:>7.1f}x {len(body):>10}"
+            )
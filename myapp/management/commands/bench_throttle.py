@@ -0,0 +1,97 @@
+# myapp/management/commands/bench_throttle.py
+import time
+import uuid
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from myapp.metrics import percentile
+from myapp.models import TokenUser
+from myapp.throttling import TokenBucketThrottle, bucket_key, get_cache
+
+SCOPE = "bench"
+
+
+class BenchView:
+    throttle_scope = SCOPE
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the overhead the rate limiter adds to a request, against the "
+        "configured RATE_LIMIT_CACHE_ALIAS cache"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--checks", type=int, default=2000)
+        parser.add_argument(
+            "--users", type=int, default=100, help="Distinct buckets to spread over"
+        )
+        parser.add_argument(
+            "--budget-ms",
+            type=float,
+            default=1.0,
+            help="Fail when the p99 overhead exceeds this (default: 1ms)",
+        )
+
+    def handle(self, *args, **options):
+        factory = APIRequestFactory()
+        requests = []
+        for _ in range(max(options["users"], 1)):
+            request = Request(factory.get("/posts/all/"))
+            request.user = TokenUser.from_claims(uuid.uuid4())
+            requests.append(request)
+        view = BenchView()
+        checks = options["checks"]
+
+        cases = {
+            # Every request passes, buckets are taken from the cache
+            "allowed": ("1000000/s", lambda i: requests[i % len(requests)]),
+            # One bucket, empty after the first request: the denied path
+            "denied": ("1/d", lambda i: requests[0]),
+        }
+        self.stdout.write(
+            f"cache: {settings.RATE_LIMIT_CACHE_ALIAS} "
+            f"({type(get_cache()).__name__})"
+        )
+        self.stdout.write(
+            f"{'case':<8} {'p50 us':>8} {'p95 us':>8} {'p99 us':>8} {'checks/s':>10}"
+        )
+        over_budget = []
+        for name, (rate, pick) in cases.items():
+            with override_settings(RATE_LIMITS={SCOPE: rate}):
+                timings = self.measure(view, pick, checks)
+            for request in requests:
+                get_cache().delete(bucket_key(SCOPE, f"user:{request.user.pk}"))
+            timings.sort()
+            p99 = percentile(timings, 99)
+            self.stdout.write(
+                f"{name:<8} {percentile(timings, 50) * 1e6:>8.1f} "
+                f"{percentile(timings, 95) * 1e6:>8.1f} {p99 * 1e6:>8.1f} "
+                f"{len(timings) / sum(timings):>10.0f}"
+            )
+            if p99 * 1000 > options["budget_ms"]:
+                over_budget.append(name)
+        if over_budget:
+            raise CommandError(
+                f"Rate limiting costs more than {options['budget_ms']}ms at p99: "
+                f"{', '.join(over_budget)}"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rate limiting stays under {options['budget_ms']}ms per request"
+            )
+        )
+
+    def measure(self, view, pick, checks):
+        throttle = TokenBucketThrottle()
+        timings = []
+        for i in range(checks):
+            request = pick(i)
+            started = time.perf_counter()
+            throttle.allow_request(request, view)
+            timings.append(time.perf_counter() - started)
+        return timings
@@ -0,0 +1,12 @@
+# myapp/management/commands/compact_changes.py
+from django.core.management.base import BaseCommand
+
+from myapp import changes
+
+
+class Command(BaseCommand):
+    help = "Remove superseded change log entries and expired tombstones"
+
+    def handle(self, *args, **kwargs):
+        deleted = changes.compact()
+        self.stdout.write(self.style.SUCCESS(f"Removed {deleted} change log entries"))
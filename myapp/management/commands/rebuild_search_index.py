@@ -0,0 +1,24 @@
+# myapp/management/commands/rebuild_search_index.py
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from myapp import search
+from myapp.models import Comment, Post
+
+
+class Command(BaseCommand):
+    help = "Rebuild the full-text search index of posts and comments"
+
+    def handle(self, *args, **kwargs):
+        if search.get_backend() is None:
+            self.stdout.write(
+                self.style.ERROR("Full-text search is not supported on this database")
+            )
+            return
+
+        with transaction.atomic():
+            search.rebuild(
+                Post.objects.only("id", "title", "content").iterator(),
+                Comment.objects.only("id", "post_id", "content").iterator(),
+            )
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt"))
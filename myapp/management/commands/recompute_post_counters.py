@@ -0,0 +1,20 @@
+# myapp/management/commands/recompute_post_counters.py
+from django.core.management.base import BaseCommand
+
+from myapp.models import Post
+
+
+class Command(BaseCommand):
+    help = "Recompute the denormalized comment and image counters of posts"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "post_ids", nargs="*", type=int, help="Only these posts (default: all)"
+        )
+
+    def handle(self, *args, **kwargs):
+        posts = Post.objects.all()
+        if kwargs["post_ids"]:
+            posts = posts.filter(pk__in=kwargs["post_ids"])
+        updated = posts.recompute_counters()
+        self.stdout.write(self.style.SUCCESS(f"Recomputed counters of {updated} posts"))
@@ -0,0 +1,77 @@
+# myapp/management/commands/run_tasks.py
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from myapp import tasks
+
+PRUNE_INTERVAL = 3600
+
+
+class Command(BaseCommand):
+    help = (
+        "Run background tasks from the job table with a pool of worker "
+        "threads, until stopped"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--workers", type=int, default=max(settings.TASKS_WORKERS, 4)
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=settings.TASKS_BATCH_SIZE,
+            help="Jobs claimed at once",
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=1.0,
+            help="Seconds to wait when the queue is empty",
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Exit when no job is due"
+        )
+
+    def handle(self, *args, **options):
+        stop = Event()
+        # Finish the jobs at hand on SIGTERM/Ctrl-C, their leases would
+        # otherwise have to run out first
+        handlers = {
+            signum: signal.signal(signum, lambda *_: stop.set())
+            for signum in (signal.SIGTERM, signal.SIGINT)
+        }
+        try:
+            succeeded, failed = self.run(stop, options)
+        finally:
+            for signum, handler in handlers.items():
+                signal.signal(signum, handler)
+        self.stdout.write(
+            self.style.SUCCESS(f"Ran {succeeded + failed} jobs, {failed} failed")
+        )
+
+    def run(self, stop, options):
+        succeeded = failed = 0
+        pruned_at = None
+        with ThreadPoolExecutor(
+            max_workers=options["workers"], thread_name_prefix="run-tasks"
+        ) as executor:
+            while not stop.is_set():
+                if pruned_at is None or time.monotonic() - pruned_at > PRUNE_INTERVAL:
+                    tasks.prune()
+                    pruned_at = time.monotonic()
+                jobs = tasks.claim(options["batch_size"])
+                if not jobs:
+                    if options["once"]:
+                        break
+                    stop.wait(options["poll_interval"])
+                    continue
+                for ok in executor.map(tasks.run_in_worker, jobs):
+                    succeeded += ok
+                    failed += not ok
+        return succeeded, failed
@@ -0,0 +1,24 @@
+# myapp/management/commands/sweep_uploads.py
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from myapp import image_uploads
+
+
+class Command(BaseCommand):
+    help = (
+        "Mark image uploads lost by a crashed or restarted process as failed, "
+        "run it periodically"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than",
+            type=int,
+            default=settings.IMAGE_UPLOAD_STALE_SECONDS,
+            help="Seconds after which a pending upload counts as lost",
+        )
+
+    def handle(self, *args, **options):
+        failed = image_uploads.fail_stale_uploads(options["older_than"])
+        self.stdout.write(self.style.SUCCESS(f"Marked {failed} lost uploads failed"))
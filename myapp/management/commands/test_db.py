@@ -1,21 +1,133 @@
 # myapp/management/commands/test_db.py
-from django.core.management.base import BaseCommand
-from django.db import connection
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
 
-class Command(BaseCommand):
-    help = "Test the database connection"
+from myapp.metrics import percentile
+
+
+def probe(alias, samples):
+    """
+    Time `samples` connection checkouts and `SELECT 1` round trips on this
+    thread's connection to `alias`, in seconds.
+    """
+    connection = connections[alias]
+    checkouts = []
+    round_trips = []
+    try:
+        for _ in range(samples):
+            # Closing hands a pooled connection back, the next checkout waits
+            # for a free one; without a pool this times a new connection
+            connection.close()
+            started = time.perf_counter()
+            connection.ensure_connection()
+            checkouts.append(time.perf_counter() - started)
 
-    def handle(self, *args, **kwargs):
-        try:
             with connection.cursor() as cursor:
+                started = time.perf_counter()
                 cursor.execute("SELECT 1")
-                result = cursor.fetchone()
-                if result:
-                    self.stdout.write(
-                        self.style.SUCCESS("Database connection successful")
-                    )
-                else:
-                    self.stdout.write(self.style.ERROR("Database connection failed"))
+                cursor.fetchone()
+                round_trips.append(time.perf_counter() - started)
+    finally:
+        connection.close()
+    return checkouts, round_trips
+
+
+def summary(values):
+    values = sorted(values)
+    return (
+        " ".join(f"p{p}={percentile(values, p) * 1000:.2f}ms" for p in (50, 95, 99))
+        + f" max={values[-1] * 1000:.2f}ms"
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "Test the database connections: pool saturation, checkout wait time "
+        "and round-trip latency of every configured database"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--samples", type=int, default=20, help="Round trips per thread"
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="Threads checking out connections at once",
+        )
+        parser.add_argument(
+            "--database", action="append", help="Alias to test (default: all)"
+        )
+
+    def handle(self, *args, **options):
+        aliases = options["database"] or list(connections)
+        failed = []
+        for alias in aliases:
+            if not self.diagnose(alias, options["samples"], options["concurrency"]):
+                failed.append(alias)
+        if failed:
+            raise CommandError(f"Database connection failed: {', '.join(failed)}")
+
+    def diagnose(self, alias, samples, concurrency):
+        connection = connections[alias]
+        pool = getattr(connection, "pool", None)
+        self.stdout.write(f"{alias} ({connection.vendor})")
+        if pool is not None:
+            self.stdout.write(
+                f"  pool: min={pool.min_size} max={pool.max_size} "
+                f"timeout={pool.timeout}s"
+            )
+        else:
+            self.stdout.write(
+                f"  no pool, persistent connections: "
+                f"{connection.settings_dict['CONN_MAX_AGE']}s"
+            )
+
+        peak_in_use = peak_waiting = 0
+        try:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                futures = [
+                    executor.submit(probe, alias, samples) for _ in range(concurrency)
+                ]
+                # Sample the pool while the probes run, it is idle afterwards
+                while not all(future.done() for future in futures):
+                    if pool is not None:
+                        stats = pool.get_stats()
+                        in_use = stats["pool_size"] - stats["pool_available"]
+                        peak_in_use = max(peak_in_use, in_use)
+                        peak_waiting = max(
+                            peak_waiting, stats.get("requests_waiting", 0)
+                        )
+                    time.sleep(0.005)
+                results = [future.result() for future in futures]
         except Exception as e:
-            self.stdout.write(self.style.ERROR(f"Database connection failed: {e}"))
+            self.stdout.write(self.style.ERROR(f"  Database connection failed: {e}"))
+            return False
+
+        checkouts = [value for result in results for value in result[0]]
+        round_trips = [value for result in results for value in result[1]]
+        self.stdout.write(f"  checkout:   {summary(checkouts)}")
+        self.stdout.write(f"  round trip: {summary(round_trips)}")
+        if pool is not None:
+            stats = pool.get_stats()
+            queued = stats.get("requests_queued", 0)
+            self.stdout.write(
+                f"  saturation: peak {peak_in_use}/{pool.max_size} in use, "
+                f"peak {peak_waiting} waiting, {queued} of "
+                f"{stats.get('requests_num', 0)} checkouts queued for "
+                f"{stats.get('requests_wait_ms', 0) / max(queued, 1):.1f}ms on "
+                f"average, {stats.get('requests_errors', 0)} failed"
+            )
+            if queued:
+                self.stdout.write(
+                    self.style.WARNING(
+                        "  checkouts had to wait: raise DATABASE_POOL_MAX_SIZE "
+                        "or lower the number of threads per process"
+                    )
+                )
+        self.stdout.write(self.style.SUCCESS("  Database connection successful"))
+        return True
@@ -0,0 +1,12 @@
+# myapp/management/commands/trim_timelines.py
+from django.core.management.base import BaseCommand
+
+from myapp import timelines
+
+
+class Command(BaseCommand):
+    help = "Remove home timeline entries past TIMELINE_MAX_ENTRIES per user"
+
+    def handle(self, *args, **kwargs):
+        deleted = timelines.trim()
+        self.stdout.write(self.style.SUCCESS(f"Removed {deleted} timeline entries"))
@@ -0,0 +1,191 @@
+# myapp/metrics.py
+import math
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from threading import Lock
+
+# Prometheus' default buckets, in seconds
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 8, 13, 21, 34, 55, 89)
+
+
+def percentile(values, p):
+    """
+    Nearest-rank percentile of sorted `values`.
+    """
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        (name, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for name, value in pairs
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (math.inf,)
+        # {label values: [per-bucket counts..., sum]}
+        self.values = {}
+        self.lock = Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * len(self.buckets) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self.lock:
+            values = {key: list(counts) for key, counts in self.values.items()}
+        for key, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = format_labels(
+                    self.labelnames, key, [("le", format_value(bound))]
+                )
+                yield f"{self.name}_bucket", labels, cumulative
+            labels = format_labels(self.labelnames, key)
+            yield f"{self.name}_sum", labels, counts[-1]
+            yield f"{self.name}_count", labels, cumulative
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def exposition(self):
+        """
+        All metrics in the Prometheus text format (version 0.0.4).
+        """
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+# Values are kept per process: every worker exposes its own, aggregate them
+# in Prometheus
+registry = Registry()
+
+REQUEST_SECONDS = registry.register(
+    Histogram(
+        "http_request_duration_seconds",
+        "Request latency by view",
+        ("view", "method", "status"),
+    )
+)
+DB_QUERIES = registry.register(
+    Histogram(
+        "http_request_db_queries",
+        "Database queries per request by view",
+        ("view",),
+        buckets=QUERY_COUNT_BUCKETS,
+    )
+)
+DB_SECONDS = registry.register(
+    Histogram(
+        "http_request_db_duration_seconds",
+        "Time spent in database queries per request by view",
+        ("view",),
+    )
+)
+SERIALIZATION_SECONDS = registry.register(
+    Histogram(
+        "http_request_serialization_duration_seconds",
+        "Time spent encoding JSON per request by view",
+        ("view",),
+    )
+)
+UPLOAD_SECONDS = registry.register(
+    Histogram(
+        "image_upload_duration_seconds",
+        "Time spent uploading one file to the image storage backend",
+        ("backend",),
+    )
+)
+
+
+class RequestMetrics:
+    __slots__ = ("queries", "db_seconds", "serialization_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serialization_seconds = 0.0
+
+
+# Metrics of the request being served, also seen from sync_to_async threads
+current = ContextVar("request_metrics", default=None)
+
+
+def record_queries(execute, sql, params, many, context):
+    """
+    Database execute wrapper counting queries and their time for the
+    current request, installed on every connection.
+    """
+    metrics = current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        metrics.queries += 1
+        metrics.db_seconds += time.perf_counter() - started
+
+
+def install_query_recorder(sender, connection, **kwargs):
+    if record_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_queries)
+
+
+@contextmanager
+def track_serialization():
+    metrics = current.get()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.serialization_seconds += time.perf_counter() - started
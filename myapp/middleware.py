@@ -0,0 +1,127 @@
+# myapp/middleware.py
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import db_router, metrics
+
+SAFE_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class MetricsMiddleware:
+    """
+    Record latency, database queries and time, and JSON encoding time of
+    every request, labelled with the URL name of the view. Works for sync
+    and async views; must come first in MIDDLEWARE to time the others.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token, started = self.start()
+        response = None
+        try:
+            response = self.get_response(request)
+            return response
+        finally:
+            self.finish(request, token, started, response)
+
+    async def __acall__(self, request):
+        token, started = self.start()
+        response = None
+        try:
+            response = await self.get_response(request)
+            return response
+        finally:
+            self.finish(request, token, started, response)
+
+    def start(self):
+        return metrics.current.set(metrics.RequestMetrics()), time.perf_counter()
+
+    def finish(self, request, token, started, response):
+        recorded = metrics.current.get()
+        metrics.current.reset(token)
+        if response is not None and response.streaming:
+            # The body is queried and encoded while it is sent: record that
+            # too, and observe the request once the response is closed
+            response.streaming_content = self.track_stream(response, recorded)
+            response._resource_closers.append(
+                lambda: self.observe(request, started, response, recorded)
+            )
+        else:
+            self.observe(request, started, response, recorded)
+
+    def track_stream(self, response, recorded):
+        if response.is_async:
+            return self.atrack_stream(response.streaming_content, recorded)
+        return self.sync_track_stream(response.streaming_content, recorded)
+
+    def sync_track_stream(self, content, recorded):
+        content = iter(content)
+        while True:
+            # Set around each chunk only, the context is the server's between
+            token = metrics.current.set(recorded)
+            try:
+                chunk = next(content, None)
+            finally:
+                metrics.current.reset(token)
+            if chunk is None:
+                return
+            yield chunk
+
+    async def atrack_stream(self, content, recorded):
+        content = aiter(content)
+        while True:
+            token = metrics.current.set(recorded)
+            try:
+                chunk = await anext(content, None)
+            finally:
+                metrics.current.reset(token)
+            if chunk is None:
+                return
+            yield chunk
+
+    def observe(self, request, started, response, recorded):
+        elapsed = time.perf_counter() - started
+        match = getattr(request, "resolver_match", None)
+        view = (match.url_name or match.view_name) if match else "unmatched"
+        status = response.status_code if response is not None else 500
+        metrics.REQUEST_SECONDS.observe(
+            elapsed, view=view, method=request.method, status=status
+        )
+        metrics.DB_QUERIES.observe(recorded.queries, view=view)
+        metrics.DB_SECONDS.observe(recorded.db_seconds, view=view)
+        metrics.SERIALIZATION_SECONDS.observe(recorded.serialization_seconds, view=view)
+
+
+class ReplicaReadsMiddleware:
+    """
+    Let safe requests read from the replicas. Authentication pins the reads
+    back to the primary for users who wrote recently, see db_router.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        with db_router.use_replicas(request.method in SAFE_METHODS):
+            return self.get_response(request)
+
+    async def __acall__(self, request):
+        with db_router.use_replicas(request.method in SAFE_METHODS):
+            return await self.get_response(request)
@@ -0,0 +1,66 @@
+from django.db import migrations
+
+# The search index as it was created at this point, kept here rather than
+# imported from myapp.search so later changes to that module do not change
+# this migration. Rows are addressed by id * 2 for posts and id * 2 + 1 for
+# comments.
+TABLE = "myapp_search_index"
+
+SQLITE_CREATE = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+    "title, content, kind UNINDEXED, object_id UNINDEXED, "
+    "post_id UNINDEXED, tokenize = 'porter unicode61')",
+    f"INSERT INTO {TABLE} (rowid, title, content, kind, object_id, post_id) "
+    "SELECT id * 2, title, content, 'post', id, id FROM myapp_post",
+    f"INSERT INTO {TABLE} (rowid, title, content, kind, object_id, post_id) "
+    "SELECT id * 2 + 1, '', content, 'comment', id, post_id FROM myapp_comment",
+]
+
+POSTGRES_CREATE = [
+    f"CREATE TABLE IF NOT EXISTS {TABLE} ("
+    "id bigint PRIMARY KEY, kind varchar(10) NOT NULL, "
+    "object_id bigint NOT NULL, post_id bigint NOT NULL, "
+    "title text NOT NULL, content text NOT NULL, "
+    "document tsvector NOT NULL)",
+    f"CREATE INDEX IF NOT EXISTS {TABLE}_document ON {TABLE} USING GIN (document)",
+    f"CREATE INDEX IF NOT EXISTS {TABLE}_post_id ON {TABLE} (post_id)",
+    f"INSERT INTO {TABLE} (id, kind, object_id, post_id, title, content, document) "
+    "SELECT id * 2, 'post', id, id, title, content, "
+    "setweight(to_tsvector('english', title), 'A') || "
+    "setweight(to_tsvector('english', content), 'B') FROM myapp_post "
+    "ON CONFLICT (id) DO NOTHING",
+    f"INSERT INTO {TABLE} (id, kind, object_id, post_id, title, content, document) "
+    "SELECT id * 2 + 1, 'comment', id, post_id, '', content, "
+    "setweight(to_tsvector('english', ''), 'A') || "
+    "setweight(to_tsvector('english', content), 'B') FROM myapp_comment "
+    "ON CONFLICT (id) DO NOTHING",
+]
+
+CREATE = {"sqlite": SQLITE_CREATE, "postgresql": POSTGRES_CREATE}
+
+
+def create_search_index(apps, schema_editor):
+    statements = CREATE.get(schema_editor.connection.vendor)
+    if statements is None:
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor not in CREATE:
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0005_imageasset'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:21
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0007_post_counters_and_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TokenUser',
+            fields=[
+            ],
+            options={
+                'proxy': True,
+                'indexes': [],
+                'constraints': [],
+            },
+            bases=('myapp.customuser',),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-18 19:31
+
+from django.db import migrations, models
+
+
+def backfill_changes(apps, schema_editor):
+    """
+    Log every existing object once, so a sync without a token is complete.
+    """
+    Change = apps.get_model("myapp", "Change")
+    sources = (
+        ("post", apps.get_model("myapp", "Post"), "id"),
+        ("comment", apps.get_model("myapp", "Comment"), "post_id"),
+        ("image", apps.get_model("myapp", "PostImage"), "post_id"),
+    )
+    for kind, model, post_field in sources:
+        rows = model.objects.order_by("id").values_list("id", post_field)
+        Change.objects.bulk_create(
+            (
+                Change(kind=kind, object_id=object_id, post_id=post_id, action="upsert")
+                for object_id, post_id in rows.iterator()
+            ),
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('myapp', '0008_tokenuser'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Change',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('post', 'Post'), ('comment', 'Comment'), ('image', 'Image')], max_length=10)),
+                ('object_id', models.BigIntegerField()),
+                ('post_id', models.BigIntegerField()),
+                ('action', models.CharField(choices=[('upsert', 'Upsert'), ('delete', 'Delete')], max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['kind', 'object_id', 'id'], name='change_object_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_changes, migrations.RunPython.noop),
+    ]
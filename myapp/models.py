@@ -1,9 +1,12 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import Count, F, OuterRef, Prefetch, Subquery, Window
+from django.db.models.functions import Coalesce, RowNumber
 from django.contrib.auth.models import (
     AbstractBaseUser,
     BaseUserManager,
     PermissionsMixin,
 )
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 import uuid
 from cloudinary.models import CloudinaryField
@@ -48,6 +51,108 @@ class CustomUser(AbstractBaseUser, PermissionsMixin):
         return self.email
 
 
+class TokenUser(CustomUser):
+    """
+    A user built from the claims of a validated access token instead of a
+    database row. It can be used wherever a CustomUser is expected as a
+    foreign key value, but it is read-only.
+    """
+
+    class Meta:
+        proxy = True
+
+    @classmethod
+    def from_claims(cls, user_id, email="", is_staff=False):
+        user = cls(user_id=user_id, email=email, is_staff=is_staff, is_active=True)
+        # Behave like a row loaded from the database
+        user._state.adding = False
+        user._state.db = "default"
+        return user
+
+    def save(self, *args, **kwargs):
+        raise TypeError("TokenUser is built from a token and cannot be saved")
+
+    def delete(self, *args, **kwargs):
+        raise TypeError("TokenUser is built from a token and cannot be deleted")
+
+
+def _count_subquery(model):
+    rows = (
+        model.objects.filter(post=OuterRef("pk"))
+        .order_by()
+        .values("post")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    return Coalesce(Subquery(rows), 0)
+
+
+class PostQuerySet(models.QuerySet):
+    def with_relations(self):
+        """
+        Posts with their author joined in the same query. The counters are
+        left out so saving these posts never overwrites them.
+        """
+        return self.select_related("author").only(
+            "id",
+            "title",
+            "content",
+            "created_at",
+            "updated_at",
+            "author__user_id",
+            "author__email",
+        )
+
+    def recompute_counters(self):
+        """
+        Recount comments and images of these posts in one UPDATE.
+        """
+        return self.update(
+            comment_count=_count_subquery(Comment),
+            image_count=_count_subquery(PostImage),
+        )
+
+    def with_feed_relations(self, comments_limit=None):
+        """
+        Posts with their images and comments prefetched.
+        When `comments_limit` is set only the newest `comments_limit` comments
+        of each post are fetched, ranked per post with ROW_NUMBER().
+        """
+        posts = self.only(
+            "id",
+            "title",
+            "content",
+            "created_at",
+            "updated_at",
+            "author_id",
+            "comment_count",
+            "image_count",
+        )
+
+        images = PostImage.objects.only(
+            "id", "image", "status", "variants", "uploaded_at", "post_id"
+        )
+        comments = Comment.objects.only(
+            "id", "content", "created_at", "updated_at", "post_id", "user_id"
+        )
+        if comments_limit is not None:
+            comments = (
+                comments.annotate(
+                    row_number=Window(
+                        expression=RowNumber(),
+                        partition_by=[F("post_id")],
+                        order_by=[F("created_at").desc(), F("id").desc()],
+                    )
+                )
+                .filter(row_number__lte=comments_limit)
+                .order_by("created_at", "id")
+            )
+        return posts.prefetch_related(
+            Prefetch("images", queryset=images),
+            Prefetch("comments", queryset=comments),
+        )
+
+
 class Post(models.Model):
     title = models.CharField(max_length=100)
     content = models.TextField()
@@ -56,20 +161,123 @@ class Post(models.Model):
     author = models.ForeignKey(
         CustomUser, on_delete=models.CASCADE, related_name="posts", to_field="user_id"
     )
+    # Denormalized counters, kept up to date with F() updates and rebuilt by
+    # the recompute_post_counters command
+    comment_count = models.PositiveIntegerField(default=0)
+    image_count = models.PositiveIntegerField(default=0)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at", "id"], name="post_feed_idx"),
+            models.Index(
+                fields=["author", "created_at"], name="post_author_created_idx"
+            ),
+        ]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        # The post_save receivers (search index, change log, fan-out, feed
+        # invalidation) commit or roll back together with the row
+        with transaction.atomic(using=kwargs.get("using"), savepoint=False):
+            super().save(*args, **kwargs)
+
+
+class ImageAsset(models.Model):
+    """
+    One stored image, shared by every PostImage with the same content.
+    """
+
+    PENDING = "pending"
+    READY = "ready"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, _("Pending")),
+        (READY, _("Ready")),
+        (FAILED, _("Failed")),
+    )
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    key = models.CharField(max_length=255)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    # Urls of the stored image and its resized copies, {variant name: url}
+    variants = models.JSONField(default=dict, blank=True)
+    # Names of every file written to the storage backend for this asset
+    stored_names = models.JSONField(default=list, blank=True)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.sha256
+
+
+class PostImageQuerySet(models.QuerySet):
+    def with_relations(self):
+        """
+        Images with their post joined in the same query.
+        """
+        return self.select_related("post").only(
+            "id",
+            "image",
+            "status",
+            "variants",
+            "uploaded_at",
+            "post__id",
+            "post__title",
+        )
+
 
 class PostImage(models.Model):
+    PENDING = "pending"
+    READY = "ready"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (PENDING, _("Pending")),
+        (READY, _("Ready")),
+        (FAILED, _("Failed")),
+    )
+
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="images")
-    image = CloudinaryField(verbose_name="Image")
+    asset = models.ForeignKey(
+        ImageAsset,
+        on_delete=models.SET_NULL,
+        related_name="post_images",
+        null=True,
+        blank=True,
+    )
+    image = CloudinaryField(verbose_name="Image", blank=True)
+    key = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=READY)
+    # Urls of the stored image and its resized copies, {variant name: url}
+    variants = models.JSONField(default=dict, blank=True)
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
+    objects = PostImageQuerySet.as_manager()
+
     def __str__(self):
         return f"Image for post {self.post.title}"
 
 
+class CommentQuerySet(models.QuerySet):
+    def with_relations(self):
+        """
+        Comments with their user and post joined in the same query.
+        """
+        return self.select_related("user", "post").only(
+            "id",
+            "content",
+            "created_at",
+            "updated_at",
+            "user__user_id",
+            "user__email",
+            "post__id",
+            "post__title",
+        )
+
+
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="comments")
     user = models.ForeignKey(
@@ -82,5 +290,159 @@ class Comment(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["post", "created_at"], name="comment_post_created_idx"
+            ),
+        ]
+
     def __str__(self):
         return f"Comment by {self.user.email} on {self.post.title}"
+
+    def save(self, *args, **kwargs):
+        # The post_save receivers (comment_count, search index, change log)
+        # commit or roll back together with the row
+        with transaction.atomic(using=kwargs.get("using"), savepoint=False):
+            super().save(*args, **kwargs)
+
+
+class Change(models.Model):
+    """
+    Change log of posts, comments and post images for incremental sync.
+    The id orders the log; only the newest entry of an object matters and
+    the compact_changes command removes older ones.
+    """
+
+    POST = "post"
+    COMMENT = "comment"
+    IMAGE = "image"
+    KIND_CHOICES = (
+        (POST, _("Post")),
+        (COMMENT, _("Comment")),
+        (IMAGE, _("Image")),
+    )
+
+    UPSERT = "upsert"
+    DELETE = "delete"
+    ACTION_CHOICES = (
+        (UPSERT, _("Upsert")),
+        (DELETE, _("Delete")),
+    )
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    object_id = models.BigIntegerField()
+    post_id = models.BigIntegerField()
+    action = models.CharField(max_length=10, choices=ACTION_CHOICES)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["kind", "object_id", "id"], name="change_object_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.action} {self.kind} {self.object_id}"
+
+
+class Follow(models.Model):
+    follower = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name="following",
+        to_field="user_id",
+    )
+    followee = models.ForeignKey(
+        CustomUser,
+        on_delete=models.CASCADE,
+        related_name="followers",
+        to_field="user_id",
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["follower", "followee"], name="unique_follow"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.follower_id} follows {self.followee_id}"
+
+
+class TimelineEntry(models.Model):
+    """
+    Home timelines, materialized on write: one row per post of the owner and
+    of the authors they follow. Reads page through the owner's rows and load
+    the posts in one query; the trim_timelines command keeps the newest
+    TIMELINE_MAX_ENTRIES of each owner.
+    """
+
+    owner = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="+", to_field="user_id"
+    )
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="+")
+    author = models.ForeignKey(
+        CustomUser, on_delete=models.CASCADE, related_name="+", to_field="user_id"
+    )
+    # Copied from the post, timelines are ordered on it
+    created_at = models.DateTimeField()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["owner", "post"], name="unique_timeline_post"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["owner", "created_at", "id"], name="timeline_owner_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"Post {self.post_id} on the timeline of {self.owner_id}"
+
+
+class Job(models.Model):
+    """
+    A background task run by myapp.tasks. Workers claim due jobs in batches
+    with a lease; a running job whose lease ran out (its worker died) is
+    claimed again. Finished jobs are kept TASKS_RETENTION_DAYS, so their
+    idempotency key keeps dropping duplicates.
+    """
+
+    QUEUED = "queued"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = (
+        (QUEUED, _("Queued")),
+        (RUNNING, _("Running")),
+        (DONE, _("Done")),
+        (FAILED, _("Failed")),
+    )
+
+    name = models.CharField(max_length=100)
+    payload = models.JSONField(default=dict, blank=True)
+    key = models.CharField(max_length=255, null=True, blank=True, unique=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    max_attempts = models.PositiveIntegerField(default=5)
+    run_at = models.DateTimeField(default=timezone.now)
+    locked_by = models.CharField(max_length=32, blank=True)
+    locked_until = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "run_at"], name="job_due_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.status})"
@@ -0,0 +1,128 @@
+# myapp/pagination.py
+import base64
+import binascii
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, pk):
+    """
+    Encode the (created_at, id) position of a row into an opaque cursor.
+    """
+    raw = f"{created_at.isoformat()}|{pk}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """
+    Decode a cursor produced by `encode_cursor` back into (created_at, id).
+    """
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        created_at, pk = base64.urlsafe_b64decode(padded).decode().split("|")
+        created_at = parse_datetime(created_at)
+        pk = int(pk)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise InvalidCursor("Invalid cursor")
+    if created_at is None:
+        raise InvalidCursor("Invalid cursor")
+    return created_at, pk
+
+
+def parse_limit(value, name, default, maximum):
+    """
+    Parse a positive integer query param, clamped to `maximum`.
+    """
+    if value in (None, ""):
+        return default
+    try:
+        limit = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be an integer")
+    if limit < 1:
+        raise ValueError(f"{name} must be greater than 0")
+    return min(limit, maximum)
+
+
+def get_page_size(value):
+    """
+    Parse the `page_size` query param, clamped to FEED_MAX_PAGE_SIZE.
+    """
+    return parse_limit(
+        value, "page_size", settings.FEED_PAGE_SIZE, settings.FEED_MAX_PAGE_SIZE
+    )
+
+
+def get_comments_limit(value):
+    """
+    Parse the `comments_limit` query param, clamped to FEED_MAX_COMMENTS_LIMIT.
+    Returns None when every comment should be included.
+    """
+    return parse_limit(value, "comments_limit", None, settings.FEED_MAX_COMMENTS_LIMIT)
+
+
+def get_offset(value):
+    """
+    Parse the cursor of offset-paginated results, e.g. search results.
+    """
+    if value in (None, ""):
+        return 0
+    try:
+        offset = int(value)
+    except (TypeError, ValueError):
+        raise InvalidCursor("Invalid cursor")
+    if offset < 0:
+        raise InvalidCursor("Invalid cursor")
+    return offset
+
+
+def keyset_queryset(queryset, cursor=None):
+    """
+    Order a queryset newest first on (created_at, id) and, when a cursor is
+    given, keep only the rows after it. Both columns are compared so rows
+    sharing a timestamp are never skipped or repeated.
+    """
+    queryset = queryset.order_by("-created_at", "-id")
+    if cursor:
+        created_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(
+            Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+        )
+    return queryset
+
+
+def paginate(queryset, cursor=None, page_size=None):
+    """
+    Return one page of `queryset` and the cursor for the next page
+    (None when this is the last page).
+    """
+    page_size = page_size or settings.FEED_PAGE_SIZE
+    # Fetch one extra row to know whether there is a next page
+    rows = list(keyset_queryset(queryset, cursor)[: page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return rows, next_cursor
+
+
+async def apaginate(queryset, cursor=None, page_size=None):
+    """
+    Async version of `paginate`, rows are fetched with async iteration.
+    """
+    page_size = page_size or settings.FEED_PAGE_SIZE
+    queryset = keyset_queryset(queryset, cursor)[: page_size + 1]
+    rows = [row async for row in queryset]
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        last = rows[-1]
+        next_cursor = encode_cursor(last.created_at, last.id)
+    return rows, next_cursor
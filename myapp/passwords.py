@@ -0,0 +1,91 @@
+# myapp/passwords.py
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+
+
+class PasswordPoolBusy(Exception):
+    pass
+
+
+def _init_worker():
+    import django
+
+    django.setup()
+
+
+def _verify(password, encoded):
+    """
+    Check a password and, when the stored hash uses an outdated hasher or
+    outdated parameters, compute its replacement.
+    Returns (is_correct, new encoded hash or None).
+    """
+    outdated = []
+    is_correct = check_password(password, encoded, setter=outdated.append)
+    return is_correct, make_password(password) if outdated else None
+
+
+def _hash(password):
+    return make_password(password)
+
+
+class PasswordPool:
+    """
+    Bounded process pool for password hashing, so hashing runs outside the
+    GIL of the API workers and a login storm can only use
+    PASSWORD_HASH_WORKERS cores. At most PASSWORD_HASH_MAX_PENDING jobs wait
+    at a time; when the pool stays full for PASSWORD_HASH_QUEUE_TIMEOUT
+    seconds callers get PasswordPoolBusy instead of queueing forever.
+    With PASSWORD_HASH_WORKERS = 0 hashing runs inline.
+    """
+
+    def __init__(self):
+        self.executor = None
+        self.slots = None
+        self.lock = threading.Lock()
+
+    def _get_executor(self):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=settings.PASSWORD_HASH_WORKERS,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                )
+                self.slots = threading.BoundedSemaphore(
+                    settings.PASSWORD_HASH_WORKERS + settings.PASSWORD_HASH_MAX_PENDING
+                )
+            return self.executor
+
+    def run(self, func, *args):
+        if not settings.PASSWORD_HASH_WORKERS:
+            return func(*args)
+        executor = self._get_executor()
+        if not self.slots.acquire(timeout=settings.PASSWORD_HASH_QUEUE_TIMEOUT):
+            raise PasswordPoolBusy("Too many password checks in progress")
+        try:
+            return executor.submit(func, *args).result()
+        finally:
+            self.slots.release()
+
+
+pool = PasswordPool()
+
+
+def hash_password(password):
+    return pool.run(_hash, password)
+
+
+def verify_user_password(user, password):
+    """
+    Check a user's password in the pool, saving the upgraded hash when the
+    stored one is outdated.
+    """
+    is_correct, new_encoded = pool.run(_verify, password, user.password)
+    if is_correct and new_encoded:
+        user.password = new_encoded
+        user.save(update_fields=["password"])
+    return is_correct
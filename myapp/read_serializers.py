@@ -0,0 +1,167 @@
+# myapp/read_serializers.py
+from collections import defaultdict
+
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from rest_framework import serializers
+
+from .models import Comment, Post, PostImage
+
+# Only the columns the feed and the change log emit are fetched, as named
+# tuples
+POST_FIELDS = (
+    "id",
+    "title",
+    "content",
+    "created_at",
+    "updated_at",
+    "author_id",
+    "comment_count",
+)
+IMAGE_FIELDS = ("post_id", "id", "image", "status", "variants", "uploaded_at")
+# Everything serialize_comment reads, the feed uses a few of them
+COMMENT_FIELDS = ("post_id", "id", "content", "created_at", "updated_at", "user_id")
+
+# The same conversions PostSerializer/PostImageSerializer apply, built once
+# instead of per serializer instance
+datetime_to_representation = serializers.DateTimeField().to_representation
+image_field = PostImage._meta.get_field("image")
+
+
+def feed_posts():
+    """
+    Feed posts as named tuples of POST_FIELDS, to be paginated with
+    pagination.paginate/keyset_queryset like the model queryset.
+    """
+    return Post.objects.values_list(*POST_FIELDS, named=True)
+
+
+def image_rows(post_ids):
+    return (
+        PostImage.objects.filter(post_id__in=post_ids)
+        .order_by("id")
+        .values_list(*IMAGE_FIELDS, named=True)
+    )
+
+
+def comment_rows(post_ids, comments_limit=None):
+    comments = Comment.objects.filter(post_id__in=post_ids)
+    if comments_limit is not None:
+        comments = comments.annotate(
+            row_number=Window(
+                expression=RowNumber(),
+                partition_by=[F("post_id")],
+                order_by=[F("created_at").desc(), F("id").desc()],
+            )
+        ).filter(row_number__lte=comments_limit)
+    return comments.order_by("created_at", "id").values_list(
+        *COMMENT_FIELDS, named=True
+    )
+
+
+def serialize_image(row):
+    image = row.image
+    if image is not None:
+        # values_list already made it a CloudinaryResource, turn it back into
+        # the stored string as PostImageSerializer's ModelField does
+        image = image_field.get_prep_value(image)
+    return {
+        "id": row.id,
+        "image": image,
+        "status": row.status,
+        "variants": row.variants,
+        "uploaded_at": datetime_to_representation(row.uploaded_at),
+    }
+
+
+def serialize_post(row):
+    """
+    PostSerializer fields of a post row, without its images.
+    """
+    return {
+        "id": row.id,
+        "title": row.title,
+        "content": row.content,
+        "created_at": datetime_to_representation(row.created_at),
+        "updated_at": datetime_to_representation(row.updated_at),
+        "author": row.author_id,
+    }
+
+
+def serialize_comment(row):
+    """
+    CommentSerializer fields of a comment row.
+    """
+    return {
+        "id": row.id,
+        "content": row.content,
+        "created_at": datetime_to_representation(row.created_at),
+        "updated_at": datetime_to_representation(row.updated_at),
+        "post": row.post_id,
+        "user": row.user_id,
+    }
+
+
+def serialize_entry(row, images, comments):
+    """
+    Feed entry for one post row, the same dict serialize_post_with_comments
+    builds from model instances.
+    """
+    post = serialize_post(row)
+    post["images"] = [serialize_image(image) for image in images]
+    return {
+        "post": post,
+        "comments": [
+            {"content": comment.content, "post": row.id, "user": comment.user_id}
+            for comment in comments
+        ],
+        "comment_count": row.comment_count,
+    }
+
+
+def group_by_post(rows):
+    grouped = defaultdict(list)
+    for row in rows:
+        grouped[row.post_id].append(row)
+    return grouped
+
+
+def serialize_feed(rows, comments_limit=None):
+    """
+    Serialize a page of post rows, with two more queries for all their
+    images and comments.
+    """
+    if not rows:
+        return []
+    post_ids = [row.id for row in rows]
+    images = group_by_post(image_rows(post_ids))
+    comments = group_by_post(comment_rows(post_ids, comments_limit))
+    return [serialize_entry(row, images[row.id], comments[row.id]) for row in rows]
+
+
+async def aserialize_feed(rows, comments_limit=None):
+    """
+    Async version of `serialize_feed`.
+    """
+    if not rows:
+        return []
+    post_ids = [row.id for row in rows]
+    images = group_by_post([image async for image in image_rows(post_ids)])
+    comments = group_by_post(
+        [comment async for comment in comment_rows(post_ids, comments_limit)]
+    )
+    return [serialize_entry(row, images[row.id], comments[row.id]) for row in rows]
+
+
+def stream_feed(rows, comments_limit=None, chunk_size=200):
+    """
+    Serialize an iterator of post rows chunk by chunk, so only one chunk
+    and its relations are in memory at a time.
+    """
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield from serialize_feed(chunk, comments_limit)
+            chunk = []
+    yield from serialize_feed(chunk, comments_limit)
@@ -0,0 +1,89 @@
+# myapp/renderers.py
+import json
+from functools import lru_cache
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+from .metrics import track_serialization
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = JSONEncoder()
+
+
+def default(obj):
+    """
+    Types orjson does not know (Decimal, lazy strings, querysets...) are
+    converted the way DRF's JSONEncoder does it.
+    """
+    return _encoder.default(obj)
+
+
+def dumps(data, indent=False):
+    """
+    Compact UTF-8 JSON bytes. orjson handles datetime, UUID and dict/list
+    subclasses natively; without it the stdlib encoder is used.
+    """
+    with track_serialization():
+        if orjson is not None:
+            option = orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS
+            if indent:
+                option |= orjson.OPT_INDENT_2
+            return orjson.dumps(data, default=default, option=option)
+        return json.dumps(
+            data,
+            cls=JSONEncoder,
+            ensure_ascii=False,
+            indent=2 if indent else None,
+            separators=None if indent else (",", ":"),
+        ).encode()
+
+
+@lru_cache(maxsize=256)
+def envelope_parts(status, message):
+    """
+    JSON before and after the data of a response_utils envelope. Messages
+    are a small fixed set, so both halves are only encoded once.
+    """
+    head = dumps({"status": status, "message": message})
+    return head[:-1] + b',"data":', b"}"
+
+
+def render_envelope(data, message="success", status="01", **extra):
+    """
+    Bytes of success_response(data, message) (or any other envelope, by
+    status) without building the wrapping dict. `extra` keys follow the
+    data, e.g. next_cursor for paginated_response.
+    """
+    head, tail = envelope_parts(status, message)
+    if extra:
+        tail = b"," + dumps(extra)[1:]
+    return head + dumps(data) + tail
+
+
+class ORJSONRenderer(BaseRenderer):
+    """
+    Drop-in replacement for DRF's JSONRenderer that encodes with orjson.
+    """
+
+    media_type = "application/json"
+    format = "json"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if orjson is None:
+            with track_serialization():
+                return JSONRenderer().render(
+                    data, accepted_media_type, renderer_context
+                )
+        renderer_context = renderer_context or {}
+        indent = JSONRenderer().get_indent(
+            accepted_media_type or self.media_type, renderer_context
+        )
+        return dumps(data, indent=bool(indent))
@@ -1,3 +1,6 @@
+from .renderers import dumps, envelope_parts
+
+
 def success_response(data, message="success"):
     """
     Utility function to create a success response.
@@ -9,6 +12,28 @@ def success_response(data, message="success"):
     }
 
 
+def paginated_response(data, next_cursor, message="success"):
+    """
+    Utility function to create a success response for one page of results.
+    """
+    response = success_response(data, message=message)
+    response["next_cursor"] = next_cursor
+    return response
+
+
+def stream_success_response(items, message="success"):
+    """
+    Utility generator that yields the success_response envelope as JSON
+    chunks, one chunk per item, so the full list is never held in memory.
+    """
+    head, tail = envelope_parts("01", message)
+    yield head + b"["
+    for index, item in enumerate(items):
+        chunk = dumps(item)
+        yield chunk if index == 0 else b"," + chunk
+    yield b"]" + tail
+
+
 def error_response(errors, message="failure"):
     """
     Utility function to create an error response.
@@ -73,3 +98,14 @@ def bad_request_response(errors, message="Bad Request"):
         "message": message,
         "data": errors,
     }
+
+
+def too_many_requests_response(message="Too many requests, please slow down"):
+    """
+    Utility function to create a rate limited response.
+    """
+    return {
+        "status": "08",
+        "message": message,
+        "data": None,
+    }
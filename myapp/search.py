@@ -0,0 +1,279 @@
+# myapp/search.py
+import re
+
+from django.db import connection
+
+POST = "post"
+COMMENT = "comment"
+KINDS = (POST, COMMENT)
+
+TABLE = "myapp_search_index"
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+SNIPPET_WORDS = 16
+
+
+def row_id(kind, object_id):
+    """
+    Index rows are addressed by a single integer so updates and deletes are
+    primary key lookups: posts use even ids and comments odd ids.
+    """
+    return object_id * 2 + KINDS.index(kind)
+
+
+class SQLiteSearchBackend:
+    """
+    FTS5 virtual table, ranked with bm25().
+    """
+
+    def create_index(self, cursor):
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABLE} USING fts5("
+            "title, content, kind UNINDEXED, object_id UNINDEXED, "
+            "post_id UNINDEXED, tokenize = 'porter unicode61')"
+        )
+
+    def drop_index(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+    def upsert(self, cursor, kind, object_id, post_id, title, content):
+        rowid = row_id(kind, object_id)
+        cursor.execute(f"DELETE FROM {TABLE} WHERE rowid = %s", [rowid])
+        cursor.execute(
+            f"INSERT INTO {TABLE} "
+            "(rowid, title, content, kind, object_id, post_id) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            [rowid, title, content, kind, object_id, post_id],
+        )
+
+    def upsert_many(self, cursor, kind, rows):
+        rowids = [[row_id(kind, object_id)] for object_id, *_ in rows]
+        cursor.executemany(f"DELETE FROM {TABLE} WHERE rowid = %s", rowids)
+        cursor.executemany(
+            f"INSERT INTO {TABLE} "
+            "(rowid, title, content, kind, object_id, post_id) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            [
+                [row_id(kind, object_id), title, content, kind, object_id, post_id]
+                for object_id, post_id, title, content in rows
+            ],
+        )
+
+    def delete(self, cursor, kind, object_id):
+        cursor.execute(
+            f"DELETE FROM {TABLE} WHERE rowid = %s", [row_id(kind, object_id)]
+        )
+
+    def delete_post_comments(self, cursor, post_id):
+        # post_id is not indexed in FTS5, find the rows through the comments
+        cursor.execute(
+            f"DELETE FROM {TABLE} WHERE rowid IN "
+            "(SELECT id * 2 + 1 FROM myapp_comment WHERE post_id = %s)",
+            [post_id],
+        )
+
+    def build_query(self, terms):
+        # Quote every term so user input is never read as FTS5 syntax
+        return " ".join('"{}"'.format(term.replace('"', '""')) for term in terms)
+
+    def search(self, cursor, terms, limit, offset):
+        cursor.execute(
+            "SELECT kind, object_id, post_id, title, "
+            f"snippet({TABLE}, 1, %s, %s, '...', %s), bm25({TABLE}) AS rank "
+            f"FROM {TABLE} WHERE {TABLE} MATCH %s "
+            "ORDER BY rank LIMIT %s OFFSET %s",
+            [
+                HIGHLIGHT_START,
+                HIGHLIGHT_END,
+                SNIPPET_WORDS,
+                self.build_query(terms),
+                limit,
+                offset,
+            ],
+        )
+        # bm25() is lower for better matches, flip it so higher is better
+        return [row[:5] + (-row[5],) for row in cursor.fetchall()]
+
+
+class PostgresSearchBackend:
+    """
+    Table with a weighted tsvector column and a GIN index, ranked with
+    ts_rank().
+    """
+
+    def create_index(self, cursor):
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {TABLE} ("
+            "id bigint PRIMARY KEY, kind varchar(10) NOT NULL, "
+            "object_id bigint NOT NULL, post_id bigint NOT NULL, "
+            "title text NOT NULL, content text NOT NULL, "
+            "document tsvector NOT NULL)"
+        )
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {TABLE}_document "
+            f"ON {TABLE} USING GIN (document)"
+        )
+        cursor.execute(
+            f"CREATE INDEX IF NOT EXISTS {TABLE}_post_id ON {TABLE} (post_id)"
+        )
+
+    def drop_index(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+
+    def upsert(self, cursor, kind, object_id, post_id, title, content):
+        self.upsert_many(cursor, kind, [(object_id, post_id, title, content)])
+
+    def upsert_many(self, cursor, kind, rows):
+        cursor.executemany(
+            f"INSERT INTO {TABLE} "
+            "(id, kind, object_id, post_id, title, content, document) "
+            "VALUES (%s, %s, %s, %s, %s, %s, "
+            "setweight(to_tsvector('english', %s), 'A') || "
+            "setweight(to_tsvector('english', %s), 'B')) "
+            "ON CONFLICT (id) DO UPDATE SET title = EXCLUDED.title, "
+            "content = EXCLUDED.content, document = EXCLUDED.document",
+            [
+                [
+                    row_id(kind, object_id),
+                    kind,
+                    object_id,
+                    post_id,
+                    title,
+                    content,
+                    title,
+                    content,
+                ]
+                for object_id, post_id, title, content in rows
+            ],
+        )
+
+    def delete(self, cursor, kind, object_id):
+        cursor.execute(f"DELETE FROM {TABLE} WHERE id = %s", [row_id(kind, object_id)])
+
+    def delete_post_comments(self, cursor, post_id):
+        cursor.execute(
+            f"DELETE FROM {TABLE} WHERE post_id = %s AND kind = %s",
+            [post_id, COMMENT],
+        )
+
+    def search(self, cursor, terms, limit, offset):
+        cursor.execute(
+            "SELECT kind, object_id, post_id, title, "
+            "ts_headline('english', content, query, %s), "
+            "ts_rank(document, query) AS rank "
+            f"FROM {TABLE}, plainto_tsquery('english', %s) query "
+            "WHERE document @@ query "
+            "ORDER BY rank DESC, id DESC LIMIT %s OFFSET %s",
+            [
+                f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_END}, "
+                f"MaxWords={SNIPPET_WORDS}, MinWords=5",
+                " ".join(terms),
+                limit,
+                offset,
+            ],
+        )
+        return cursor.fetchall()
+
+
+BACKENDS = {
+    "sqlite": SQLiteSearchBackend,
+    "postgresql": PostgresSearchBackend,
+}
+
+
+def get_backend(vendor=None):
+    """
+    Search backend for the database in use, None when it has no full-text
+    support.
+    """
+    backend = BACKENDS.get(vendor or connection.vendor)
+    return backend() if backend else None
+
+
+def tokenize(query):
+    return re.findall(r"\w+", query or "")[:32]
+
+
+def index_post(post):
+    backend = get_backend()
+    if backend:
+        with connection.cursor() as cursor:
+            backend.upsert(cursor, POST, post.id, post.id, post.title, post.content)
+
+
+def index_comment(comment):
+    backend = get_backend()
+    if backend:
+        with connection.cursor() as cursor:
+            backend.upsert(
+                cursor, COMMENT, comment.id, comment.post_id, "", comment.content
+            )
+
+
+def index_many(kind, rows):
+    """
+    Index many objects at once, `rows` are (object_id, post_id, title,
+    content) tuples. Used for bulk_create, which sends no post_save signals.
+    """
+    backend = get_backend()
+    if backend and rows:
+        with connection.cursor() as cursor:
+            backend.upsert_many(cursor, kind, rows)
+
+
+def remove(kind, object_id):
+    backend = get_backend()
+    if backend:
+        with connection.cursor() as cursor:
+            backend.delete(cursor, kind, object_id)
+
+
+def remove_post_comments(post_id):
+    """
+    Remove every comment of a post from the index in one statement.
+    """
+    backend = get_backend()
+    if backend:
+        with connection.cursor() as cursor:
+            backend.delete_post_comments(cursor, post_id)
+
+
+def search(query, limit, offset=0):
+    """
+    Ranked matches for `query` over post titles, post content and comments.
+    """
+    terms = tokenize(query)
+    backend = get_backend()
+    if not terms or backend is None:
+        return []
+    with connection.cursor() as cursor:
+        rows = backend.search(cursor, terms, limit, offset)
+    return [
+        {
+            "type": kind,
+            "id": object_id,
+            "post_id": post_id,
+            "title": title,
+            "snippet": snippet,
+            "rank": rank,
+        }
+        for kind, object_id, post_id, title, snippet, rank in rows
+    ]
+
+
+def rebuild(posts, comments):
+    """
+    Re-create the index from scratch.
+    """
+    backend = get_backend()
+    if backend is None:
+        return
+    with connection.cursor() as cursor:
+        backend.drop_index(cursor)
+        backend.create_index(cursor)
+        for post in posts:
+            backend.upsert(cursor, POST, post.id, post.id, post.title, post.content)
+        for comment in comments:
+            backend.upsert(
+                cursor, COMMENT, comment.id, comment.post_id, "", comment.content
+            )
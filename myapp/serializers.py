@@ -3,8 +3,9 @@ from rest_framework import serializers
 from .models import CustomUser, Post, Comment, PostImage
 from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
 from pprint import pprint
-import cloudinary.uploader
-import cloudinary
+from .authentication import add_user_claims
+from .image_processing import ImageTooLarge, validate_dimensions
+from .image_uploads import schedule_uploads
 
 
 class CustomUserSerializer(serializers.ModelSerializer):
@@ -17,7 +18,7 @@ class CustomUserSerializer(serializers.ModelSerializer):
 class PostImageSerializer(serializers.ModelSerializer):
     class Meta:
         model = PostImage
-        fields = ("id", "image", "uploaded_at")
+        fields = ("id", "image", "status", "variants", "uploaded_at")
 
 
 class PostSerializer(serializers.ModelSerializer):
@@ -44,14 +45,27 @@ class PostSerializer(serializers.ModelSerializer):
             "author",
         )  # Author should be read-only
 
+    def validate_images(self, images):
+        for image in images:
+            try:
+                validate_dimensions(image)
+            except ImageTooLarge as e:
+                raise serializers.ValidationError(str(e))
+        return images
+
     def create(self, validated_data):
         images = validated_data.pop("images", [])
         post = Post.objects.create(**validated_data)
-        for image in images:
-            result = cloudinary.uploader.upload(image, public_id=post.id)
-            PostImage.objects.create(post=post, image=result["secure_url"])
+        # Images are uploaded in parallel in the background, the post is
+        # returned right away with its images pending
+        schedule_uploads(post, images)
         return post
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        data["images"] = self.get_images(instance)
+        return data
+
     def get_images(self, obj):
         images = obj.images.all()
         return [PostImageSerializer(image).data for image in images]
@@ -92,7 +106,6 @@ class TokenSerializer(TokenObtainPairSerializer):
     def get_token(cls, user):
         token = super().get_token(user)
 
-        # Ensure user_id is included in the token
-        token["user_id"] = str(user.user_id)  # Convert UUID to string
-
-        return token
+        # Ensure user_id and the claims used by ClaimsJWTAuthentication
+        # are included in the token
+        return add_user_claims(token, user)
@@ -0,0 +1,139 @@
+# myapp/signals.py
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from . import (
+    authentication,
+    changes,
+    feed_cache,
+    image_uploads,
+    metrics,
+    search,
+    timelines,
+)
+from .models import Change, Comment, CustomUser, Post, PostImage
+
+# Per-request query count and time for the metrics middleware
+connection_created.connect(metrics.install_query_recorder)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_delete, sender=Post)
+@receiver(post_save, sender=Comment)
+@receiver(post_delete, sender=Comment)
+@receiver(post_save, sender=PostImage)
+@receiver(post_delete, sender=PostImage)
+def invalidate_feed_cache(sender, **kwargs):
+    # After commit: bumped inside the transaction, a concurrent miss could
+    # cache a page of the old data under the new generation
+    transaction.on_commit(feed_cache.bump_generation)
+
+
+@receiver(post_delete, sender=PostImage)
+def release_image_asset(sender, instance, origin=None, **kwargs):
+    if instance.asset_id:
+        image_uploads.release_asset(instance.asset_id)
+    # No counter to update when the post itself is being deleted
+    if not isinstance(origin, Post):
+        Post.objects.filter(pk=instance.post_id).update(
+            image_count=Greatest(F("image_count") - 1, 0)
+        )
+
+
+@receiver(post_save, sender=Comment)
+def count_comment(sender, instance, created, raw=False, **kwargs):
+    # Runs in the transaction of Comment.save, like the decrement below in
+    # the one of the delete
+    if created and not raw:
+        Post.objects.filter(pk=instance.post_id).update(
+            comment_count=F("comment_count") + 1
+        )
+
+
+@receiver(post_delete, sender=Comment)
+def uncount_comment(sender, instance, origin=None, **kwargs):
+    if not isinstance(origin, Post):
+        # Never below zero, for comments counted before this receiver existed
+        Post.objects.filter(pk=instance.post_id).update(
+            comment_count=Greatest(F("comment_count") - 1, 0)
+        )
+
+
+@receiver(post_save, sender=Post)
+def index_post(sender, instance, **kwargs):
+    search.index_post(instance)
+
+
+@receiver(pre_delete, sender=Post)
+def unindex_post_comments(sender, instance, **kwargs):
+    # One statement for all comments instead of one per cascaded delete
+    search.remove_post_comments(instance.id)
+
+
+@receiver(post_delete, sender=Post)
+def unindex_post(sender, instance, **kwargs):
+    search.remove(search.POST, instance.id)
+
+
+@receiver(post_save, sender=Comment)
+def index_comment(sender, instance, **kwargs):
+    search.index_comment(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def unindex_comment(sender, instance, origin=None, **kwargs):
+    # Comments deleted along with their post were removed by
+    # unindex_post_comments already
+    if not isinstance(origin, Post):
+        search.remove(search.COMMENT, instance.id)
+
+
+@receiver(post_save, sender=Post)
+def log_post_change(sender, instance, **kwargs):
+    changes.record(Change.POST, instance.id, instance.id)
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, **kwargs):
+    # Timeline entries only reference the post, edits need no fan-out
+    if created:
+        timelines.schedule_fan_out([instance.id])
+
+
+@receiver(pre_delete, sender=Post)
+def log_post_deletion(sender, instance, **kwargs):
+    # Tombstones for the post and everything cascaded, in one statement
+    changes.record_post_deleted(instance.id)
+
+
+@receiver(post_save, sender=Comment)
+def log_comment_change(sender, instance, **kwargs):
+    changes.record(Change.COMMENT, instance.id, instance.post_id)
+
+
+@receiver(post_save, sender=PostImage)
+def log_image_change(sender, instance, **kwargs):
+    changes.record(Change.IMAGE, instance.id, instance.post_id)
+
+
+@receiver(post_delete, sender=Comment)
+@receiver(post_delete, sender=PostImage)
+def log_deletion(sender, instance, origin=None, **kwargs):
+    # Rows deleted along with their post were logged by log_post_deletion
+    if not isinstance(origin, Post):
+        kind = Change.COMMENT if sender is Comment else Change.IMAGE
+        changes.record(kind, instance.id, instance.post_id, Change.DELETE)
+
+
+@receiver(post_save, sender=CustomUser)
+def update_user_revocation(sender, instance, **kwargs):
+    authentication.set_revoked(instance.user_id, not instance.is_active)
+
+
+@receiver(post_delete, sender=CustomUser)
+def revoke_deleted_user(sender, instance, **kwargs):
+    authentication.set_revoked(instance.user_id, True)
@@ -0,0 +1,223 @@
+# myapp/tasks.py
+import logging
+import random
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from threading import Lock
+
+from django.conf import settings
+from django.db import close_old_connections, connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Job
+
+logger = logging.getLogger(__name__)
+
+# Task functions by name, filled by the @task decorator
+registry = {}
+
+_executor = None
+_draining = 0
+_lock = Lock()
+
+
+def task(name=None, max_attempts=None):
+    """
+    Register a function as a background task, to be run with `enqueue`.
+    Its keyword arguments are stored as JSON.
+    """
+
+    def decorator(func):
+        func.task_name = name or f"{func.__module__}.{func.__name__}"
+        func.max_attempts = max_attempts
+        registry[func.task_name] = func
+        return func
+
+    return decorator
+
+
+def enqueue(func, key=None, delay=0, **kwargs):
+    """
+    Queue the task `func` with `kwargs` once the current transaction commits,
+    right away outside of one. While a job with the same `key` exists, the
+    new one is dropped.
+    """
+    transaction.on_commit(
+        lambda: insert(func.task_name, kwargs, key, delay, func.max_attempts)
+    )
+
+
+def insert(name, payload, key=None, delay=0, max_attempts=None):
+    Job.objects.bulk_create(
+        [
+            Job(
+                name=name,
+                payload=payload,
+                key=key,
+                max_attempts=max_attempts or settings.TASKS_MAX_ATTEMPTS,
+                run_at=timezone.now() + timedelta(seconds=delay),
+            )
+        ],
+        ignore_conflicts=True,
+    )
+    if settings.TASKS_EAGER:
+        run_pending()
+    elif not delay:
+        wake()
+
+
+def get_executor():
+    """
+    In-process worker pool, created once per process.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=settings.TASKS_WORKERS, thread_name_prefix="tasks"
+        )
+    return _executor
+
+
+def wake():
+    """
+    Have the in-process pool drain the queue, unless TASKS_WORKERS threads
+    already do. With TASKS_WORKERS = 0 jobs wait for the run_tasks command.
+    """
+    global _draining
+    with _lock:
+        if _draining >= settings.TASKS_WORKERS:
+            return
+        _draining += 1
+    get_executor().submit(_drain)
+
+
+def _drain():
+    global _draining
+    close_old_connections()
+    try:
+        run_pending()
+    except Exception:
+        logger.exception("Draining the task queue failed")
+    finally:
+        close_old_connections()
+        with _lock:
+            _draining -= 1
+
+
+def due_jobs(now):
+    return Q(status=Job.QUEUED, run_at__lte=now) | Q(
+        status=Job.RUNNING, locked_until__lt=now
+    )
+
+
+def claim(batch_size=None):
+    """
+    Lease up to `batch_size` due jobs to the caller, oldest first.
+    """
+    batch_size = batch_size or settings.TASKS_BATCH_SIZE
+    now = timezone.now()
+    token = uuid.uuid4().hex
+    with transaction.atomic():
+        due = Job.objects.filter(due_jobs(now)).order_by("run_at", "id")
+        if connection.features.has_select_for_update_skip_locked:
+            due = due.select_for_update(skip_locked=True)
+        ids = list(due.values_list("id", flat=True)[:batch_size])
+        # The due condition is checked again: without row locks (SQLite)
+        # another worker may have claimed some of them in the meantime
+        Job.objects.filter(due_jobs(now), id__in=ids).update(
+            status=Job.RUNNING,
+            locked_by=token,
+            locked_until=now + timedelta(seconds=settings.TASKS_LEASE_SECONDS),
+            attempts=F("attempts") + 1,
+        )
+    return list(
+        Job.objects.filter(id__in=ids, locked_by=token).order_by("run_at", "id")
+    )
+
+
+def backoff(attempts):
+    """
+    Seconds before retry number `attempts`: exponential, capped, with
+    jitter so failed jobs do not all come back at once.
+    """
+    delay = min(
+        settings.TASKS_RETRY_BASE_SECONDS * 2 ** (attempts - 1),
+        settings.TASKS_RETRY_MAX_SECONDS,
+    )
+    return delay * random.uniform(0.5, 1)
+
+
+def run_job(job):
+    """
+    Run one claimed job in a transaction, then mark it done, or queue it
+    again with backoff until it has used up its attempts.
+    """
+    jobs = Job.objects.filter(pk=job.pk, locked_by=job.locked_by)
+    try:
+        func = registry.get(job.name)
+        if func is None:
+            raise LookupError(f"Unknown task {job.name}")
+        if job.attempts > job.max_attempts:
+            # Claimed again after its lease ran out, every time: the job
+            # keeps killing its worker
+            raise RuntimeError("Lease expired on every attempt")
+        with transaction.atomic():
+            func(**job.payload)
+    except Exception:
+        logger.exception(
+            "Task failed", extra={"task": job.name, "attempts": job.attempts}
+        )
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            jobs.update(
+                status=Job.FAILED,
+                last_error=error,
+                locked_until=None,
+                finished_at=timezone.now(),
+            )
+            return False
+        jobs.update(
+            status=Job.QUEUED,
+            last_error=error,
+            locked_until=None,
+            run_at=timezone.now() + timedelta(seconds=backoff(job.attempts)),
+        )
+        return False
+    jobs.update(status=Job.DONE, locked_until=None, finished_at=timezone.now())
+    return True
+
+
+def run_in_worker(job):
+    close_old_connections()
+    try:
+        return run_job(job)
+    finally:
+        close_old_connections()
+
+
+def run_pending(batch_size=None):
+    """
+    Run due jobs on this thread until there are none left. Returns the
+    number of jobs run.
+    """
+    count = 0
+    while jobs := claim(batch_size):
+        for job in jobs:
+            run_job(job)
+        count += len(jobs)
+    return count
+
+
+def prune():
+    """
+    Delete finished jobs older than TASKS_RETENTION_DAYS. Returns the number
+    of deleted jobs.
+    """
+    cutoff = timezone.now() - timedelta(days=settings.TASKS_RETENTION_DAYS)
+    deleted, _ = Job.objects.filter(
+        status__in=(Job.DONE, Job.FAILED), finished_at__lt=cutoff
+    ).delete()
+    return deleted
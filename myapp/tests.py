@@ -1,3 +1,1330 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import shutil
+import tempfile
+import time
+import uuid
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import (
+    AsyncClient,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import (
+    authentication,
+    checks,
+    db_router,
+    feed_cache,
+    image_uploads,
+    tasks,
+    throttling,
+)
+from .image_processing import process_image
+from .image_storage import reset_image_backend
+from .models import Change, CustomUser, Post, PostImage, ImageAsset, Comment, Job
+from .renderers import ORJSONRenderer, render_envelope
+from .pagination import encode_cursor, paginate
+from .response_utils import paginated_response
+from .read_serializers import comment_rows, serialize_comment
+from .serializers import CommentSerializer, PostSerializer
+from .views import GetPostWithCommentsView, serialize_post_with_comments
+from .upload_handlers import SpooledUploadedFile
+
+
+class FeedTestMixin:
+    def setUp(self):
+        # Rate limit buckets outlive the test's transaction
+        throttling.get_cache().clear()
+        self.user = CustomUser.objects.create_user(
+            email="author@example.com", password="secret-pass-123"
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+    def create_posts(self, count, comments=0):
+        posts = []
+        # As if committed: the feed is invalidated and timelines are filled
+        # on commit
+        with self.settings(TASKS_EAGER=True), self.captureOnCommitCallbacks(
+            execute=True
+        ):
+            for i in range(count):
+                post = Post.objects.create(
+                    title=f"Post {i}", content=f"Content {i}", author=self.user
+                )
+                for j in range(comments):
+                    Comment.objects.create(post=post, user=self.user, content=f"c{j}")
+                posts.append(post)
+            Post.objects.filter(pk__in=[post.pk for post in posts]).recompute_counters()
+        return posts
+
+
+class GetPostWithCommentsViewTests(FeedTestMixin, TestCase):
+    url = reverse("get_post_with_comments")
+
+    def test_pages_follow_cursor_without_gaps(self):
+        posts = self.create_posts(5)
+
+        seen = []
+        cursor = None
+        while True:
+            params = {"page_size": 2}
+            if cursor:
+                params["cursor"] = cursor
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, 200)
+            seen += [item["post"]["id"] for item in response.data["data"]]
+            cursor = response.data["next_cursor"]
+            if cursor is None:
+                break
+
+        self.assertEqual(seen, [post.id for post in reversed(posts)])
+
+    def test_invalid_cursor_is_bad_request(self):
+        response = self.client.get(self.url, {"cursor": "not-a-cursor"})
+        self.assertEqual(response.status_code, 400)
+
+    def test_stream_returns_every_post(self):
+        self.create_posts(3, comments=2)
+
+        response = self.client.get(self.url, {"stream": "1"})
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(b"".join(response.streaming_content))
+
+        self.assertEqual(body["status"], "01")
+        self.assertEqual(len(body["data"]), 3)
+        self.assertEqual(len(body["data"][0]["comments"]), 2)
+
+    def test_comments_limit_keeps_newest_comments_and_count(self):
+        self.create_posts(2, comments=5)
+
+        response = self.client.get(self.url, {"comments_limit": 2})
+        self.assertEqual(response.status_code, 200)
+
+        for item in response.data["data"]:
+            self.assertEqual(item["comment_count"], 5)
+            self.assertEqual(
+                [comment["content"] for comment in item["comments"]], ["c3", "c4"]
+            )
+
+    def test_cached_page_is_served_until_data_changes(self):
+        post = self.create_posts(1)[0]
+        feed_cache.reset_stats()
+
+        self.client.get(self.url)
+        with self.assertNumQueries(0):
+            self.client.get(self.url)
+        self.assertEqual(feed_cache.get_stats()["hits"], 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("comment_on_post", args=[post.id]), {"content": "new"}
+            )
+        response = self.client.get(self.url)
+        self.assertEqual(response.data["data"][0]["comment_count"], 1)
+        self.assertEqual(feed_cache.get_stats()["misses"], 2)
+
+    def test_feed_is_invalidated_on_commit(self):
+        generation = feed_cache.get_generation()
+        with self.captureOnCommitCallbacks() as callbacks:
+            Post.objects.create(title="t", content="c", author=self.user)
+        # Readers must not cache pre-commit data under a new generation
+        self.assertEqual(feed_cache.get_generation(), generation)
+        self.assertIn(feed_cache.bump_generation, callbacks)
+        feed_cache.bump_generation()
+        self.assertNotEqual(feed_cache.get_generation(), generation)
+
+
+class ConditionalFeedTests(FeedTestMixin, TestCase):
+    url = reverse("get_post_with_comments")
+
+    def test_unchanged_feed_is_not_modified(self):
+        post = self.create_posts(2)[0]
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        etag = response["ETag"]
+
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["ETag"], etag)
+        self.assertEqual(response.content, b"")
+
+        last_modified = response["Last-Modified"]
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+
+        # Other pages of the same feed have their own ETag
+        response = self.client.get(self.url, {"page_size": 1}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("comment_on_post", args=[post.id]), {"content": "c"}
+            )
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+
+    def test_per_process_generation_expires(self):
+        # Another worker may have written since, this one would not know
+        feed_cache.get_cache().delete_many(
+            [feed_cache.GENERATION_KEY, feed_cache.CHANGED_AT_KEY]
+        )
+        etag = self.client.get(self.url)["ETag"]
+        later = time.time() + settings.FEED_GENERATION_TTL + 1
+        with mock.patch("time.time", return_value=later):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class ReadSerializerTests(FeedTestMixin, TestCase):
+    def test_feed_output_is_byte_identical_to_model_serializers(self):
+        posts = self.create_posts(3, comments=4)
+        PostImage.objects.create(
+            post=posts[0],
+            image="image/upload/v1/posts/a.png",
+            key="posts/a.png",
+            variants={"thumb": "https://example.com/a_thumb.webp"},
+        )
+        PostImage.objects.create(
+            post=posts[0], status=PostImage.PENDING, key="posts/b.png"
+        )
+
+        for comments_limit in (None, 2):
+            params = {"comments_limit": comments_limit} if comments_limit else {}
+            response = self.client.get(reverse("get_post_with_comments"), params)
+
+            rows, next_cursor = paginate(
+                Post.objects.with_feed_relations(comments_limit)
+            )
+            expected = paginated_response(
+                [serialize_post_with_comments(post) for post in rows],
+                next_cursor,
+                message=GetPostWithCommentsView.message,
+            )
+            self.assertEqual(response.content, ORJSONRenderer().render(expected))
+
+    def test_comment_rows_serialize_like_comment_serializer(self):
+        post = self.create_posts(1, comments=2)[0]
+        self.assertEqual(
+            [serialize_comment(row) for row in comment_rows([post.id])],
+            CommentSerializer(
+                post.comments.order_by("created_at", "id"), many=True
+            ).data,
+        )
+
+
+class QueryCountTests(FeedTestMixin, TestCase):
+    """
+    Each endpoint must run a fixed number of queries, however many rows exist.
+    """
+
+    def assertQueriesIndependentOfRows(self, num, request, target=None):
+        for rows in (1, 10):
+            self.create_posts(rows, comments=rows)
+            args = (target(),) if target else ()
+            with self.assertNumQueries(num):
+                response = request(*args)
+            self.assertLess(response.status_code, 400)
+
+    def test_get_post_with_comments(self):
+        url = reverse("get_post_with_comments")
+        self.assertQueriesIndependentOfRows(3, lambda: self.client.get(url))
+        self.assertQueriesIndependentOfRows(
+            3, lambda: self.client.get(url, {"comments_limit": 3})
+        )
+
+    def test_timelines(self):
+        author_url = reverse("user_posts", args=[self.user.pk])
+        home_url = reverse("home_timeline")
+        for rows in (1, 10):
+            self.create_posts(rows, comments=rows)
+            for num, url in ((3, author_url), (4, home_url)):
+                with self.assertNumQueries(num):
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertTrue(response.data["data"])
+
+    def test_create_post(self):
+        url = reverse("create_post")
+        self.assertQueriesIndependentOfRows(
+            5, lambda: self.client.post(url, {"title": "t", "content": "c"})
+        )
+
+    def test_comment_on_post(self):
+        post = self.create_posts(1)[0]
+        url = reverse("comment_on_post", args=[post.id])
+        self.assertQueriesIndependentOfRows(
+            6, lambda: self.client.post(url, {"content": "c"})
+        )
+
+    def test_update_post(self):
+        post = self.create_posts(1)[0]
+        url = reverse("update_post", args=[post.id])
+        self.assertQueriesIndependentOfRows(
+            6, lambda: self.client.patch(url, {"title": "new"})
+        )
+
+    def test_delete_post(self):
+        self.assertQueriesIndependentOfRows(
+            9,
+            lambda post: self.client.delete(reverse("delete_post", args=[post.id])),
+            target=lambda: Post.objects.latest("id"),
+        )
+
+    def test_delete_comment(self):
+        self.assertQueriesIndependentOfRows(
+            5,
+            lambda comment: self.client.delete(
+                reverse("delete_comment", args=[comment.id])
+            ),
+            target=lambda: Comment.objects.latest("id"),
+        )
+
+
+def make_image(name="photo.png", size=(8, 8), format="PNG", color="red"):
+    from PIL import Image
+
+    buffer = io.BytesIO()
+    Image.new("RGB", size, color).save(buffer, format=format)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type="image/png")
+
+
+class CreatePostImageUploadTests(FeedTestMixin, TestCase):
+    url = reverse("create_post")
+
+    def setUp(self):
+        super().setUp()
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root, ignore_errors=True)
+        settings_override = override_settings(
+            MEDIA_ROOT=self.media_root,
+            IMAGE_STORAGE_BACKEND="myapp.image_storage.LocalImageBackend",
+            IMAGE_UPLOAD_EAGER=True,
+            TASKS_EAGER=True,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        reset_image_backend()
+        self.addCleanup(reset_image_backend)
+
+    def test_each_image_gets_its_own_key_and_is_marked_ready(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                self.url,
+                {
+                    "title": "t",
+                    "content": "c",
+                    "images": [make_image(), make_image(color="blue")],
+                },
+                format="multipart",
+            )
+        self.assertEqual(response.status_code, 201)
+
+        images = PostImage.objects.all()
+        self.assertEqual(len(images), 2)
+        self.assertNotEqual(images[0].key, images[1].key)
+        self.assertEqual({image.status for image in images}, {PostImage.READY})
+        self.assertEqual(
+            set(images[0].variants), {"original", "thumbnail", "small", "medium"}
+        )
+
+    @override_settings(IMAGE_MAX_DIMENSIONS=(100, 100))
+    def test_oversized_image_is_rejected(self):
+        response = self.client.post(
+            self.url,
+            {"title": "t", "content": "c", "images": [make_image(size=(200, 50))]},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Post.objects.exists())
+
+    def test_processing_strips_metadata_and_resizes(self):
+        from PIL import Image
+
+        source = Image.new("RGB", (800, 400), "blue")
+        exif = Image.Exif()
+        exif[0x010F] = "Camera maker"
+        buffer = io.BytesIO()
+        source.save(buffer, format="JPEG", exif=exif)
+        buffer.seek(0)
+
+        extension, original, variants = process_image(buffer)
+
+        self.assertEqual(extension, ".webp")
+        with Image.open(io.BytesIO(original)) as image:
+            self.assertEqual(image.format, "WEBP")
+            self.assertEqual(image.size, (800, 400))
+            self.assertFalse(image.getexif())
+        with Image.open(io.BytesIO(variants["thumbnail"])) as image:
+            self.assertEqual(image.size, (150, 75))
+
+    @override_settings(IMAGE_UPLOAD_MAX_FILE_SIZE=100)
+    def test_image_over_file_limit_is_rejected_while_streaming(self):
+        response = self.client.post(
+            self.url,
+            {"title": "t", "content": "c", "images": [make_image(size=(64, 64))]},
+            format="multipart",
+        )
+        self.assertEqual(response.status_code, 413)
+        self.assertEqual(response.data["status"], "02")
+        self.assertFalse(Post.objects.exists())
+
+    def test_identical_images_share_one_asset(self):
+        image_bytes = make_image().read()
+        responses = []
+        with mock.patch(
+            "myapp.image_storage.LocalImageBackend.upload",
+            autospec=True,
+            side_effect=lambda backend, file, key: (f"/media/{key}", key),
+        ) as upload:
+            for _ in range(2):
+                with self.captureOnCommitCallbacks(execute=True):
+                    responses.append(
+                        self.client.post(
+                            self.url,
+                            {
+                                "title": "t",
+                                "content": "c",
+                                "images": [SimpleUploadedFile("a.png", image_bytes)],
+                            },
+                            format="multipart",
+                        )
+                    )
+
+        # One original plus the variants, uploaded once for both posts
+        self.assertEqual(upload.call_count, 4)
+        asset = ImageAsset.objects.get()
+        self.assertEqual(asset.ref_count, 2)
+        self.assertEqual(responses[1].data["data"]["images"][0]["status"], "ready")
+
+        with mock.patch(
+            "myapp.image_storage.LocalImageBackend.delete", autospec=True
+        ) as delete:
+            with self.captureOnCommitCallbacks(execute=True):
+                Post.objects.first().delete()
+            self.assertEqual(ImageAsset.objects.get().ref_count, 1)
+            with self.captureOnCommitCallbacks(execute=True):
+                Post.objects.first().delete()
+
+        self.assertFalse(ImageAsset.objects.exists())
+        self.assertEqual(delete.call_count, 4)
+
+    def test_lost_uploads_are_failed_then_retried(self):
+        image_bytes = make_image().read()
+
+        def post_image():
+            return self.client.post(
+                self.url,
+                {
+                    "title": "t",
+                    "content": "c",
+                    "images": [SimpleUploadedFile("a.png", image_bytes)],
+                },
+                format="multipart",
+            )
+
+        # The process dies after the commit, before the upload ran
+        with self.captureOnCommitCallbacks():
+            post_image()
+        out = io.StringIO()
+        call_command("sweep_uploads", stdout=out)
+        self.assertIn("Marked 0 lost uploads failed", out.getvalue())
+
+        ImageAsset.objects.update(created_at=timezone.now() - timedelta(hours=1))
+        call_command("sweep_uploads", stdout=out)
+        self.assertIn("Marked 1 lost uploads failed", out.getvalue())
+        self.assertEqual(ImageAsset.objects.get().status, ImageAsset.FAILED)
+        self.assertEqual(PostImage.objects.get().status, PostImage.FAILED)
+
+        # The same content uploaded again is stored for both posts
+        with self.captureOnCommitCallbacks(execute=True):
+            post_image()
+        self.assertEqual(ImageAsset.objects.get().status, ImageAsset.READY)
+        self.assertEqual(
+            set(PostImage.objects.values_list("status", flat=True)), {PostImage.READY}
+        )
+
+    def test_renamed_files_are_the_ones_deleted(self):
+        image_bytes = make_image().read()
+        storage = image_uploads.get_image_backend().storage
+        assets = []
+        for sha256 in ("a" * 64, "b" * 64):
+            # Same key, the storage renames the second asset's files
+            asset = ImageAsset.objects.create(
+                sha256=sha256, key="images/aa/same", ref_count=1
+            )
+            image_uploads.upload_asset(asset, ContentFile(image_bytes, name="a.png"))
+            assets.append(asset)
+        first, second = (set(asset.stored_names) for asset in assets)
+        self.assertEqual(len(second), 4)
+        self.assertFalse(first & second)
+        self.assertTrue(all(storage.exists(name) for name in first | second))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image_uploads.release_asset(assets[1].pk)
+        self.assertFalse(any(storage.exists(name) for name in second))
+        self.assertTrue(all(storage.exists(name) for name in first))
+
+
+class SpooledUploadedFileTests(TestCase):
+    def test_spools_to_disk_and_hashes_content(self):
+        import hashlib
+
+        data = b"x" * 300
+        file = SpooledUploadedFile("a.png", "image/png", None, {}, spool_size=100)
+        for start in range(0, len(data), 64):
+            file.write_chunk(data[start : start + 64])
+        file.complete(len(data))
+
+        self.assertTrue(hasattr(file, "temporary_file_path"))
+        self.assertEqual(file.sha256, hashlib.sha256(data).hexdigest())
+        self.assertEqual(file.read(), data)
+
+        file.detach().close()
+        self.assertFalse(file.file.closed)
+        file.release()
+        self.assertTrue(file.file.closed)
+
+
+class SearchPostsViewTests(FeedTestMixin, TestCase):
+    url = reverse("search_posts")
+
+    def test_ranked_results_with_highlighted_snippets(self):
+        post = Post.objects.create(
+            title="Django performance", content="Caching tips", author=self.user
+        )
+        other = Post.objects.create(
+            title="Gardening", content="Tomatoes and basil", author=self.user
+        )
+        comment = Comment.objects.create(
+            post=other, user=self.user, content="Django would help with tomatoes"
+        )
+
+        response = self.client.get(self.url, {"q": "django"})
+        self.assertEqual(response.status_code, 200)
+        results = response.data["data"]
+        self.assertEqual(
+            {(result["type"], result["id"]) for result in results},
+            {("post", post.id), ("comment", comment.id)},
+        )
+        comment_result = next(r for r in results if r["type"] == "comment")
+        self.assertIn("<mark>Django</mark>", comment_result["snippet"])
+        self.assertEqual(comment_result["post_id"], other.id)
+
+    def test_index_follows_updates_and_deletes(self):
+        post = Post.objects.create(title="Old", content="words", author=self.user)
+        post.title = "Renamed"
+        post.save()
+
+        self.assertEqual(self.client.get(self.url, {"q": "old"}).data["data"], [])
+        self.assertEqual(
+            len(self.client.get(self.url, {"q": "renamed"}).data["data"]), 1
+        )
+
+        post.delete()
+        self.assertEqual(self.client.get(self.url, {"q": "renamed"}).data["data"], [])
+
+    def test_query_syntax_is_not_interpreted(self):
+        response = self.client.get(self.url, {"q": 'django" OR *'})
+        self.assertEqual(response.status_code, 200)
+
+
+class PostCounterTests(FeedTestMixin, TestCase):
+    def test_counters_follow_comment_api_and_can_be_recomputed(self):
+        post = self.create_posts(1)[0]
+        url = reverse("comment_on_post", args=[post.id])
+        self.client.post(url, {"content": "a"})
+        response = self.client.post(url, {"content": "b"})
+        self.client.delete(
+            reverse("delete_comment", args=[response.data["data"]["id"]])
+        )
+
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+
+        comment = Comment.objects.create(
+            post=post, user=self.user, content="outside the api"
+        )
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 2)
+        comment.delete()
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+
+        call_command("recompute_post_counters", stdout=io.StringIO())
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 1)
+        self.assertEqual(post.image_count, 0)
+
+    def test_counters_never_go_below_zero(self):
+        post = self.create_posts(1, comments=1)[0]
+        Post.objects.filter(pk=post.pk).update(comment_count=0)
+        response = self.client.delete(
+            reverse("delete_comment", args=[post.comments.get().id])
+        )
+        self.assertEqual(response.status_code, 204)
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 0)
+
+
+# Jobs run inline: the worker pool would still hold the tables when they
+# are flushed
+@override_settings(TASKS_EAGER=True)
+class SaveReceiverTests(TransactionTestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(
+            email="author@example.com", password="secret-pass-123"
+        )
+
+    def test_failing_receiver_rolls_back_the_write(self):
+        post = Post.objects.create(title="t", content="c", author=self.user)
+        with mock.patch("myapp.changes.record", side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                Post.objects.create(title="lost", content="c", author=self.user)
+            with self.assertRaises(RuntimeError):
+                Comment.objects.create(post=post, user=self.user, content="lost")
+        self.assertEqual(list(Post.objects.values_list("title", flat=True)), ["t"])
+        self.assertFalse(Comment.objects.exists())
+        self.assertEqual(Change.objects.count(), 1)
+
+
+@override_settings(BULK_BATCH_SIZE=2)
+class BulkCreateTests(FeedTestMixin, TestCase):
+    def test_bulk_posts_are_indexed_and_invalidate_the_feed(self):
+        self.client.get(reverse("get_post_with_comments"))
+        items = [{"title": f"Imported {i}", "content": "bulk"} for i in range(5)]
+
+        with self.settings(TASKS_EAGER=True), self.captureOnCommitCallbacks(
+            execute=True
+        ):
+            response = self.client.post(
+                reverse("bulk_create_posts"), items, format="json"
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data["data"]), 5)
+        self.assertEqual(Post.objects.filter(author=self.user).count(), 5)
+
+        feed = self.client.get(reverse("get_post_with_comments"))
+        self.assertEqual(len(feed.data["data"]), 5)
+        search = self.client.get(reverse("search_posts"), {"q": "imported"})
+        self.assertEqual(len(search.data["data"]), 5)
+
+    def test_invalid_items_are_reported_by_index_and_nothing_is_written(self):
+        items = [{"title": "ok", "content": "c"}, {"title": "no content"}]
+
+        response = self.client.post(reverse("bulk_create_posts"), items, format="json")
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data["status"], "07")
+        self.assertEqual([e["index"] for e in response.data["data"]], [1])
+        self.assertIn("content", response.data["data"][0]["errors"])
+        self.assertFalse(Post.objects.exists())
+
+    def test_bulk_comments_update_the_counter(self):
+        post = self.create_posts(1)[0]
+        url = reverse("bulk_comment_on_post", args=[post.id])
+        items = [{"content": f"comment {i}"} for i in range(3)]
+
+        response = self.client.post(url, items, format="json")
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(
+            [c["content"] for c in response.data["data"]],
+            [item["content"] for item in items],
+        )
+        post.refresh_from_db()
+        self.assertEqual(post.comment_count, 3)
+
+        response = self.client.post(
+            reverse("bulk_comment_on_post", args=[0]), items, format="json"
+        )
+        self.assertEqual(response.status_code, 404)
+
+
+class RendererTests(TestCase):
+    def test_orjson_output_matches_drf_renderer(self):
+        data = [{"id": 1, "author": uuid.uuid4(), "content": "ünïcödé"}]
+        payload = paginated_response(data, "abc", message="ok")
+
+        body = ORJSONRenderer().render(payload)
+        self.assertEqual(body, JSONRenderer().render(payload))
+        self.assertEqual(render_envelope(data, "ok", next_cursor="abc"), body)
+
+
+@override_settings(CHANGES_SETTLE_SECONDS=0)
+class PostChangesViewTests(FeedTestMixin, TestCase):
+    url = reverse("post_changes")
+
+    def sync(self, since=None, **params):
+        if since:
+            params["since"] = since
+        response = self.client.get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_only_changes_since_the_token_are_returned(self):
+        kept, removed = self.create_posts(2, comments=2)
+        since = self.sync()["since"]
+
+        kept.refresh_from_db()
+        kept.title = "Edited"
+        kept.save()
+        comment = kept.comments.first()
+        self.client.delete(reverse("delete_comment", args=[comment.id]))
+        removed_comments = list(removed.comments.values_list("id", flat=True))
+        self.client.delete(reverse("delete_post", args=[removed.id]))
+
+        body = self.sync(since)
+        self.assertFalse(body["has_more"])
+        changes = {(c["type"], c["id"]): c for c in body["data"]}
+        self.assertEqual(changes["post", kept.id]["action"], "upsert")
+        self.assertEqual(changes["post", kept.id]["data"]["title"], "Edited")
+        self.assertEqual(changes["comment", comment.id]["action"], "delete")
+        self.assertEqual(changes["post", removed.id]["action"], "delete")
+        for comment_id in removed_comments:
+            self.assertEqual(changes["comment", comment_id]["action"], "delete")
+        self.assertEqual(len(changes), 3 + len(removed_comments))
+
+        self.assertEqual(self.sync(body["since"])["data"], [])
+
+    def test_pages_and_compaction(self):
+        post = self.create_posts(1)[0]
+        for title in ("a", "b", "c"):
+            post.title = title
+            post.save()
+
+        first = self.sync(page_size=2)
+        self.assertTrue(first["has_more"])
+        rest = self.sync(first["since"], page_size=10)
+        self.assertFalse(rest["has_more"])
+
+        call_command("compact_changes", stdout=io.StringIO())
+        self.assertEqual(Change.objects.filter(kind="post").count(), 1)
+        self.assertEqual(self.sync()["data"][0]["data"]["title"], "c")
+
+    def test_expired_token_requires_a_full_sync(self):
+        since = encode_cursor(timezone.now() - timedelta(days=365), 1)
+        response = self.client.get(self.url, {"since": since})
+        self.assertEqual(response.status_code, 410)
+
+        response = self.client.get(self.url, {"since": "garbage"})
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(CHANGES_SETTLE_SECONDS=60)
+    def test_recent_changes_are_held_back(self):
+        self.create_posts(1)
+        body = self.sync()
+        self.assertEqual(body["data"], [])
+        self.assertEqual(self.sync(body["since"])["data"], [])
+
+    @override_settings(
+        DEBUG=False, CHANGES_SETTLE_SECONDS=30, DATABASE_STATEMENT_TIMEOUT=30000
+    )
+    def test_settle_window_below_statement_timeout_is_reported(self):
+        self.assertEqual(
+            [warning.id for warning in checks.check_changes_settle_window(None)],
+            ["myapp.W003"],
+        )
+
+
+@override_settings(METRICS_TOKEN="s3cret")
+class MetricsTests(FeedTestMixin, TestCase):
+    def sample(self, name):
+        body = self.client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer s3cret"
+        ).content.decode()
+        for line in body.splitlines():
+            if line.startswith(name + " "):
+                return float(line.rsplit(" ", 1)[1])
+        return 0.0
+
+    def test_requests_are_timed_with_their_queries(self):
+        self.create_posts(2, comments=1)
+        queries = 'http_request_db_queries_sum{view="get_post_with_comments"}'
+        count = 'http_request_duration_seconds_count{view="get_post_with_comments",method="GET",status="200"}'
+        before = self.sample(queries), self.sample(count)
+
+        self.client.get(reverse("get_post_with_comments"), {"page_size": 7})
+
+        self.assertEqual(self.sample(queries) - before[0], 3)
+        self.assertEqual(self.sample(count) - before[1], 1)
+        self.assertGreater(
+            self.sample(
+                'http_request_serialization_duration_seconds_count{view="get_post_with_comments"}'
+            ),
+            0,
+        )
+
+    def test_streamed_feed_is_measured_once_sent(self):
+        self.create_posts(2, comments=1)
+        queries = 'http_request_db_queries_sum{view="get_post_with_comments"}'
+        count = 'http_request_duration_seconds_count{view="get_post_with_comments",method="GET",status="200"}'
+        before = self.sample(queries), self.sample(count)
+
+        response = self.client.get(reverse("get_post_with_comments"), {"stream": "1"})
+        self.assertEqual(self.sample(count), before[1])
+        b"".join(response.streaming_content)
+
+        # The posts, then their images and comments
+        self.assertEqual(self.sample(queries) - before[0], 3)
+        self.assertEqual(self.sample(count) - before[1], 1)
+
+    def test_token_is_required(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 401)
+        response = self.client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Bearer s3cret"
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(
+            b"# TYPE http_request_duration_seconds histogram", response.content
+        )
+
+    @override_settings(METRICS_TOKEN="")
+    def test_closed_without_a_token_outside_debug(self):
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 404)
+        with self.settings(DEBUG=True):
+            self.assertEqual(self.client.get(reverse("metrics")).status_code, 200)
+
+
+class AsyncViewTests(FeedTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        token = AccessToken.for_user(self.user)
+        self.headers = {"Authorization": f"Bearer {token}"}
+
+    async def test_bodies_are_validated_off_the_event_loop(self):
+        loops = []
+        is_valid = PostSerializer.is_valid
+
+        def record_loop(serializer, *args, **kwargs):
+            try:
+                loops.append(asyncio.get_running_loop())
+            except RuntimeError:
+                loops.append(None)
+            return is_valid(serializer, *args, **kwargs)
+
+        with mock.patch.object(PostSerializer, "is_valid", record_loop):
+            response = await self.async_client.post(
+                reverse("async_create_post"),
+                {"title": "Async", "content": "body"},
+                content_type="application/json",
+                headers=self.headers,
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(loops, [None])
+
+    async def test_post_lifecycle(self):
+        response = await self.async_client.post(
+            reverse("async_create_post"),
+            {"title": "Async", "content": "body"},
+            content_type="application/json",
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 201)
+        post_id = response.json()["data"]["id"]
+
+        response = await self.async_client.post(
+            reverse("async_comment_on_post", args=[post_id]),
+            {"content": "hi"},
+            content_type="application/json",
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 201)
+        comment_id = response.json()["data"]["id"]
+
+        response = await self.async_client.patch(
+            reverse("async_update_post", args=[post_id]),
+            {"title": "Renamed"},
+            content_type="application/json",
+            headers=self.headers,
+        )
+        self.assertEqual(response.json()["data"]["title"], "Renamed")
+
+        response = await self.async_client.get(
+            reverse("async_get_post_with_comments"), headers=self.headers
+        )
+        item = response.json()["data"][0]
+        self.assertEqual(item["post"]["title"], "Renamed")
+        self.assertEqual(item["comment_count"], 1)
+
+        response = await self.async_client.delete(
+            reverse("async_delete_comment", args=[comment_id]), headers=self.headers
+        )
+        self.assertEqual(response.status_code, 204)
+        response = await self.async_client.delete(
+            reverse("async_delete_post", args=[post_id]), headers=self.headers
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(await Post.objects.aexists())
+
+    def test_sync_and_async_feeds_share_a_warm_cache(self):
+        self.create_posts(2, comments=1)
+        feed_cache.get_cache().clear()
+        sync_url = reverse("get_post_with_comments")
+        async_url = reverse("async_get_post_with_comments")
+        expected = self.client.get(sync_url).json()
+        self.assertEqual(expected["status"], "01")
+        for url in (async_url, sync_url, async_url):
+            response = self.client.get(url, headers=self.headers)
+            self.assertEqual(response.json(), expected)
+
+        feed_cache.get_cache().clear()
+        self.client.get(async_url, headers=self.headers)
+        self.assertEqual(self.client.get(sync_url).json(), expected)
+
+    async def test_requires_token(self):
+        response = await AsyncClient().get(reverse("async_get_post_with_comments"))
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response.json()["status"], "03")
+
+
+class ClaimsJWTAuthenticationTests(FeedTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        response = self.client.post(
+            reverse("login"),
+            {"email": "author@example.com", "password": "secret-pass-123"},
+        )
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {response.data['data']['access']}"
+        )
+
+    def test_authenticated_read_runs_no_auth_query(self):
+        url = reverse("get_post_with_comments")
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_writes_use_token_user(self):
+        response = self.client.post(
+            reverse("create_post"), {"title": "t", "content": "c"}
+        )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Post.objects.get().author_id, self.user.user_id)
+
+    def test_deactivated_user_is_refused(self):
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.get(reverse("get_post_with_comments"))
+        self.assertEqual(response.status_code, 401)
+
+        self.user.is_active = True
+        self.user.save()
+        response = self.client.get(reverse("get_post_with_comments"))
+        self.assertEqual(response.status_code, 200)
+
+    def test_revocation_survives_a_lost_cache_entry(self):
+        self.user.is_active = False
+        self.user.save()
+        # Evicted, or the cache restarted
+        authentication.get_shared_cache().clear()
+        authentication.revocations.clear()
+        response = self.client.get(reverse("get_post_with_comments"))
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(DEBUG=False)
+    def test_per_process_revocation_cache_is_reported(self):
+        self.assertEqual(
+            [warning.id for warning in checks.check_shared_caches(None)],
+            ["myapp.W001", "myapp.W002", "myapp.W004"],
+        )
+
+    @override_settings(DEBUG=False, DATABASE_REPLICAS=["replica_0"])
+    def test_per_process_pin_cache_is_reported_with_replicas(self):
+        self.assertIn(
+            "myapp.W005",
+            [warning.id for warning in checks.check_shared_caches(None)],
+        )
+
+
+@override_settings(TASKS_EAGER=True)
+class TimelineTests(FeedTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.author = CustomUser.objects.create_user(
+            email="followed@example.com", password="secret-pass-123"
+        )
+
+    def post_as(self, user, title):
+        # Fan-out is a background task, queued on commit
+        with self.captureOnCommitCallbacks(execute=True):
+            return Post.objects.create(title=title, content="c", author=user)
+
+    def home(self, **params):
+        response = self.client.get(reverse("home_timeline"), params)
+        self.assertEqual(response.status_code, 200)
+        return [item["post"]["title"] for item in response.data["data"]]
+
+    def follow(self, user):
+        return self.client.post(reverse("follow_user", args=[user.pk]))
+
+    def test_follow_backfills_and_new_posts_fan_out(self):
+        self.post_as(self.author, "old")
+        self.post_as(self.user, "mine")
+        self.assertEqual(self.home(), ["mine"])
+
+        self.assertEqual(self.follow(self.author).status_code, 201)
+        self.assertEqual(self.follow(self.author).status_code, 200)
+        self.assertEqual(self.home(), ["mine", "old"])
+
+        self.post_as(self.author, "new")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(
+                reverse("bulk_create_posts"),
+                [{"title": "bulk", "content": "c"}],
+                format="json",
+            )
+        self.assertEqual(self.home(), ["bulk", "new", "mine", "old"])
+        self.assertEqual(self.home(page_size=3)[-1], "mine")
+
+    def test_unfollow_and_deleted_posts_leave_the_timeline(self):
+        self.follow(self.author)
+        kept = self.post_as(self.author, "kept")
+        self.post_as(self.author, "deleted").delete()
+        self.assertEqual(self.home(), ["kept"])
+
+        response = self.client.delete(reverse("follow_user", args=[self.author.pk]))
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(self.home(), [])
+        response = self.client.delete(reverse("follow_user", args=[self.author.pk]))
+        self.assertEqual(response.status_code, 404)
+        self.assertTrue(Post.objects.filter(pk=kept.pk).exists())
+
+    def test_invalid_follows(self):
+        self.assertEqual(self.follow(self.user).status_code, 400)
+        self.assertEqual(
+            self.client.post(reverse("follow_user", args=[uuid.uuid4()])).status_code,
+            404,
+        )
+
+    def test_author_posts(self):
+        self.post_as(self.author, "theirs")
+        self.post_as(self.user, "mine")
+        response = self.client.get(reverse("user_posts", args=[self.author.pk]))
+        self.assertEqual(
+            [item["post"]["title"] for item in response.data["data"]], ["theirs"]
+        )
+        response = self.client.get(reverse("user_posts", args=[uuid.uuid4()]))
+        self.assertEqual(response.status_code, 404)
+
+    @override_settings(TIMELINE_MAX_ENTRIES=2)
+    def test_trim_keeps_the_newest_entries(self):
+        for title in ("a", "b", "c"):
+            self.post_as(self.user, title)
+        call_command("trim_timelines", stdout=io.StringIO())
+        self.assertEqual(self.home(), ["c", "b"])
+        self.assertEqual(Post.objects.count(), 3)
+
+
+@override_settings(DATABASE_REPLICAS=["replica_0"])
+class ReplicaRoutingTests(FeedTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.client = APIClient()
+        response = self.client.post(
+            reverse("login"),
+            {"email": "author@example.com", "password": "secret-pass-123"},
+        )
+        self.client.credentials(
+            HTTP_AUTHORIZATION=f"Bearer {response.data['data']['access']}"
+        )
+        db_router.get_cache().clear()
+
+    def replica_reads(self, method, url, **kwargs):
+        """
+        Number of reads sent to a replica during one request. The test
+        database has no replica, the picked reads run against default.
+        """
+        with mock.patch(
+            "myapp.db_router.random.choice", return_value="default"
+        ) as choice:
+            response = getattr(self.client, method)(url, **kwargs)
+        self.assertLess(response.status_code, 400)
+        return choice.call_count
+
+    def settle_feed(self):
+        feed_cache.get_cache().set(feed_cache.CHANGED_AT_KEY, 0, timeout=None)
+
+    def test_reads_outside_requests_use_primary(self):
+        post = self.create_posts(1)[0]
+        self.assertEqual(Post.objects.all().db, "default")
+        with db_router.use_replicas():
+            self.assertEqual(Post.objects.all().db, "replica_0")
+            # Relations follow the database their instance was loaded from
+            self.assertEqual(post.comments.all().db, "default")
+        self.assertEqual(Post.objects.all().db, "default")
+
+    def test_feed_reads_from_replica_and_writes_use_primary(self):
+        self.create_posts(2, comments=1)
+        self.settle_feed()
+        self.assertEqual(
+            self.replica_reads("get", reverse("get_post_with_comments")), 3
+        )
+        self.assertEqual(
+            self.replica_reads(
+                "post", reverse("create_post"), data={"title": "t", "content": "c"}
+            ),
+            0,
+        )
+
+    def test_recent_write_pins_reads_to_primary(self):
+        response = self.client.post(
+            reverse("create_post"), {"title": "Mine", "content": "c"}
+        )
+        post_id = response.json()["data"]["id"]
+        self.settle_feed()
+        url = reverse("get_post_with_comments")
+        self.assertEqual(self.replica_reads("get", url, data={"page_size": 3}), 0)
+
+        db_router.get_cache().delete(db_router.pin_key(self.user.pk))
+        self.assertEqual(self.replica_reads("get", url, data={"page_size": 4}), 3)
+
+        self.client.delete(reverse("delete_post", args=[post_id]))
+        self.assertEqual(self.replica_reads("get", url, data={"page_size": 5}), 0)
+
+    def test_feed_changed_within_pin_window_is_built_from_primary(self):
+        other = CustomUser.objects.create_user(
+            email="other@example.com", password="secret-pass-123"
+        )
+        self.create_posts(1)
+        feed_cache.bump_generation()
+        # Another user's feed: not pinned, but the change is too recent
+        self.client.force_authenticate(user=other)
+        url = reverse("get_post_with_comments")
+        self.assertEqual(self.replica_reads("get", url), 0)
+
+        self.settle_feed()
+        feed_cache.bump_generation()
+        self.settle_feed()
+        self.assertEqual(self.replica_reads("get", url), 3)
+
+    def test_change_log_is_read_from_primary(self):
+        self.create_posts(2, comments=1)
+        self.assertEqual(self.replica_reads("get", reverse("post_changes")), 0)
+
+
+class PasswordPolicyTests(TestCase):
+    def login(self, password):
+        return APIClient().post(
+            reverse("login"), {"email": "old@example.com", "password": password}
+        )
+
+    def test_outdated_hash_is_upgraded_on_login(self):
+        user = CustomUser.objects.create(
+            email="old@example.com",
+            password=make_password("secret-pass-123", hasher="pbkdf2_sha256"),
+        )
+
+        with override_settings(PASSWORD_HASH_WORKERS=0):
+            self.assertEqual(self.login("wrong").status_code, 401)
+            user.refresh_from_db()
+            self.assertTrue(user.password.startswith("pbkdf2_sha256$"))
+
+            self.assertEqual(self.login("secret-pass-123").status_code, 200)
+        user.refresh_from_db()
+        self.assertTrue(user.password.startswith("scrypt$"))
+
+    def test_login_verifies_in_process_pool(self):
+        CustomUser.objects.create_user(
+            email="old@example.com", password="secret-pass-123"
+        )
+        with override_settings(PASSWORD_HASH_WORKERS=1):
+            self.assertEqual(self.login("secret-pass-123").status_code, 200)
+
+
+class TestDbCommandTests(TestCase):
+    def test_reports_latency_of_every_database(self):
+        out = io.StringIO()
+        call_command("test_db", samples=3, concurrency=2, stdout=out)
+        output = out.getvalue()
+        self.assertIn("default (sqlite)", output)
+        self.assertRegex(output, r"round trip: p50=[\d.]+ms p95=[\d.]+ms")
+        self.assertIn("Database connection successful", output)
+
+
+@override_settings(RATE_LIMITS={"default": "", "login": "2/min", "feed": "2/min"})
+class ThrottlingTests(FeedTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.feed = reverse("get_post_with_comments")
+
+    def assertThrottled(self, response):
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.json()["status"], "08")
+        self.assertGreaterEqual(int(response["Retry-After"]), 1)
+
+    def test_buckets_are_per_user_and_per_scope(self):
+        for _ in range(2):
+            self.assertEqual(self.client.get(self.feed).status_code, 200)
+        self.assertThrottled(self.client.get(self.feed))
+        # Views of another scope, here without a limit
+        response = self.client.get(reverse("search_posts"), {"q": "post"})
+        self.assertEqual(response.status_code, 200)
+
+        other = APIClient()
+        other.force_authenticate(
+            CustomUser.objects.create_user(
+                email="other@example.com", password="secret-pass-123"
+            )
+        )
+        self.assertEqual(other.get(self.feed).status_code, 200)
+
+    def test_tokens_refill_over_time(self):
+        now = 1_700_000_000.0
+        with mock.patch("myapp.throttling.time.time", return_value=now):
+            self.client.get(self.feed)
+            self.client.get(self.feed)
+            response = self.client.get(self.feed)
+        self.assertThrottled(response)
+        self.assertEqual(response["Retry-After"], "30")
+        # One token back every 30 seconds, the denied request took none
+        with mock.patch("myapp.throttling.time.time", return_value=now + 30):
+            self.assertEqual(self.client.get(self.feed).status_code, 200)
+            self.assertThrottled(self.client.get(self.feed))
+
+    def test_login_is_limited_per_ip(self):
+        client = APIClient()
+        data = {"email": self.user.email, "password": "wrong"}
+        for _ in range(2):
+            self.assertEqual(client.post(reverse("login"), data).status_code, 401)
+        self.assertThrottled(client.post(reverse("login"), data))
+        other = APIClient(REMOTE_ADDR="10.0.0.2")
+        self.assertEqual(other.post(reverse("login"), data).status_code, 401)
+
+    def test_spoofed_forwarded_for_shares_the_bucket(self):
+        data = {"email": self.user.email, "password": "wrong"}
+        for index in range(2):
+            client = APIClient(HTTP_X_FORWARDED_FOR=f"203.0.113.{index}")
+            self.assertEqual(client.post(reverse("login"), data).status_code, 401)
+        client = APIClient(HTTP_X_FORWARDED_FOR="203.0.113.9")
+        self.assertThrottled(client.post(reverse("login"), data))
+
+    def test_forwarded_for_of_trusted_proxies(self):
+        data = {"email": self.user.email, "password": "wrong"}
+        rest_framework = dict(settings.REST_FRAMEWORK, NUM_PROXIES=1)
+        with self.settings(REST_FRAMEWORK=rest_framework):
+            for _ in range(2):
+                # Only the entry the proxy appended counts, not the spoofed one
+                client = APIClient(
+                    HTTP_X_FORWARDED_FOR=f"{uuid.uuid4().hex}, 198.51.100.1"
+                )
+                self.assertEqual(client.post(reverse("login"), data).status_code, 401)
+            self.assertThrottled(
+                APIClient(HTTP_X_FORWARDED_FOR="198.51.100.1").post(
+                    reverse("login"), data
+                )
+            )
+            client = APIClient(HTTP_X_FORWARDED_FOR="198.51.100.2")
+            self.assertEqual(client.post(reverse("login"), data).status_code, 401)
+
+    async def test_async_views_share_the_buckets(self):
+        headers = {"Authorization": f"Bearer {AccessToken.for_user(self.user)}"}
+        url = reverse("async_get_post_with_comments")
+        for _ in range(2):
+            response = await self.async_client.get(url, headers=headers)
+            self.assertEqual(response.status_code, 200)
+        self.assertThrottled(await self.async_client.get(url, headers=headers))
+
+    def test_bench_throttle_command(self):
+        out = io.StringIO()
+        call_command("bench_throttle", checks=50, users=5, budget_ms=1000, stdout=out)
+        self.assertRegex(out.getvalue(), r"allowed +[\d.]+ +[\d.]+")
+
+
+calls = []
+
+
+@tasks.task(name="tests.record", max_attempts=2)
+def record(value, fail=False):
+    calls.append(value)
+    if fail:
+        raise ValueError(value)
+
+
+@override_settings(TASKS_WORKERS=0)
+class TaskQueueTests(TestCase):
+    def setUp(self):
+        calls.clear()
+
+    def enqueue(self, **kwargs):
+        with self.captureOnCommitCallbacks(execute=True):
+            tasks.enqueue(record, **kwargs)
+
+    def test_jobs_run_once_per_key(self):
+        self.enqueue(key="a", value=1)
+        self.enqueue(key="a", value=2)
+        self.enqueue(value=3)
+        self.assertEqual(Job.objects.count(), 2)
+        self.assertEqual(tasks.run_pending(), 2)
+        self.assertEqual(calls, [1, 3])
+        self.assertEqual(tasks.run_pending(), 0)
+        self.assertFalse(Job.objects.exclude(status=Job.DONE).exists())
+
+    def test_jobs_wait_for_the_transaction(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            tasks.enqueue(record, value=1)
+        self.assertFalse(Job.objects.exists())
+        self.assertEqual(len(callbacks), 1)
+
+    def test_failed_jobs_retry_with_backoff_then_fail(self):
+        self.enqueue(value=1, fail=True)
+        self.assertEqual(tasks.run_pending(), 1)
+        job = Job.objects.get()
+        self.assertEqual((job.status, job.attempts), (Job.QUEUED, 1))
+        self.assertGreater(job.run_at, timezone.now())
+        self.assertIn("ValueError", job.last_error)
+        # Not due yet
+        self.assertEqual(tasks.run_pending(), 0)
+
+        Job.objects.update(run_at=timezone.now())
+        self.assertEqual(tasks.run_pending(), 1)
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), (Job.FAILED, 2))
+        self.assertEqual(calls, [1, 1])
+
+    def test_expired_leases_are_claimed_again(self):
+        self.enqueue(value=1)
+        (job,) = tasks.claim()
+        self.assertEqual(tasks.claim(), [])
+        Job.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        (again,) = tasks.claim()
+        self.assertEqual((again.pk, again.attempts), (job.pk, 2))
+        # The first worker lost its lease and cannot finish the job anymore
+        tasks.run_job(job)
+        self.assertEqual(Job.objects.get().status, Job.RUNNING)
+        self.assertTrue(tasks.run_job(again))
+        self.assertEqual(Job.objects.get().status, Job.DONE)
+
+    def test_prune_deletes_old_finished_jobs(self):
+        self.enqueue(value=1)
+        self.enqueue(value=2, fail=True)
+        tasks.run_pending()
+        Job.objects.update(finished_at=timezone.now() - timedelta(days=30))
+        self.assertEqual(tasks.prune(), 1)
+        self.assertEqual(Job.objects.get().status, Job.QUEUED)
+
+    def test_run_tasks_command_exits_when_nothing_is_due(self):
+        # Workers run on their own connections, which cannot see the data of
+        # a TestCase: only jobs that are not due yet
+        self.enqueue(value=1, delay=60)
+        out = io.StringIO()
+        call_command("run_tasks", once=True, workers=1, stdout=out)
+        self.assertIn("Ran 0 jobs, 0 failed", out.getvalue())
+        self.assertEqual(Job.objects.get().status, Job.QUEUED)
@@ -0,0 +1,164 @@
+# myapp/throttling.py
+import math
+import time
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework import status
+from rest_framework.exceptions import Throttled
+from rest_framework.response import Response
+from rest_framework.throttling import BaseThrottle
+
+from .response_utils import too_many_requests_response
+
+PERIODS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+
+
+def get_cache():
+    return caches[settings.RATE_LIMIT_CACHE_ALIAS]
+
+
+@lru_cache(maxsize=64)
+def parse_rate(rate):
+    """
+    "<requests>/<period>" as (burst, milliseconds per token): bursts of up to
+    <requests>, refilled evenly over second, minute, hour or day. None for
+    an empty rate, which means no limit.
+    """
+    if not rate:
+        return None
+    count, period = rate.split("/")
+    count = int(count)
+    return count, max(PERIODS[period[0]] * 1000 // count, 1)
+
+
+def bucket_key(scope, ident):
+    return f"throttle:{scope}:{ident}"
+
+
+def get_rate(scope):
+    rates = settings.RATE_LIMITS
+    return parse_rate(rates.get(scope, rates.get("default")))
+
+
+def settle(tat, now, burst, interval):
+    """
+    Decide a request from the theoretical arrival time `tat` of its bucket,
+    just pushed one token ahead (generic cell rate algorithm): it passes
+    unless `tat` got more than `burst` tokens ahead of now. Returns the
+    seconds to wait, None when it passes, and the cache update to make.
+    """
+    if tat is None or tat - interval < now:
+        # A full bucket, or no key: start over from now. Requests racing
+        # here may each pass, at most one token too many apiece
+        return None, ("set", now + interval)
+    excess = tat - now - burst * interval
+    if excess > 0:
+        # Denied requests give their token back
+        return excess / 1000, ("decr", interval)
+    # The key must outlive the bucket's debt, incr keeps its old expiry
+    return None, ("touch", None)
+
+
+def take(scope, ident):
+    """
+    Take a token from the bucket of `ident` for `scope`. Returns None when
+    the request may go on, else the seconds until it may be retried.
+    """
+    rate = get_rate(scope)
+    if rate is None:
+        return None
+    burst, interval = rate
+    cache = get_cache()
+    key = bucket_key(scope, ident)
+    timeout = burst * interval // 1000 + 1
+    now = int(time.time() * 1000)
+    try:
+        tat = cache.incr(key, interval)
+    except ValueError:
+        tat = None
+    wait, (op, value) = settle(tat, now, burst, interval)
+    if op == "set":
+        cache.set(key, value, timeout=timeout)
+    elif op == "decr":
+        cache.decr(key, value)
+    else:
+        cache.touch(key, timeout=timeout)
+    return wait
+
+
+async def atake(scope, ident):
+    rate = get_rate(scope)
+    if rate is None:
+        return None
+    burst, interval = rate
+    cache = get_cache()
+    key = bucket_key(scope, ident)
+    timeout = burst * interval // 1000 + 1
+    now = int(time.time() * 1000)
+    try:
+        tat = await cache.aincr(key, interval)
+    except ValueError:
+        tat = None
+    wait, (op, value) = settle(tat, now, burst, interval)
+    if op == "set":
+        await cache.aset(key, value, timeout=timeout)
+    elif op == "decr":
+        await cache.adecr(key, value)
+    else:
+        await cache.atouch(key, timeout=timeout)
+    return wait
+
+
+def get_ident(request, view):
+    """
+    What a bucket belongs to: the user ID from the JWT, or the client IP for
+    anonymous requests and views that set `throttle_per_ip`. The IP is
+    REMOTE_ADDR, or the X-Forwarded-For entry of the first of NUM_PROXIES
+    trusted proxies.
+    """
+    user = getattr(request, "user", None)
+    if getattr(view, "throttle_per_ip", False) or not (user and user.is_authenticated):
+        return f"ip:{BaseThrottle().get_ident(request)}"
+    return f"user:{user.pk}"
+
+
+def get_scope(view):
+    return getattr(view, "throttle_scope", None) or "default"
+
+
+def retry_after(wait):
+    return str(max(math.ceil(wait), 1))
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Token bucket per user (or client IP) and per view `throttle_scope`, with
+    the rates of RATE_LIMITS. Costs two shared cache operations and no
+    database query.
+    """
+
+    def allow_request(self, request, view):
+        self.wait_seconds = take(get_scope(view), get_ident(request, view))
+        return self.wait_seconds is None
+
+    def wait(self):
+        return self.wait_seconds
+
+
+def exception_handler(exc, context):
+    """
+    DRF's exception handler, with throttled requests answered in the
+    response_utils envelope.
+    """
+    # rest_framework.views loads the throttle classes, so not at import time
+    from rest_framework.views import exception_handler as drf_exception_handler
+
+    if isinstance(exc, Throttled):
+        return Response(
+            too_many_requests_response(),
+            status=status.HTTP_429_TOO_MANY_REQUESTS,
+            headers={"Retry-After": retry_after(exc.wait or 0)},
+        )
+    return drf_exception_handler(exc, context)
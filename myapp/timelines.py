@@ -0,0 +1,145 @@
+# myapp/timelines.py
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+
+from . import tasks
+from .models import Follow, Post, TimelineEntry
+from .pagination import paginate
+from .read_serializers import feed_posts, serialize_feed
+
+
+@tasks.task()
+def fan_out(post_ids):
+    """
+    Add posts to the home timelines of their authors and of everyone
+    following them, in a single statement. Runs as a background task: posts
+    deleted since are skipped, entries already there (a retry, or a follow
+    backfill) are left alone.
+    """
+    if not post_ids:
+        return
+    placeholders = ", ".join(["%s"] * len(post_ids))
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {TimelineEntry._meta.db_table} "
+            "(owner_id, post_id, author_id, created_at) "
+            "SELECT f.follower_id, p.id, p.author_id, p.created_at "
+            f"FROM {Post._meta.db_table} p JOIN {Follow._meta.db_table} f "
+            f"ON f.followee_id = p.author_id WHERE p.id IN ({placeholders}) "
+            "UNION ALL "
+            "SELECT p.author_id, p.id, p.author_id, p.created_at "
+            f"FROM {Post._meta.db_table} p WHERE p.id IN ({placeholders}) "
+            "ON CONFLICT DO NOTHING",
+            [*post_ids, *post_ids],
+        )
+
+
+def schedule_fan_out(post_ids):
+    """
+    Fan posts out in the background once the transaction commits.
+    """
+    tasks.enqueue(
+        fan_out, key=f"fan_out:{post_ids[0]}:{len(post_ids)}", post_ids=post_ids
+    )
+
+
+def follow(follower_id, followee_id):
+    """
+    Follow an author and copy their newest posts into the follower's
+    timeline. Returns False when the follow already existed.
+    """
+    with transaction.atomic():
+        _, created = Follow.objects.get_or_create(
+            follower_id=follower_id, followee_id=followee_id
+        )
+        if created:
+            posts = (
+                Post.objects.filter(author_id=followee_id)
+                .order_by("-created_at", "-id")
+                .values_list("id", "created_at")[: settings.TIMELINE_MAX_ENTRIES]
+            )
+            TimelineEntry.objects.bulk_create(
+                [
+                    TimelineEntry(
+                        owner_id=follower_id,
+                        post_id=post_id,
+                        author_id=followee_id,
+                        created_at=created_at,
+                    )
+                    for post_id, created_at in posts
+                ],
+                ignore_conflicts=True,
+            )
+    return created
+
+
+def unfollow(follower_id, followee_id):
+    """
+    Stop following an author and drop their posts from the follower's
+    timeline. Returns False when there was no such follow.
+    """
+    with transaction.atomic():
+        deleted, _ = Follow.objects.filter(
+            follower_id=follower_id, followee_id=followee_id
+        ).delete()
+        if deleted:
+            TimelineEntry.objects.filter(
+                owner_id=follower_id, author_id=followee_id
+            ).delete()
+    return bool(deleted)
+
+
+def home_page(owner_id, cursor, page_size, comments_limit=None):
+    """
+    One page of a home timeline and the next cursor: the page of entries,
+    then its posts in one query, serialized like the feed.
+    """
+    entries, next_cursor = paginate(
+        TimelineEntry.objects.filter(owner_id=owner_id).values_list(
+            "id", "post_id", "created_at", named=True
+        ),
+        cursor,
+        page_size,
+    )
+    posts = {
+        row.id: row
+        for row in feed_posts().filter(id__in=[entry.post_id for entry in entries])
+    }
+    rows = [posts[entry.post_id] for entry in entries if entry.post_id in posts]
+    return serialize_feed(rows, comments_limit), next_cursor
+
+
+def author_page(author_id, cursor, page_size, comments_limit=None):
+    """
+    One page of an author's posts and the next cursor. Served straight from
+    the (author, created_at) index, it needs no materialized copy.
+    """
+    rows, next_cursor = paginate(
+        feed_posts().filter(author_id=author_id), cursor, page_size
+    )
+    return serialize_feed(rows, comments_limit), next_cursor
+
+
+def trim():
+    """
+    Delete the entries past the newest TIMELINE_MAX_ENTRIES of each owner.
+    Returns the number of deleted entries.
+    """
+    ranked = TimelineEntry.objects.annotate(
+        rank=Window(
+            expression=RowNumber(),
+            partition_by=[F("owner_id")],
+            order_by=[F("created_at").desc(), F("id").desc()],
+        )
+    ).filter(rank__gt=settings.TIMELINE_MAX_ENTRIES)
+    ids = list(ranked.values_list("id", flat=True))
+    deleted = 0
+    size = settings.BULK_BATCH_SIZE
+    for start in range(0, len(ids), size):
+        count, _ = TimelineEntry.objects.filter(
+            id__in=ids[start : start + size]
+        ).delete()
+        deleted += count
+    return deleted
@@ -0,0 +1,129 @@
+# myapp/upload_handlers.py
+import hashlib
+import io
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+
+class UploadTooLarge(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = "Upload too large"
+    default_code = "upload_too_large"
+
+
+class SpooledUploadedFile(UploadedFile):
+    """
+    An uploaded file kept in memory until it grows past `spool_size`, then
+    moved to a named temporary file. The sha256 of the content is computed
+    while it is written.
+
+    A detached file is no longer closed when the request ends, so it can be
+    handed to a background worker, which calls `release()` when done.
+    """
+
+    def __init__(self, name, content_type, charset, content_type_extra, spool_size):
+        super().__init__(
+            io.BytesIO(), name, content_type, 0, charset, content_type_extra
+        )
+        self.spool_size = spool_size
+        self.hasher = hashlib.sha256()
+        self.sha256 = None
+        self.detached = False
+
+    def write_chunk(self, data):
+        self.hasher.update(data)
+        if not hasattr(self, "temporary_file_path") and (
+            self.file.tell() + len(data) > self.spool_size
+        ):
+            self._rollover()
+        self.file.write(data)
+
+    def _rollover(self):
+        _, ext = os.path.splitext(self.name or "")
+        disk_file = tempfile.NamedTemporaryFile(
+            suffix=".upload" + ext, dir=settings.FILE_UPLOAD_TEMP_DIR
+        )
+        disk_file.write(self.file.getbuffer())
+        self.file = disk_file
+        # Only defined once the data is on disk: Django's ImageField reads
+        # files without a temporary_file_path fully into memory to verify them
+        self.temporary_file_path = lambda: disk_file.name
+
+    def complete(self, size):
+        self.size = size
+        self.sha256 = self.hasher.hexdigest()
+        self.file.seek(0)
+        return self
+
+    def detach(self):
+        self.detached = True
+        return self
+
+    def close(self):
+        if not self.detached:
+            self.release()
+
+    def release(self):
+        try:
+            self.file.close()
+        except FileNotFoundError:
+            pass
+
+
+class StreamingUploadHandler(FileUploadHandler):
+    """
+    Upload handler for post images. Files are spooled to disk above
+    IMAGE_UPLOAD_SPOOL_SIZE and hashed as they stream in. The size limits
+    are enforced while reading, so an oversized upload is rejected before
+    the rest of the body is read.
+    """
+
+    chunk_size = 64 * 1024
+
+    def __init__(self, request=None):
+        super().__init__(request)
+        self.max_file_size = settings.IMAGE_UPLOAD_MAX_FILE_SIZE
+        self.max_request_size = settings.IMAGE_UPLOAD_MAX_REQUEST_SIZE
+        self.received = 0
+
+    def handle_raw_input(
+        self, input_data, META, content_length, boundary, encoding=None
+    ):
+        # Reject from the Content-Length header alone when we can
+        if content_length and content_length > self.max_request_size:
+            raise UploadTooLarge(f"Request body exceeds {self.max_request_size} bytes")
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = SpooledUploadedFile(
+            self.file_name,
+            self.content_type,
+            self.charset,
+            self.content_type_extra,
+            settings.IMAGE_UPLOAD_SPOOL_SIZE,
+        )
+        self.file_size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file_size += len(raw_data)
+        self.received += len(raw_data)
+        if self.file_size > self.max_file_size:
+            self.upload_interrupted()
+            raise UploadTooLarge(f"{self.file_name} exceeds {self.max_file_size} bytes")
+        if self.received > self.max_request_size:
+            self.upload_interrupted()
+            raise UploadTooLarge(f"Uploaded files exceed {self.max_request_size} bytes")
+        self.file.write_chunk(raw_data)
+
+    def file_complete(self, file_size):
+        return self.file.complete(file_size)
+
+    def upload_interrupted(self):
+        if hasattr(self, "file"):
+            self.file.release()
@@ -1,4 +1,6 @@
 # myapp/views.py
+import logging
+
 from django.contrib.auth.hashers import make_password
 from rest_framework import status
 from rest_framework.response import Response
@@ -7,38 +9,73 @@ from rest_framework_simplejwt.tokens import RefreshToken
 from .models import CustomUser, Post, Comment
 from .serializers import CustomUserSerializer, PostSerializer, CommentSerializer
 from rest_framework.permissions import IsAuthenticated
-from django.db.models import Prefetch
+from django.conf import settings
+from django.db.models import prefetch_related_objects
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from . import changes, db_router, feed_cache, metrics, search, timelines
+from .bulk import create_comments, create_posts, item_errors
+from .read_serializers import feed_posts, serialize_feed, stream_feed
+from .upload_handlers import StreamingUploadHandler, UploadTooLarge
+from .pagination import (
+    get_comments_limit,
+    get_offset,
+    get_page_size,
+    keyset_queryset,
+    paginate,
+)
 from .response_utils import (
     success_response,
+    paginated_response,
+    stream_success_response,
     error_response,
     not_found_response,
     bad_request_response,
     unauthorized_response,
 )
 
+logger = logging.getLogger(__name__)
+
 
 class CreatePostView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_scope = "write"
 
     def post(self, request):
-        print("Request Data:", request.data)
+        # Stream uploaded images instead of buffering them, must be set
+        # before request.data is first read
+        request.upload_handlers = [StreamingUploadHandler(request)]
+        try:
+            data = request.data
+        except UploadTooLarge as e:
+            return Response(
+                error_response(e.detail, message="Upload too large"),
+                status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            )
+        logger.debug(
+            "Create post request",
+            extra={
+                "user_id": str(request.user.pk),
+                "fields": sorted(data.keys()),
+                "images": len(request.FILES.getlist("images")),
+            },
+        )
         # Initialize the serializer with the incoming request data and context
 
-        post_serializer = PostSerializer(
-            data=request.data, context={"request": request}
-        )
+        post_serializer = PostSerializer(data=data, context={"request": request})
         # Check if the data is valid according to the serializer's validation rules
 
         if post_serializer.is_valid():
             # Save the post instance with the current user as the author
             post_serializer.save(author=request.user)
+            db_router.mark_recent_write(request.user.pk)
 
             # Return a success response with the serialized data and a 201 Created status code
             return Response(
                 success_response(
-                    success_response(
-                        post_serializer.data, message="post created successfully"
-                    )
+                    post_serializer.data, message="post created successfully"
                 ),
                 status=status.HTTP_201_CREATED,
             )
@@ -53,10 +90,11 @@ class CreatePostView(APIView):
 
 class CommentOnPostView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_scope = "write"
 
     def post(self, request, post_id):
         try:
-            post = Post.objects.get(id=post_id)
+            post = Post.objects.with_relations().get(id=post_id)
         except Post.DoesNotExist:
             return Response(
                 {"error": "Post not found"}, status=status.HTTP_404_NOT_FOUND
@@ -69,6 +107,7 @@ class CommentOnPostView(APIView):
 
         if serializer.is_valid():
             serializer.save()  # ✅ Now 'request' and 'post' are available in create()
+            db_router.mark_recent_write(request.user.pk)
             return Response(
                 success_response(serializer.data), status=status.HTTP_201_CREATED
             )
@@ -76,57 +115,364 @@ class CommentOnPostView(APIView):
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class BulkCreatePostsView(APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_scope = "bulk"
+
+    def post(self, request):
+        # Validate the whole array first, nothing is written if any item fails
+        serializer = PostSerializer(
+            data=request.data,
+            many=True,
+            allow_empty=False,
+            max_length=settings.BULK_MAX_ITEMS,
+            context={"request": request},
+        )
+        if not serializer.is_valid():
+            return Response(
+                bad_request_response(item_errors(serializer.errors)),
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        items = serializer.validated_data
+        for item in items:
+            # Images go through posts/, a JSON array cannot carry files
+            item.pop("images", None)
+        posts = create_posts(request.user, items)
+        db_router.mark_recent_write(request.user.pk)
+        prefetch_related_objects(posts, "images")
+
+        return Response(
+            success_response(
+                PostSerializer(posts, many=True).data,
+                message="posts created successfully",
+            ),
+            status=status.HTTP_201_CREATED,
+        )
+
+
+class BulkCommentOnPostView(APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_scope = "bulk"
+
+    def post(self, request, post_id):
+        try:
+            post = Post.objects.only("id").get(id=post_id)
+        except Post.DoesNotExist:
+            return Response(
+                not_found_response("Post not found"), status=status.HTTP_404_NOT_FOUND
+            )
+
+        serializer = CommentSerializer(
+            data=request.data,
+            many=True,
+            allow_empty=False,
+            max_length=settings.BULK_MAX_ITEMS,
+            context={"request": request, "post": post},
+        )
+        if not serializer.is_valid():
+            return Response(
+                bad_request_response(item_errors(serializer.errors)),
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        comments = create_comments(post, request.user, serializer.validated_data)
+        db_router.mark_recent_write(request.user.pk)
+        return Response(
+            success_response(
+                CommentSerializer(comments, many=True).data,
+                message="comments created successfully",
+            ),
+            status=status.HTTP_201_CREATED,
+        )
+
+
+def serialize_post_with_comments(post):
+    """
+    Build the feed entry for a single post and its comments, from model
+    instances. The feed itself is served by read_serializers, which must
+    produce the same output.
+    """
+    # Serialize the post
+    post_serializer = PostSerializer(post)
+
+    # Serialize the comments
+    comments_serializer = CommentSerializer(post.comments.all(), many=True)
+
+    filtered_comments = [
+        {
+            "content": comment["content"],
+            "post": comment["post"],
+            "user": comment["user"],
+        }
+        for comment in comments_serializer.data
+    ]
+
+    return {
+        "post": post_serializer.data,
+        "comments": filtered_comments,
+        "comment_count": post.comment_count,
+    }
+
+
+def set_validators(response, etag, last_modified):
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(last_modified)
+    # Clients may keep the page but must revalidate it on every poll
+    patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+def not_modified(request, etag, last_modified):
+    """
+    A 304 response when the client's If-None-Match / If-Modified-Since
+    still match, None when the page has to be sent.
+    """
+    # The headers of the 304 are copied from `response`, which is returned
+    # as is when no precondition applies
+    response = set_validators(HttpResponse(), etag, last_modified)
+    conditional = get_conditional_response(
+        request, etag=etag, last_modified=last_modified, response=response
+    )
+    return None if conditional is response else conditional
+
+
 class GetPostWithCommentsView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_scope = "feed"
+    message = "Posts and comments  retrieved successfully"
 
     def get(self, request):
+        cursor = request.query_params.get("cursor")
 
         try:
-            # Retrieve all posts and prefetch related comments
-            posts = Post.objects.prefetch_related("comments").all()
-
-            # Prepare the response data
-            response_data = []
-
-            for post in posts:
-                # Serialize the post
-                post_serializer = PostSerializer(post)
-
-                # Serialize the comments
-                comments_serializer = CommentSerializer(post.comments.all(), many=True)
-
-                filtered_comments = [
-                    {
-                        "content": comment["content"],
-                        "post": comment["post"],
-                        "user": comment["user"],
-                    }
-                    for comment in comments_serializer.data
-                ]
-
-                # Append post and its comments to the response data
-                response_data.append(
-                    {"post": post_serializer.data, "comments": filtered_comments}
-                )
+            page_size = get_page_size(request.query_params.get("page_size"))
+            comments_limit = get_comments_limit(
+                request.query_params.get("comments_limit")
+            )
+            # Only the fields the feed emits are fetched, as plain rows
+            posts = feed_posts()
 
+            if request.query_params.get("stream") in ("1", "true"):
+                return self.stream(keyset_queryset(posts, cursor), comments_limit)
+
+            # Checked before any query or serialization
+            etag, last_modified = feed_cache.get_validators(
+                cursor, page_size, comments_limit
+            )
+            response = not_modified(request, etag, last_modified)
+            if response is not None:
+                return response
+
+            # The feed is the same for every user, so pages are shared
+            payload = feed_cache.get_page(
+                cursor,
+                page_size,
+                comments_limit,
+                lambda: self.build_page(posts, cursor, page_size, comments_limit),
+                fmt="data",
+            )
+        except ValueError as e:
             return Response(
-                success_response(
-                    response_data, message="Posts and comments  retrieved successfully"
-                ),
-                status=status.HTTP_200_OK,
+                bad_request_response(str(e)), status=status.HTTP_400_BAD_REQUEST
             )
         except Exception as e:
             return Response(
                 error_response(str(e)), status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
+        return set_validators(
+            Response(payload, status=status.HTTP_200_OK), etag, last_modified
+        )
+
+    def build_page(self, posts, cursor, page_size, comments_limit):
+        rows, next_cursor = paginate(posts, cursor, page_size)
+        # Prepare the response data
+        response_data = serialize_feed(rows, comments_limit)
+        return paginated_response(response_data, next_cursor, message=self.message)
+
+    def stream(self, posts, comments_limit):
+        # Rows are fetched in chunks, so memory stays flat however big the table is
+        chunk_size = settings.FEED_STREAM_CHUNK_SIZE
+        rows = posts.iterator(chunk_size=chunk_size)
+        return StreamingHttpResponse(
+            stream_success_response(
+                stream_feed(rows, comments_limit, chunk_size),
+                message=self.message,
+            ),
+            content_type="application/json",
+            status=status.HTTP_200_OK,
+        )
+
+
+class SearchPostsView(APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_scope = "search"
+
+    def get(self, request):
+        query = request.query_params.get("q", "").strip()
+        if not query:
+            return Response(
+                bad_request_response("q is required"),
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        try:
+            page_size = get_page_size(request.query_params.get("page_size"))
+            offset = get_offset(request.query_params.get("cursor"))
+        except ValueError as e:
+            return Response(
+                bad_request_response(str(e)), status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Fetch one extra result to know whether there is a next page
+        results = search.search(query, page_size + 1, offset)
+        next_cursor = None
+        if len(results) > page_size:
+            results = results[:page_size]
+            next_cursor = str(offset + page_size)
+
+        return Response(
+            paginated_response(
+                results, next_cursor, message="Search results retrieved successfully"
+            ),
+            status=status.HTTP_200_OK,
+        )
+
+
+class PostChangesView(APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_scope = "feed"
+
+    def get(self, request):
+        try:
+            page_size = get_page_size(request.query_params.get("page_size"))
+            # From the primary: a lagging replica would hand out tokens past
+            # entries it has not received yet, and those would be skipped
+            with db_router.use_replicas(False):
+                items, since, has_more = changes.get_changes(
+                    request.query_params.get("since"), page_size
+                )
+        except changes.SyncTokenExpired as e:
+            return Response(
+                error_response(str(e), message="Sync token expired"),
+                status=status.HTTP_410_GONE,
+            )
+        except ValueError as e:
+            return Response(
+                bad_request_response(str(e)), status=status.HTTP_400_BAD_REQUEST
+            )
+
+        response = success_response(items, message="Changes retrieved successfully")
+        # Clients store `since` for their next sync and keep paging while
+        # `has_more` is true
+        response["since"] = since
+        response["has_more"] = has_more
+        return Response(response, status=status.HTTP_200_OK)
+
+
+class UserPostsView(APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_scope = "feed"
+
+    def get(self, request, user_id):
+        try:
+            page_size = get_page_size(request.query_params.get("page_size"))
+            comments_limit = get_comments_limit(
+                request.query_params.get("comments_limit")
+            )
+            data, next_cursor = timelines.author_page(
+                user_id, request.query_params.get("cursor"), page_size, comments_limit
+            )
+        except ValueError as e:
+            return Response(
+                bad_request_response(str(e)), status=status.HTTP_400_BAD_REQUEST
+            )
+
+        # Only an empty page needs to tell a missing user from one without posts
+        if not data and not CustomUser.objects.filter(user_id=user_id).exists():
+            return Response(
+                not_found_response("User not found"), status=status.HTTP_404_NOT_FOUND
+            )
+        return Response(
+            paginated_response(
+                data, next_cursor, message="Posts retrieved successfully"
+            ),
+            status=status.HTTP_200_OK,
+        )
+
+
+class HomeTimelineView(APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_scope = "feed"
+
+    def get(self, request):
+        try:
+            page_size = get_page_size(request.query_params.get("page_size"))
+            comments_limit = get_comments_limit(
+                request.query_params.get("comments_limit")
+            )
+            data, next_cursor = timelines.home_page(
+                request.user.pk,
+                request.query_params.get("cursor"),
+                page_size,
+                comments_limit,
+            )
+        except ValueError as e:
+            return Response(
+                bad_request_response(str(e)), status=status.HTTP_400_BAD_REQUEST
+            )
+
+        return Response(
+            paginated_response(
+                data, next_cursor, message="Timeline retrieved successfully"
+            ),
+            status=status.HTTP_200_OK,
+        )
+
+
+class FollowUserView(APIView):
+    permission_classes = [IsAuthenticated]
+    throttle_scope = "write"
+
+    def post(self, request, user_id):
+        if user_id == request.user.pk:
+            return Response(
+                bad_request_response("You cannot follow yourself"),
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not CustomUser.objects.filter(user_id=user_id, is_active=True).exists():
+            return Response(
+                not_found_response("User not found"), status=status.HTTP_404_NOT_FOUND
+            )
+
+        created = timelines.follow(request.user.pk, user_id)
+        db_router.mark_recent_write(request.user.pk)
+        return Response(
+            success_response(data=None, message="User followed successfully"),
+            status=status.HTTP_201_CREATED if created else status.HTTP_200_OK,
+        )
+
+    def delete(self, request, user_id):
+        if not timelines.unfollow(request.user.pk, user_id):
+            return Response(
+                not_found_response("You are not following this user"),
+                status=status.HTTP_404_NOT_FOUND,
+            )
+        db_router.mark_recent_write(request.user.pk)
+        return Response(
+            success_response(data=None, message="User unfollowed successfully"),
+            status=status.HTTP_204_NO_CONTENT,
+        )
+
 
 class UpdatePostView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_scope = "write"
 
     def get_object(self, pk):
         try:
-            return Post.objects.get(pk=pk)
+            return Post.objects.with_relations().get(pk=pk)
         except Post.DoesNotExist:
             return None
 
@@ -137,7 +483,7 @@ class UpdatePostView(APIView):
                 not_found_response("Post not found"), status=status.HTTP_404_NOT_FOUND
             )
 
-        if post.author != request.user:
+        if post.author_id != request.user.pk:
             return Response(
                 unauthorized_response("You are not authorized to perform this action"),
                 status=status.HTTP_403_FORBIDDEN,
@@ -149,6 +495,7 @@ class UpdatePostView(APIView):
 
         if post_serializer.is_valid():
             post_serializer.save()
+            db_router.mark_recent_write(request.user.pk)
 
             return Response(
                 success_response(post_serializer.data, message="Post Updated"),
@@ -163,21 +510,23 @@ class UpdatePostView(APIView):
 
 class DeletePostView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_scope = "write"
 
     def delete(self, request, pk):
         try:
-            post = Post.objects.get(pk=pk)
+            post = Post.objects.with_relations().get(pk=pk)
         except Post.DoesNotExist:
             return Response(
                 not_found_response("Post not found"), status=status.HTTP_404_NOT_FOUND
             )
 
-        if post.author != request.user:
+        if post.author_id != request.user.pk:
             return Response(
                 unauthorized_response("You are not authorized to perform this action"),
                 status=status.HTTP_403_FORBIDDEN,
             )
         post.delete()
+        db_router.mark_recent_write(request.user.pk)
         return Response(
             success_response(data=None, message="Post deleted successfully"),
             status=status.HTTP_204_NO_CONTENT,
@@ -186,24 +535,46 @@ class DeletePostView(APIView):
 
 class DeleteCommentView(APIView):
     permission_classes = [IsAuthenticated]
+    throttle_scope = "write"
 
     def delete(self, request, pk):
         try:
-            comment = Comment.objects.get(pk=pk)
+            comment = Comment.objects.with_relations().get(pk=pk)
         except Comment.DoesNotExist:
             return Response(
                 not_found_response("Comment not found"),
                 status=status.HTTP_404_NOT_FOUND,
             )
 
-        if comment.user != request.user:
+        if comment.user_id != request.user.pk:
             return Response(
                 unauthorized_response("You are not authorized to perform this action"),
                 status=status.HTTP_403_FORBIDDEN,
             )
 
         comment.delete()
+        db_router.mark_recent_write(request.user.pk)
         return Response(
             success_response(data=None, message="Comment deleted successfully"),
             status=status.HTTP_204_NO_CONTENT,
         )
+
+
+def metrics_view(request):
+    """
+    Request metrics of this process in the Prometheus text format. Requires
+    `Authorization: Bearer <METRICS_TOKEN>`; without a METRICS_TOKEN it is
+    only served in DEBUG.
+    """
+    token = settings.METRICS_TOKEN
+    if not token:
+        if not settings.DEBUG:
+            return HttpResponse(status=status.HTTP_404_NOT_FOUND)
+    elif not constant_time_compare(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    ):
+        return HttpResponse(status=status.HTTP_401_UNAUTHORIZED)
+    return HttpResponse(
+        metrics.registry.exposition(),
+        content_type="text/plain; version=0.0.4; charset=utf-8",
+    )